@@ -9,21 +9,57 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from backend.config import load_config
-from backend.db import init_db, set_db_path
-from backend.redis_client import init_redis, close_redis
-from backend.routers import maps, nodes, auth, teams, export
+from backend.db import init_db, init_pool, close_pool
+from backend.lock_sweeper import sweeper as lock_sweeper
+from backend.notifier import notifier
+from backend.redis_client import init_redis, close_redis, get_redis
+from backend.write_queue import init_write_queue, close_write_queue
+from backend.routers import maps, nodes, auth, teams, export, metrics
+from backend.services import snapshot_service
 from backend.ws import handler as ws_handler
+from backend.ws.actor import actors as map_actors
+from backend.ws.coalescer import coalescer
+from backend.ws.manager import manager as ws_manager
+from backend.ws.rebalancer import rebalancer as key_rebalancer
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     config = load_config("config.yaml")
     os.makedirs(os.path.dirname(config.database) or ".", exist_ok=True)
-    set_db_path(config.database)
+    await init_pool(
+        config.database,
+        size=config.db_pool_size,
+        synchronous=config.db_synchronous,
+        cache_size=config.db_cache_size,
+        mmap_size=config.db_mmap_size,
+        busy_timeout=config.db_busy_timeout,
+    )
     await init_db()
+    snapshot_service.set_snapshot_dir(config.snapshot_dir)
+    await init_write_queue(
+        batch_window_ms=config.write_batch_window_ms,
+        max_batch=config.write_batch_max,
+    )
     await init_redis(config.redis_url)
+    ws_manager.configure(config.ws_send_queue_size, config.ws_slow_consumer_policy, config.ws_replay_buffer)
+    coalescer.configure(config.edit_coalesce_window_ms)
+    if config.ws_redis_fanout:
+        await ws_manager.start(get_redis())
+    await notifier.start(get_redis())
+    lock_sweeper.interval = config.lock_sweep_interval
+    await lock_sweeper.start()
+    await key_rebalancer.start()
     yield
+    await key_rebalancer.stop()
+    await coalescer.flush_all()
+    await map_actors.stop()
+    await lock_sweeper.stop()
+    await notifier.stop()
+    await ws_manager.stop()
     await close_redis()
+    await close_write_queue()
+    await close_pool()
 
 
 def create_app() -> FastAPI:
@@ -41,6 +77,7 @@ def create_app() -> FastAPI:
     app.include_router(nodes.router)
     app.include_router(teams.router)
     app.include_router(export.router)
+    app.include_router(metrics.router)
     app.include_router(ws_handler.router)
 
     # Serve frontend build if it exists
@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -82,15 +82,12 @@ async def get_current_user(
         )
 
     from backend.db import get_db
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT id, username, email, display_name FROM users WHERE id = ?", (payload["sub"],))
         user = await cursor.fetchone()
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
         return dict(user)
-    finally:
-        await db.close()
 
 
 async def get_current_user_optional(
@@ -104,10 +101,17 @@ async def get_current_user_optional(
         return None
 
     from backend.db import get_db
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT id, username, email, display_name FROM users WHERE id = ?", (payload["sub"],))
         user = await cursor.fetchone()
         return dict(user) if user else None
-    finally:
-        await db.close()
+
+
+async def get_current_user_or_token(
+    token: str = Query(default=""),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+) -> dict:
+    """Like get_current_user but also accepts ``?token=`` (EventSource cannot set headers)."""
+    if credentials is None and token:
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return await get_current_user(credentials)
@@ -8,11 +8,34 @@ from pydantic import BaseModel
 
 class AppConfig(BaseModel):
     port: int = 8080
+    workers: int = 1
     database: str = "./data/mindmap.db"
+    # Versioned gzip snapshots served by GET /api/maps/{id}; empty disables
+    snapshot_dir: str = "./data/snapshots"
     jwt_secret: str = "CHANGE-ME-IN-PRODUCTION"
     redis_url: str = "redis://127.0.0.1:6379/0"
     access_token_expire_minutes: int = 30
     refresh_token_expire_days: int = 30
+    # SQLite connection pool and PRAGMA profile
+    db_pool_size: int = 4
+    db_synchronous: str = "NORMAL"
+    db_cache_size: int = -16000  # negative = KiB
+    db_mmap_size: int = 268435456
+    db_busy_timeout: int = 5000  # milliseconds
+    # Group commit for node mutations
+    write_batch_window_ms: float = 2.0
+    write_batch_max: int = 64
+    # Publish WebSocket room broadcasts over Redis so several workers can serve one map
+    ws_redis_fanout: bool = True
+    # Per-connection outbound queue; "disconnect" or "resync" clients that overflow it
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: str = "disconnect"
+    # Recent ops kept per room so reconnecting clients resume with ?since=
+    ws_replay_buffer: int = 256
+    # Opt-in write-behind window for typing-driven content edits; 0 disables
+    edit_coalesce_window_ms: float = 1000.0
+    # Seconds between sweeps that expire node locks and announce lock:expired
+    lock_sweep_interval: float = 1.0
 
 
 def load_config(path: str = "config.yaml") -> AppConfig:
@@ -25,11 +48,17 @@ def load_config(path: str = "config.yaml") -> AppConfig:
     # Environment variables override config file
     if os.environ.get("MINDMAP_PORT"):
         data["port"] = int(os.environ["MINDMAP_PORT"])
+    if os.environ.get("MINDMAP_WORKERS"):
+        data["workers"] = int(os.environ["MINDMAP_WORKERS"])
     if os.environ.get("MINDMAP_DATABASE"):
         data["database"] = os.environ["MINDMAP_DATABASE"]
+    if os.environ.get("MINDMAP_SNAPSHOT_DIR") is not None:
+        data["snapshot_dir"] = os.environ["MINDMAP_SNAPSHOT_DIR"]
     if os.environ.get("MINDMAP_JWT_SECRET"):
         data["jwt_secret"] = os.environ["MINDMAP_JWT_SECRET"]
     if os.environ.get("MINDMAP_REDIS_URL"):
         data["redis_url"] = os.environ["MINDMAP_REDIS_URL"]
+    if os.environ.get("MINDMAP_DB_POOL_SIZE"):
+        data["db_pool_size"] = int(os.environ["MINDMAP_DB_POOL_SIZE"])
 
     return AppConfig(**data)
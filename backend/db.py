@@ -1,26 +1,146 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 import aiosqlite
 
-_db_path: str = ""
+from backend.order_keys import spread_keys
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """A bounded pool of long-lived aiosqlite connections.
+
+    Each connection owns one background thread and is configured once with
+    the PRAGMA profile when it is opened. Callers check a connection out
+    with ``async with pool.connection() as db`` and it is returned (rolled
+    back if a transaction was left open) when the block exits.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4,
+        synchronous: str = "NORMAL",
+        cache_size: int = -16000,
+        mmap_size: int = 0,
+        busy_timeout: int = 5000,
+    ):
+        self.path = path
+        self.size = max(1, size)
+        self.pragmas = {
+            "journal_mode": "WAL",
+            "foreign_keys": "ON",
+            "synchronous": synchronous,
+            "cache_size": cache_size,
+            "mmap_size": mmap_size,
+            "busy_timeout": busy_timeout,
+        }
+        self._idle: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._connections: list[aiosqlite.Connection] = []
+        # Metrics
+        self.checkouts = 0
+        self.waiting = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.hold_time_total = 0.0
+        self.hold_time_max = 0.0
+
+    async def open_connection(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path)
+        db.row_factory = aiosqlite.Row
+        for name, value in self.pragmas.items():
+            await db.execute(f"PRAGMA {name}={value}")
+        return db
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            db = await self.open_connection()
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+        logger.info("SQLite pool opened: %s (%d connections)", self.path, self.size)
+
+    async def close(self) -> None:
+        for db in self._connections:
+            await db.close()
+        self._connections.clear()
+        self._idle = asyncio.Queue()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            db = await self._idle.get()
+        finally:
+            self.waiting -= 1
+        acquired = time.perf_counter()
+        waited = acquired - start
+        self.checkouts += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        try:
+            yield db
+        finally:
+            try:
+                if db.in_transaction:
+                    await db.rollback()
+            finally:
+                held = time.perf_counter() - acquired
+                self.hold_time_total += held
+                self.hold_time_max = max(self.hold_time_max, held)
+                self._idle.put_nowait(db)
+
+    def stats(self) -> dict:
+        checkouts = self.checkouts or 1
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "wait_ms_avg": round(self.wait_time_total / checkouts * 1000, 3),
+            "wait_ms_max": round(self.wait_time_max * 1000, 3),
+            "hold_ms_avg": round(self.hold_time_total / checkouts * 1000, 3),
+            "hold_ms_max": round(self.hold_time_max * 1000, 3),
+        }
+
+
+_pool: ConnectionPool | None = None
 
 
-def set_db_path(path: str) -> None:
-    global _db_path
-    _db_path = path
+async def init_pool(path: str, **options) -> ConnectionPool:
+    global _pool
+    pool = ConnectionPool(path, **options)
+    await pool.open()
+    _pool = pool
+    return pool
 
 
-async def get_db() -> aiosqlite.Connection:
-    db = await aiosqlite.connect(_db_path)
-    db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
-    await db.execute("PRAGMA foreign_keys=ON")
-    return db
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Database pool not initialized. Call init_pool() first.")
+    return _pool
+
+
+def get_db():
+    """Check out a pooled connection: ``async with get_db() as db: ...``"""
+    return get_pool().connection()
 
 
 async def init_db() -> None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.executescript(
             """
             CREATE TABLE IF NOT EXISTS maps (
@@ -39,6 +159,7 @@ async def init_db() -> None:
                 parent_id   TEXT REFERENCES nodes(id) ON DELETE CASCADE,
                 content     TEXT NOT NULL DEFAULT '',
                 position    INTEGER NOT NULL DEFAULT 0,
+                order_key   TEXT,
                 style       TEXT DEFAULT '{}',
                 collapsed   BOOLEAN DEFAULT 0,
                 version     INTEGER NOT NULL DEFAULT 0,
@@ -173,6 +294,35 @@ async def init_db() -> None:
             await db.execute("ALTER TABLE nodes ADD COLUMN last_edited_at DATETIME")
         except Exception:
             pass
+        # Migrate: sibling order moves from position to order_key
+        try:
+            await db.execute("ALTER TABLE nodes ADD COLUMN order_key TEXT")
+        except Exception:
+            pass
+        await db.executescript(
+            """
+            DROP INDEX IF EXISTS idx_nodes_map_position;
+            DROP INDEX IF EXISTS idx_nodes_map_parent;
+            CREATE INDEX IF NOT EXISTS idx_nodes_map_order ON nodes(map_id, order_key);
+            CREATE INDEX IF NOT EXISTS idx_nodes_map_parent_order ON nodes(map_id, parent_id, order_key);
+            """
+        )
+        await _backfill_order_keys(db)
         await db.commit()
-    finally:
-        await db.close()
+
+
+async def _backfill_order_keys(db) -> None:
+    """Give every sibling list that has nodes without an order_key fresh keys in position order."""
+    cursor = await db.execute("SELECT DISTINCT map_id, parent_id FROM nodes WHERE order_key IS NULL")
+    groups = await cursor.fetchall()
+    updates = []
+    for map_id, parent_id in groups:
+        cursor = await db.execute(
+            "SELECT id FROM nodes WHERE map_id = ? AND parent_id IS ? ORDER BY position, rowid",
+            (map_id, parent_id),
+        )
+        ids = [row["id"] for row in await cursor.fetchall()]
+        updates.extend(zip(spread_keys(len(ids)), ids))
+    if updates:
+        await db.executemany("UPDATE nodes SET order_key = ? WHERE id = ?", updates)
+        logger.info("Assigned order keys to %d nodes in %d sibling lists", len(updates), len(groups))
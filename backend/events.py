@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Event names
+ACCESS_CHANGED = "access:changed"
+MAP_CHANGED = "map:changed"      # a node mutation committed a new map version
+REMOTE_MAP_CHANGED = "map:changed:remote"  # another worker committed a new map version
+LOCKS_CHANGED = "locks:changed"  # a node lock was acquired, released or expired
+
+_listeners: dict[str, list[Callable[..., Any]]] = defaultdict(list)
+
+
+def subscribe(event: str, listener: Callable[..., Any]) -> None:
+    """Register ``listener(**payload)`` for an in-process event. May be sync or async."""
+    _listeners[event].append(listener)
+
+
+def unsubscribe(event: str, listener: Callable[..., Any]) -> None:
+    try:
+        _listeners[event].remove(listener)
+    except ValueError:
+        pass
+
+
+async def emit(event: str, **payload: Any) -> None:
+    for listener in list(_listeners.get(event, ())):
+        try:
+            result = listener(**payload)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception("Listener for %s failed", event)
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from backend.services import node_service
+
+logger = logging.getLogger(__name__)
+
+
+class LockSweeper:
+    """Background task that expires node locks once their TTL has passed.
+
+    Each tick runs one atomic sweep over the global ``locks:due`` set, which
+    announces every expiry (``lock:expired`` to the map's room) exactly once
+    even when several workers sweep.
+    """
+
+    def __init__(self, interval: float = 1.0, batch: int = 100):
+        self.interval = interval
+        self.batch = batch
+        self.expired = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="lock-sweeper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                count = await node_service.expire_due_locks(self.batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lock sweep failed")
+                count = 0
+            self.expired += count
+            # A full batch means more may be due; sweep again right away
+            if count < self.batch:
+                await asyncio.sleep(self.interval)
+
+
+sweeper = LockSweeper()
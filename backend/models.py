@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import sys
+from array import array
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
+from typing import Iterable, Iterator
 
 
 @dataclass
@@ -22,6 +25,7 @@ class Node:
     parent_id: str | None = None
     content: str = ""
     position: int = 0
+    order_key: str | None = None
     style: str = "{}"
     collapsed: bool = False
     created_at: str = ""
@@ -31,3 +35,226 @@ class Node:
         d = asdict(self)
         d["collapsed"] = bool(d["collapsed"])
         return d
+
+
+NO_PARENT = -1
+
+
+class NodeTree:
+    """Compact tree of a map's nodes, stored as parallel columns.
+
+    Every node gets an integer slot: ``ids[slot]`` is its (interned) id,
+    ``parent`` is a typed array, ``order_key[slot]`` the sibling order key
+    and ``children[slot]`` a list of child slots, or None for leaves. ``content`` is kept only when
+    asked for (exports). Freed slots are reused. Nodes whose parent is not
+    in the tree are kept as roots and listed in ``orphans``.
+    """
+
+    __slots__ = ("version", "ids", "parent", "order_key", "children", "content", "orphans", "_index", "_free")
+
+    def __init__(self, version: int = 0, with_content: bool = False):
+        self.version = version
+        self.ids: list[str | None] = []
+        self.parent = array("q")
+        self.order_key: list[str | None] = []
+        self.children: list[list[int] | None] = []
+        self.content: list[str] | None = [] if with_content else None
+        self.orphans: set[str] = set()
+        self._index: dict[str, int] = {}
+        self._free: list[int] = []
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, version: int = 0, with_content: bool = False) -> NodeTree:
+        """Build from rows of (id, parent_id, order_key[, content]) or mappings with those keys."""
+        tree = cls(version, with_content)
+        parents = []
+        for row in rows:
+            if isinstance(row, dict):
+                node_id, parent_id, order_key = row["id"], row["parent_id"], row["order_key"]
+                content = row.get("content") if with_content else None
+            else:
+                node_id, parent_id, order_key = row[0], row[1], row[2]
+                content = row[3] if with_content else None
+            tree._alloc(node_id, order_key, content)
+            parents.append(parent_id)
+        for slot, parent_id in enumerate(parents):
+            if parent_id is not None:
+                tree._link(slot, parent_id)
+        return tree
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._index
+
+    def slot(self, node_id: str) -> int | None:
+        return self._index.get(node_id)
+
+    def parent_id(self, node_id: str) -> str | None:
+        parent = self.parent[self._index[node_id]]
+        return None if parent == NO_PARENT else self.ids[parent]
+
+    def order_key_of(self, node_id: str) -> str | None:
+        return self.order_key[self._index[node_id]]
+
+    def child_ids(self, node_id: str) -> list[str]:
+        """Children of ``node_id`` in order key order."""
+        return [self.ids[s] for s in self._sorted_children(self._index[node_id])]
+
+    def roots(self) -> list[int]:
+        """Slots of nodes without a parent (the map root), in slot order."""
+        return [
+            slot for slot, node_id in enumerate(self.ids)
+            if node_id is not None and self.parent[slot] == NO_PARENT and node_id not in self.orphans
+        ]
+
+    def upsert(self, node_id: str, parent_id: str | None, order_key: str | None, content: str | None = None) -> None:
+        """Add a node or move/update an existing one. The parent must already be present."""
+        slot = self._index.get(node_id)
+        if slot is None:
+            slot = self._alloc(node_id, order_key, content)
+        else:
+            self.order_key[slot] = order_key and sys.intern(order_key)
+            if self.content is not None and content is not None:
+                self.content[slot] = content
+            old = self.parent[slot]
+            if old != NO_PARENT:
+                if self.ids[old] == parent_id:
+                    return
+                self._unlink(slot)
+        if parent_id is not None:
+            self._link(slot, parent_id)
+
+    def upsert_many(self, rows: Iterable[tuple]) -> None:
+        """Upsert (id, parent_id, order_key) rows in an order where parents come first."""
+        pending = list(rows)
+        while pending:
+            ids = {row[0] for row in pending}
+            ready = [row for row in pending if row[1] is None or row[1] in self._index or row[1] not in ids]
+            if not ready:
+                # A cycle among the rows themselves; apply them as they are
+                ready = pending
+            for row in ready:
+                self.upsert(*row)
+            ready_ids = {row[0] for row in ready}
+            pending = [row for row in pending if row[0] not in ready_ids]
+
+    def remove(self, node_id: str) -> None:
+        """Drop a node and everything under it."""
+        slot = self._index.get(node_id)
+        if slot is None:
+            return
+        if self.parent[slot] != NO_PARENT:
+            self._unlink(slot)
+        for s in self._subtree(slot):
+            del self._index[self.ids[s]]
+            self.orphans.discard(self.ids[s])
+            self.ids[s] = None
+            self.children[s] = None
+            self.parent[s] = NO_PARENT
+            self.order_key[s] = None
+            if self.content is not None:
+                self.content[s] = None
+            self._free.append(s)
+
+    def subtree(self, node_id: str) -> list[str]:
+        """Ids of ``node_id`` and its descendants, parents before children."""
+        slot = self._index.get(node_id)
+        if slot is None:
+            return []
+        return [self.ids[s] for s in self._subtree(slot)]
+
+    def is_ancestor(self, ancestor_id: str, node_id: str | None) -> bool:
+        """True if ``ancestor_id`` is ``node_id`` or one of its ancestors."""
+        target = self._index.get(ancestor_id)
+        slot = self._index.get(node_id) if node_id is not None else None
+        if target is None or slot is None:
+            return False
+        while slot != NO_PARENT:
+            if slot == target:
+                return True
+            slot = self.parent[slot]
+        return False
+
+    def walk(self, slot: int, max_depth: int | None = None) -> Iterator[tuple[int, int]]:
+        """Yield (slot, depth) depth-first from ``slot``, children in order key order."""
+        stack = [(slot, 0)]
+        while stack:
+            slot, depth = stack.pop()
+            yield slot, depth
+            if max_depth is not None and depth >= max_depth:
+                continue
+            kids = self._sorted_children(slot)
+            stack.extend((child, depth + 1) for child in reversed(kids))
+
+    def memory(self) -> int:
+        """Approximate bytes held, including the id and content strings."""
+        size = sys.getsizeof(self.ids) + sys.getsizeof(self._index) + sys.getsizeof(self.children)
+        size += self.parent.buffer_info()[1] * self.parent.itemsize
+        size += sys.getsizeof(self.order_key)
+        size += sum(sys.getsizeof(k) for k in set(self.order_key) if k is not None)
+        size += sum(sys.getsizeof(node_id) for node_id in self._index)
+        size += sum(sys.getsizeof(kids) for kids in self.children if kids is not None)
+        if self.content is not None:
+            size += sys.getsizeof(self.content)
+            size += sum(sys.getsizeof(c) for c in self.content if c is not None)
+        return size
+
+    def _alloc(self, node_id: str, order_key: str | None, content: str | None) -> int:
+        node_id = sys.intern(node_id)
+        # Keys repeat across sibling lists, so share them too
+        order_key = order_key and sys.intern(order_key)
+        if self._free:
+            slot = self._free.pop()
+            self.ids[slot] = node_id
+            self.parent[slot] = NO_PARENT
+            self.order_key[slot] = order_key
+            if self.content is not None:
+                self.content[slot] = content
+        else:
+            slot = len(self.ids)
+            self.ids.append(node_id)
+            self.parent.append(NO_PARENT)
+            self.order_key.append(order_key)
+            self.children.append(None)
+            if self.content is not None:
+                self.content.append(content)
+        self._index[node_id] = slot
+        return slot
+
+    def _link(self, slot: int, parent_id: str) -> None:
+        parent = self._index.get(parent_id)
+        if parent is None:
+            self.orphans.add(self.ids[slot])
+            return
+        self.orphans.discard(self.ids[slot])
+        self.parent[slot] = parent
+        kids = self.children[parent]
+        if kids is None:
+            self.children[parent] = [slot]
+        else:
+            kids.append(slot)
+
+    def _unlink(self, slot: int) -> None:
+        parent = self.parent[slot]
+        kids = self.children[parent]
+        kids.remove(slot)
+        if not kids:
+            self.children[parent] = None
+        self.parent[slot] = NO_PARENT
+
+    def _sorted_children(self, slot: int) -> list[int]:
+        kids = self.children[slot]
+        if not kids:
+            return []
+        order_key = self.order_key
+        return sorted(kids, key=lambda s: order_key[s] or "")
+
+    def _subtree(self, slot: int) -> list[int]:
+        slots = [slot]
+        i = 0
+        while i < len(slots):
+            slots.extend(self.children[slots[i]] or ())
+            i += 1
+        return slots
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+
+from backend import events
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = "sync:changed"
+
+# Change notices waiting for the publisher task before new ones are dropped
+PUBLISH_QUEUE_SIZE = 10000
+
+
+class ChangeNotifier:
+    """Wakes parked /sync long-polls and SSE streams when a map changes.
+
+    Fed by map:changed and locks:changed events from the mutation path, and
+    relayed over one Redis channel so waiters on other workers wake too.
+    Access changes wake the affected map (or every map, for team-wide
+    changes) so open SSE streams re-check permissions. Node changes from
+    other workers are re-emitted locally as map:changed:remote. Publishing
+    is left to a background task, so the mutation path never waits on Redis.
+    """
+
+    def __init__(self):
+        self._events: dict[str, asyncio.Event] = {}
+        self.worker_id = uuid.uuid4().hex
+        self._redis = None
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+        self._outbox: asyncio.Queue[str | None] | None = None
+        self._publisher: asyncio.Task | None = None
+        self.dropped_publishes = 0
+
+    async def start(self, redis) -> None:
+        self._redis = redis
+        self._pubsub = redis.pubsub()
+        await self._pubsub.subscribe(CHANGES_CHANNEL)
+        self._listener = asyncio.create_task(self._listen(), name="sync-notifier")
+        self._outbox = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._publisher = asyncio.create_task(self._publish_loop(self._outbox), name="sync-notifier-publisher")
+
+    async def stop(self) -> None:
+        if self._publisher is not None:
+            # Let queued notices go out before Redis is closed
+            try:
+                self._outbox.put_nowait(None)
+            except asyncio.QueueFull:
+                self._publisher.cancel()
+            try:
+                await asyncio.wait_for(self._publisher, 5.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+            self._publisher = None
+            self._outbox = None
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._redis = None
+
+    def watch(self, map_id: str) -> asyncio.Event:
+        """Return the event set on the next change to ``map_id``.
+
+        Take it *before* reading the current state so a change that lands
+        in between is not missed.
+        """
+        event = self._events.get(map_id)
+        if event is None:
+            event = self._events[map_id] = asyncio.Event()
+        return event
+
+    def wake(self, map_id: str | None) -> None:
+        if map_id is None:
+            waiting, self._events = self._events, {}
+            for event in waiting.values():
+                event.set()
+            return
+        event = self._events.pop(map_id, None)
+        if event is not None:
+            event.set()
+
+    @property
+    def waiting_maps(self) -> int:
+        return len(self._events)
+
+    async def on_change(self, map_id: str | None = None, result: dict | None = None, **_) -> None:
+        self.wake(map_id)
+        if self._outbox is not None:
+            data = {"origin": self.worker_id, "map_id": map_id}
+            if result is not None:
+                data["version"] = result.get("version")
+            try:
+                self._outbox.put_nowait(json.dumps(data))
+            except asyncio.QueueFull:
+                self.dropped_publishes += 1
+                logger.warning("Change notice queue full, dropping change for map %s", map_id)
+
+    async def _publish_loop(self, outbox: asyncio.Queue) -> None:
+        while True:
+            payload = await outbox.get()
+            if payload is None:
+                return
+            try:
+                await self._redis.publish(CHANGES_CHANNEL, payload)
+            except Exception:
+                logger.exception("Failed to publish change notice")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Change notifier listener error")
+                await asyncio.sleep(1.0)
+                continue
+            if not msg or msg.get("type") != "message":
+                continue
+            try:
+                data = json.loads(msg["data"])
+            except ValueError:
+                continue
+            if data.get("origin") != self.worker_id:
+                self.wake(data.get("map_id"))
+                if "version" in data:
+                    await events.emit(events.REMOTE_MAP_CHANGED, map_id=data["map_id"], version=data["version"])
+
+
+notifier = ChangeNotifier()
+events.subscribe(events.MAP_CHANGED, notifier.on_change)
+events.subscribe(events.LOCKS_CHANGED, notifier.on_change)
+events.subscribe(events.ACCESS_CHANGED, notifier.on_change)
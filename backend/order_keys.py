@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import re
+
+# Base-62 digits in ASCII order, so keys compare correctly as plain strings
+# (and with SQLite's default BINARY collation)
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+_BASE = len(DIGITS)
+_VALUE = {d: i for i, d in enumerate(DIGITS)}
+
+# Generated keys longer than this get their sibling list rebalanced
+MAX_KEY_LENGTH = 16
+
+# A valid key: digits only, never empty or ending in the lowest digit,
+# which leaves room below and between any two keys
+_KEY_RE = re.compile(r"[0-9A-Za-z]{0,63}[1-9A-Za-z]")
+
+
+def is_valid_key(key: object) -> bool:
+    return isinstance(key, str) and _KEY_RE.fullmatch(key) is not None
+
+
+def key_between(before: str | None, after: str | None) -> str:
+    """A key that sorts strictly between ``before`` and ``after``.
+
+    None stands for the start or end of the list. Keys are base-62
+    fractions: "V" is a half, "k" about two thirds, "V8" a bit over a half.
+    Appending or prepending grows the key by one digit every few calls.
+    """
+    before = before or ""
+    if after is not None and before >= after:
+        raise ValueError(f"{before!r} does not sort before {after!r}")
+    return _midpoint(before, after)
+
+
+def _midpoint(a: str, b: str | None) -> str:
+    if b is not None:
+        # Keep the common prefix, reading a missing digit of ``a`` as "0"
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    low = _VALUE[a[0]] if a else 0
+    if b is None and a and low < _BASE - 1:
+        return DIGITS[low + 1]
+    high = _VALUE[b[0]] if b is not None else _BASE
+    if high - low > 1:
+        return DIGITS[(low + high + 1) // 2]
+    # Adjacent first digits
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[low] + _midpoint(a[1:], None)
+
+
+def spread_keys(count: int) -> list[str]:
+    """``count`` increasing keys spaced evenly over the whole key range."""
+    if count <= 0:
+        return []
+    # Enough digits for twice as many keys, so each gap fits more inserts
+    length, span = 1, _BASE
+    while span <= 2 * count:
+        length += 1
+        span *= _BASE
+    keys = []
+    for i in range(1, count + 1):
+        value = i * span // (count + 1)
+        digits = []
+        for _ in range(length):
+            value, d = divmod(value, _BASE)
+            digits.append(DIGITS[d])
+        keys.append("".join(reversed(digits)).rstrip("0"))
+    return keys
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Encode ``content`` exactly as JSONResponse would, using orjson when installed.
+
+    For str/int/bool/None/list/dict content the two encoders produce the same
+    bytes. They differ only in float exponent formatting (``1e-05`` vs
+    ``0.00001``), so payloads with floats should keep using JSONResponse.
+    Anything orjson rejects (e.g. non-str keys, ints beyond 64 bits) falls
+    back to the stdlib encoder.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            pass
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered through ``dumps``.
+
+    Endpoints serving large node lists return it directly, which also skips
+    FastAPI's jsonable_encoder pass over plain dicts/lists from the services.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
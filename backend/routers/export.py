@@ -50,26 +50,27 @@ async def export_map(map_id: str, format: str, user: dict = Depends(get_current_
         raise HTTPException(status_code=403, detail="Access denied")
 
     try:
-        map_data = await map_service.get_map_with_nodes(map_id)
+        map_data = await map_service.get_map_tree(map_id)
     except Exception:
         logger.exception("Failed to fetch map data: map_id=%s", map_id)
         raise
     if not map_data:
         logger.warning("Map not found: map_id=%s", map_id)
         raise HTTPException(status_code=404, detail="Map not found")
+    map_name, tree = map_data
 
-    logger.info("Exporting map '%s' (%d nodes) as %s", map_data["name"], len(map_data["nodes"]), format)
+    logger.info("Exporting map '%s' (%d nodes) as %s", map_name, len(tree), format)
 
     fmt = EXPORT_FORMATS[format]
     try:
-        buf = fmt["fn"](map_data["name"], map_data["nodes"])
+        buf = fmt["fn"](map_name, tree)
     except Exception:
         logger.exception("Export generation failed: map_id=%s, format=%s, map_name='%s', nodes_count=%d",
-                         map_id, format, map_data["name"], len(map_data["nodes"]))
+                         map_id, format, map_name, len(tree))
         raise HTTPException(status_code=500, detail=f"Failed to generate {format} file")
 
     # Use RFC 5987 encoding for non-ASCII filenames
-    raw_filename = f"{map_data['name']}{fmt['ext']}"
+    raw_filename = f"{map_name}{fmt['ext']}"
     encoded_filename = quote(raw_filename)
     content_disposition = f"attachment; filename*=UTF-8''{encoded_filename}"
 
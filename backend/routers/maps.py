@@ -2,16 +2,26 @@ from __future__ import annotations
 
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import gzip
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from backend.auth import get_current_user
+from backend.auth import get_current_user, get_current_user_or_token
+from backend.notifier import notifier
+from backend.responses import FastJSONResponse
 from backend.services import map_service
 from backend.services import permission_service
 from backend.services import node_service
 
 router = APIRouter(prefix="/api/maps", tags=["maps"])
 
+MAX_SYNC_WAIT = 30.0  # seconds a /sync long-poll may be parked
+SSE_KEEPALIVE = 15.0
+
 
 class CreateMapRequest(BaseModel):
     name: str
@@ -24,7 +34,7 @@ class ClaimMapRequest(BaseModel):
 
 @router.get("")
 async def list_maps(user: dict = Depends(get_current_user)):
-    return await map_service.list_maps(user["id"])
+    return FastJSONResponse(await map_service.list_maps(user["id"]))
 
 
 @router.post("", status_code=201)
@@ -36,24 +46,198 @@ async def create_map(req: CreateMapRequest, user: dict = Depends(get_current_use
     return await map_service.create_map(req.name, owner_id=user["id"], team_id=req.team_id)
 
 
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [t.strip() for t in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """Whether Accept-Encoding allows gzip, honouring q-values (``gzip;q=0`` refuses it)."""
+    qualities = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    q = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0)))
+    return q > 0
+
+
 @router.get("/{map_id}")
-async def get_map(map_id: str, user: dict = Depends(get_current_user)):
+async def get_map(
+    map_id: str,
+    request: Request,
+    depth: Optional[int] = Query(None, ge=0),
+    visible: bool = False,
+    user: dict = Depends(get_current_user),
+):
+    """The whole map, or with ``depth`` / ``visible`` only the top levels and
+    the nodes not hidden under a collapsed node (see ``truncated``)."""
     if not await permission_service.check_map_access(user["id"], map_id, "view"):
         raise HTTPException(status_code=403, detail="Access denied")
-    result = await map_service.get_map_with_nodes(map_id)
-    if not result:
+    version = await map_service.get_map_version(map_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Map not found")
-    return result
+    if depth is not None or visible:
+        etag = f'"map-{map_id}-{version}-{depth}-{int(visible)}"'
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        result = await map_service.get_map_partial(map_id, depth=depth, visible_only=visible)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Map not found")
+        headers = {"ETag": etag} if result["version"] == version else None
+        return FastJSONResponse(result, headers=headers)
+    # The gzip and identity bodies differ, so each gets its own strong tag
+    use_gzip = _accepts_gzip(request)
+    etag = f'"map-{map_id}-{version}-gz"' if use_gzip else f'"map-{map_id}-{version}"'
+    headers = {"Vary": "Accept-Encoding"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+    snapshot = await map_service.get_map_snapshot(map_id, version)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Map not found")
+    snapshot_version, body = snapshot
+    if snapshot_version == version:
+        headers["ETag"] = etag
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = gzip.decompress(body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def _sync_state(map_id: str) -> tuple[int | None, int]:
+    version = await map_service.get_map_version(map_id)
+    lock_generation = await node_service.get_lock_generation(map_id) if version is not None else 0
+    return version, lock_generation
 
 
 @router.get("/{map_id}/sync")
-async def sync_map(map_id: str, since: int = 0, user: dict = Depends(get_current_user)):
+async def sync_map(
+    map_id: str,
+    request: Request,
+    since: int = 0,
+    wait: float = 0,
+    user: dict = Depends(get_current_user),
+):
+    """Changes since ``since``. With ``wait`` (seconds, capped at MAX_SYNC_WAIT)
+    the request is parked until the map version moves past ``since`` or lock
+    state changes, then answered with the same payload."""
     if not await permission_service.check_map_access(user["id"], map_id, "view"):
         raise HTTPException(status_code=403, detail="Access denied")
+    changed = notifier.watch(map_id)
+    version, lock_generation = await _sync_state(map_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Map not found")
+    etag = f'"sync-{map_id}-{since}-{version}-{lock_generation}"'
+
+    # Only park a client that is up to date; a stale ETag means it has not
+    # seen the current lock state yet, so answer right away.
+    if wait > 0 and version <= since and (_etag_matches(request, etag) or not request.headers.get("if-none-match")):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(wait, MAX_SYNC_WAIT)
+        start_generation = lock_generation
+        while version <= since and lock_generation == start_generation:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+            changed = notifier.watch(map_id)
+            version, lock_generation = await _sync_state(map_id)
+            if version is None:
+                raise HTTPException(status_code=404, detail="Map not found")
+        etag = f'"sync-{map_id}-{since}-{version}-{lock_generation}"'
+
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     result = await map_service.get_sync(map_id, since)
     if result is None:
         raise HTTPException(status_code=404, detail="Map not found")
-    return result
+    headers = {"ETag": etag} if result["version"] == version else None
+    return FastJSONResponse(result, headers=headers)
+
+
+@router.get("/{map_id}/events")
+async def map_events(
+    map_id: str,
+    request: Request,
+    since: int = 0,
+    user: dict = Depends(get_current_user_or_token),
+):
+    """Server-Sent Events stream of /sync deltas.
+
+    Each frame carries the map version as its ``id`` so a reconnecting
+    EventSource resumes from ``Last-Event-ID``. Access is re-checked on every
+    wake; the stream ends when it is revoked or the map is deleted.
+    """
+    if not await permission_service.check_map_access(user["id"], map_id, "view"):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if await map_service.get_map_version(map_id) is None:
+        raise HTTPException(status_code=404, detail="Map not found")
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def stream():
+        nonlocal since
+        lock_generation = None
+        loop = asyncio.get_running_loop()
+        woken = False
+        while True:
+            changed = notifier.watch(map_id)
+            version, generation = await _sync_state(map_id)
+            if version is None:
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            if woken and not await permission_service.check_map_access(user["id"], map_id, "view"):
+                yield "event: revoked\ndata: {}\n\n"
+                return
+            woken = True
+            if version > since or generation != lock_generation:
+                result = await map_service.get_sync(map_id, since)
+                if result is None:
+                    return
+                since = result["version"]
+                lock_generation = generation
+                data = json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+                yield f"id: {since}\nevent: sync\ndata: {data}\n\n"
+            deadline = loop.time() + SSE_KEEPALIVE
+            # One waiter per change, polled in short slices so a closed
+            # connection is noticed promptly
+            waiter = asyncio.ensure_future(changed.wait())
+            try:
+                while not waiter.done():
+                    if await request.is_disconnected():
+                        return
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        yield ": keepalive\n\n"
+                        deadline = loop.time() + SSE_KEEPALIVE
+                        continue
+                    await asyncio.wait((waiter,), timeout=min(remaining, 1.0))
+            finally:
+                waiter.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.delete("/{map_id}", status_code=204)
@@ -80,4 +264,4 @@ async def claim_map(map_id: str, user: dict = Depends(get_current_user)):
 async def get_map_history(map_id: str, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "view"):
         raise HTTPException(status_code=403, detail="Access denied")
-    return await node_service.get_map_history(map_id)
+    return FastJSONResponse(await node_service.get_map_history(map_id))
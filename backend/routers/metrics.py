@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends
+
+from backend.auth import get_current_user
+from backend.db import get_pool
+from backend.tree_cache import tree_cache
+from backend.write_queue import get_write_queue
+from backend.ws.actor import actors
+from backend.ws.coalescer import coalescer
+from backend.ws.manager import manager
+from backend.ws.rebalancer import rebalancer
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics(user: dict = Depends(get_current_user)):
+    write_queue = get_write_queue()
+    return {
+        "db_pool": get_pool().stats(),
+        "write_queue": write_queue.stats() if write_queue else None,
+        "websocket": manager.stats(),
+        "edit_coalescer": coalescer.stats(),
+        "map_actors": actors.stats(),
+        "tree_cache": tree_cache.stats(),
+        "key_rebalancer": rebalancer.stats(),
+    }
@@ -2,11 +2,15 @@ from __future__ import annotations
 
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 
 from backend.auth import get_current_user
-from backend.services import node_service, permission_service
+from backend.order_keys import is_valid_key
+from backend.responses import FastJSONResponse
+from backend.services import map_service, node_service, permission_service
+from backend.ws.actor import actors
+from backend.ws.manager import manager
 
 router = APIRouter(prefix="/api/maps/{map_id}/nodes", tags=["nodes"])
 
@@ -15,13 +19,27 @@ class CreateNodeRequest(BaseModel):
     parent_id: str
     content: str = ""
     position: int = 0
+    order_key: Optional[str] = None
     style: str = "{}"
     id: Optional[str] = None
 
 
+class NodeBatchRequest(BaseModel):
+    ops: list[dict]
+
+
+class ReorderRequest(BaseModel):
+    ordered_ids: list[str]
+
+
+class BatchLockRequest(BaseModel):
+    node_ids: list[str]
+
+
 class UpdateNodeRequest(BaseModel):
     content: Optional[str] = None
     position: Optional[int] = None
+    order_key: Optional[str] = None
     style: Optional[str] = None
     collapsed: Optional[bool] = None
     parent_id: Optional[str] = None
@@ -31,7 +49,9 @@ class UpdateNodeRequest(BaseModel):
 async def create_node(map_id: str, req: CreateNodeRequest, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "edit"):
         raise HTTPException(status_code=403, detail="No edit access")
-    result = await node_service.create_node(
+    if req.order_key is not None and not is_valid_key(req.order_key):
+        raise HTTPException(status_code=400, detail="Invalid order_key")
+    result = await actors.run(map_id, lambda: node_service.create_node(
         map_id=map_id,
         parent_id=req.parent_id,
         content=req.content,
@@ -40,12 +60,43 @@ async def create_node(map_id: str, req: CreateNodeRequest, user: dict = Depends(
         node_id=req.id,
         user_id=user["id"],
         username=user.get("username", ""),
-    )
+        order_key=req.order_key,
+    ))
     if result is None:
         raise HTTPException(status_code=404, detail="Parent node not found in this map")
     return result
 
 
+@router.post(":batch")
+async def batch_nodes(map_id: str, req: NodeBatchRequest, user: dict = Depends(get_current_user)):
+    """Apply create/update/move/delete ops atomically under one version."""
+    if not await permission_service.check_map_access(user["id"], map_id, "edit"):
+        raise HTTPException(status_code=403, detail="No edit access")
+    if not req.ops or len(req.ops) > node_service.MAX_NODE_BATCH:
+        raise HTTPException(status_code=400, detail=f"ops must contain 1 to {node_service.MAX_NODE_BATCH} operations")
+
+    async def apply() -> dict:
+        result = await node_service.apply_batch(map_id, req.ops, user_id=user["id"], username=user.get("username", ""))
+        if "version" in result:
+            message = {"type": "node:batch", "version": result["version"]}
+            await manager.broadcast(
+                map_id,
+                {**message, "data": {"results": node_service.batch_deltas(result["results"])}},
+                full={**message, "data": {"results": result["results"]}},
+            )
+        return result
+
+    result = await actors.run(map_id, apply)
+    if result.get("lock_conflict"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"{result['locked_by']} 正在编辑该节点，请等待操作结束后再进行操作",
+        )
+    if "error" in result:
+        raise HTTPException(status_code=400, detail={"message": result["error"], "index": result["index"]})
+    return result
+
+
 @router.put("/{node_id}")
 async def update_node(map_id: str, node_id: str, req: UpdateNodeRequest, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "edit"):
@@ -53,7 +104,11 @@ async def update_node(map_id: str, node_id: str, req: UpdateNodeRequest, user: d
     changes = {k: v for k, v in req.model_dump().items() if v is not None}
     if not changes:
         raise HTTPException(status_code=400, detail="No valid fields to update")
-    result = await node_service.update_node(map_id, node_id, changes, user_id=user["id"], username=user.get("username", ""))
+    if "order_key" in changes and not is_valid_key(changes["order_key"]):
+        raise HTTPException(status_code=400, detail="Invalid order_key")
+    result = await actors.run(map_id, lambda: node_service.update_node(
+        map_id, node_id, changes, user_id=user["id"], username=user.get("username", ""),
+    ))
     if not result:
         raise HTTPException(status_code=404, detail="Node not found")
     if isinstance(result, dict) and result.get("lock_conflict"):
@@ -68,7 +123,9 @@ async def update_node(map_id: str, node_id: str, req: UpdateNodeRequest, user: d
 async def delete_node(map_id: str, node_id: str, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "edit"):
         raise HTTPException(status_code=403, detail="No edit access")
-    result = await node_service.delete_node(map_id, node_id, user_id=user["id"], username=user.get("username", ""))
+    result = await actors.run(map_id, lambda: node_service.delete_node(
+        map_id, node_id, user_id=user["id"], username=user.get("username", ""),
+    ))
     if not result:
         raise HTTPException(status_code=404, detail="Node not found")
     if isinstance(result, dict) and result.get("lock_conflict"):
@@ -79,13 +136,59 @@ async def delete_node(map_id: str, node_id: str, user: dict = Depends(get_curren
     return result
 
 
+@router.post("/{node_id}/children:reorder")
+async def reorder_children(map_id: str, node_id: str, req: ReorderRequest, user: dict = Depends(get_current_user)):
+    """Rewrite the order of all of a node's children under one version."""
+    if not await permission_service.check_map_access(user["id"], map_id, "edit"):
+        raise HTTPException(status_code=403, detail="No edit access")
+    if not req.ordered_ids or len(req.ordered_ids) > node_service.MAX_REORDER:
+        raise HTTPException(status_code=400, detail=f"ordered_ids must contain 1 to {node_service.MAX_REORDER} nodes")
+
+    async def apply() -> dict | None:
+        result = await node_service.reorder_children(
+            map_id, node_id, req.ordered_ids, user_id=user["id"], username=user.get("username", ""),
+        )
+        if result and "version" in result:
+            await manager.broadcast(map_id, {
+                "type": "node:reorder",
+                "data": node_service.reorder_delta(result),
+                "version": result["version"],
+            })
+        return result
+
+    result = await actors.run(map_id, apply)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    if result.get("lock_conflict"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"{result['locked_by']} 正在编辑该节点，请等待操作结束后再进行操作",
+        )
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
+@router.get("/{node_id}/children")
+async def get_node_children(
+    map_id: str, node_id: str, depth: int = Query(1, ge=1), user: dict = Depends(get_current_user),
+):
+    """Descendants of a node down to ``depth`` levels, for expanding a lazily loaded map."""
+    if not await permission_service.check_map_access(user["id"], map_id, "view"):
+        raise HTTPException(status_code=403, detail="Access denied")
+    result = await map_service.get_node_children(map_id, node_id, depth)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return FastJSONResponse(result)
+
+
 @router.get("/{node_id}/history")
 async def get_node_history(map_id: str, node_id: str, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "view"):
         raise HTTPException(status_code=403, detail="Access denied")
     if not await node_service.node_belongs_to_map(node_id, map_id):
         raise HTTPException(status_code=404, detail="Node not found")
-    return await node_service.get_node_history(node_id)
+    return FastJSONResponse(await node_service.get_node_history(node_id))
 
 
 @router.post("/{node_id}/history/{history_id}/rollback")
@@ -94,18 +197,86 @@ async def rollback_node_history(
 ):
     if not await permission_service.check_map_access(user["id"], map_id, "edit"):
         raise HTTPException(status_code=403, detail="No edit access")
-    result = await node_service.rollback_to_history(
-        history_id=history_id,
-        map_id=map_id,
-        user_id=user["id"],
-        username=user.get("username", ""),
-        expected_node_id=node_id,
-    )
+
+    async def apply() -> dict:
+        result = await node_service.rollback_to_history(
+            history_id=history_id,
+            map_id=map_id,
+            user_id=user["id"],
+            username=user.get("username", ""),
+            expected_node_id=node_id,
+        )
+        if "error" not in result:
+            await _broadcast_rollback(map_id, result)
+        return result
+
+    result = await actors.run(map_id, apply)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
 
 
+async def _broadcast_rollback(map_id: str, result: dict) -> None:
+    """Tell the map's WebSocket room about a rollback as one event."""
+    action = result.get("action")
+    full = None
+    if action == "delete_reversed":
+        message = {
+            "type": "node:restore",
+            "data": {"parent_id": result["parent_id"], "nodes": result["restored"]},
+            "version": result["version"],
+        }
+    elif action == "update_reversed":
+        node = result["node"]
+        message = {
+            "type": "node:update",
+            "data": node_service.node_delta(node, ("content", "parent_id", "position", "order_key")),
+            "version": node["version"],
+        }
+        full = {**message, "data": node}
+    elif action == "reorder_reversed":
+        message = {
+            "type": "node:reorder",
+            "data": node_service.reorder_delta(result),
+            "version": result["version"],
+        }
+    elif action == "create_reversed":
+        deleted = result["result"]
+        message = {
+            "type": "node:delete",
+            "data": {"id": deleted["deleted_ids"][0], "deleted_ids": deleted["deleted_ids"]},
+            "version": deleted["version"],
+        }
+    else:
+        return
+    await manager.broadcast(map_id, message, full=full)
+
+
+@router.post("/locks:acquire")
+async def lock_nodes(map_id: str, req: BatchLockRequest, user: dict = Depends(get_current_user)):
+    """Lock all of ``node_ids`` or none; 409 lists the nodes held by others."""
+    if not await permission_service.check_map_access(user["id"], map_id, "edit"):
+        raise HTTPException(status_code=403, detail="No edit access")
+    if len(req.node_ids) > node_service.MAX_LOCK_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {node_service.MAX_LOCK_BATCH} nodes per request")
+    if await node_service.missing_nodes(map_id, req.node_ids):
+        raise HTTPException(status_code=404, detail="Node not found")
+    result = await node_service.acquire_locks(req.node_ids, map_id, user["id"], user.get("username", ""))
+    if not result["locked"]:
+        raise HTTPException(status_code=409, detail={"conflicts": result["conflicts"]})
+    return result
+
+
+@router.post("/locks:release")
+async def unlock_nodes(map_id: str, req: BatchLockRequest, user: dict = Depends(get_current_user)):
+    if not await permission_service.check_map_access(user["id"], map_id, "edit"):
+        raise HTTPException(status_code=403, detail="No edit access")
+    if len(req.node_ids) > node_service.MAX_LOCK_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {node_service.MAX_LOCK_BATCH} nodes per request")
+    released = await node_service.release_locks(req.node_ids, map_id, user["id"])
+    return {"status": "ok", "released": released}
+
+
 @router.post("/{node_id}/lock")
 async def lock_node(map_id: str, node_id: str, user: dict = Depends(get_current_user)):
     if not await permission_service.check_map_access(user["id"], map_id, "edit"):
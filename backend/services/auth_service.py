@@ -15,8 +15,7 @@ async def register_user(username: str, email: str, password: str, display_name:
     if not display_name:
         display_name = username
 
-    db = await get_db()
-    try:
+    async with get_db() as db:
         # Check uniqueness
         cursor = await db.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email))
         existing = await cursor.fetchone()
@@ -34,13 +33,10 @@ async def register_user(username: str, email: str, password: str, display_name:
             "email": email,
             "display_name": display_name,
         }
-    finally:
-        await db.close()
 
 
 async def authenticate_user(username: str, password: str) -> dict | None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT id, username, email, password_hash, display_name FROM users WHERE username = ?",
             (username,),
@@ -56,22 +52,17 @@ async def authenticate_user(username: str, password: str) -> dict | None:
             "email": user["email"],
             "display_name": user["display_name"],
         }
-    finally:
-        await db.close()
 
 
 async def store_refresh_token(user_id: str, token: str, expires_at: datetime) -> None:
     token_id = str(uuid.uuid4())
     token_hash = hashlib.sha256(token.encode()).hexdigest()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute(
             "INSERT INTO refresh_tokens (id, user_id, token_hash, expires_at) VALUES (?, ?, ?, ?)",
             (token_id, user_id, token_hash, expires_at.isoformat()),
         )
         await db.commit()
-    finally:
-        await db.close()
 
 
 async def validate_refresh_token(token: str) -> dict | None:
@@ -80,8 +71,7 @@ async def validate_refresh_token(token: str) -> dict | None:
         return None
 
     token_hash = hashlib.sha256(token.encode()).hexdigest()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT rt.id, rt.user_id, u.username, u.email, u.display_name FROM refresh_tokens rt JOIN users u ON rt.user_id = u.id WHERE rt.token_hash = ? AND rt.expires_at > ?",
             (token_hash, datetime.now(timezone.utc).isoformat()),
@@ -96,24 +86,16 @@ async def validate_refresh_token(token: str) -> dict | None:
             "email": row["email"],
             "display_name": row["display_name"],
         }
-    finally:
-        await db.close()
 
 
 async def revoke_refresh_token(token: str) -> None:
     token_hash = hashlib.sha256(token.encode()).hexdigest()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute("DELETE FROM refresh_tokens WHERE token_hash = ?", (token_hash,))
         await db.commit()
-    finally:
-        await db.close()
 
 
 async def revoke_all_refresh_tokens(user_id: str) -> None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute("DELETE FROM refresh_tokens WHERE user_id = ?", (user_id,))
         await db.commit()
-    finally:
-        await db.close()
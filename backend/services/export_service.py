@@ -6,42 +6,25 @@ import zipfile
 from io import BytesIO
 from typing import Any
 
+from backend.models import NodeTree
+
 logger = logging.getLogger(__name__)
 
 
-def _build_tree(nodes: list[dict]) -> dict | None:
-    """Build a tree from a flat node list. Returns the root node with 'children' populated."""
-    logger.debug("Building tree from %d nodes", len(nodes))
-    node_map: dict[str, dict] = {}
-    root = None
-    for n in nodes:
-        node_map[n["id"]] = {**n, "children": []}
-    for n in nodes:
-        if n["parent_id"] is None:
-            root = node_map[n["id"]]
-        else:
-            parent = node_map.get(n["parent_id"])
-            if parent:
-                parent["children"].append(node_map[n["id"]])
-            else:
-                logger.warning("Orphan node: id=%s, parent_id=%s not found", n["id"], n["parent_id"])
-    # Sort children by position
-    if root:
-        _sort_children(root)
-        logger.debug("Tree built successfully, root='%s'", root.get("content", ""))
-    else:
+def _root(tree: NodeTree) -> int | None:
+    """Slot of the map's root node, logging orphans whose parent is missing."""
+    logger.debug("Exporting tree of %d nodes", len(tree))
+    for node_id in tree.orphans:
+        logger.warning("Orphan node: id=%s, parent not found", node_id)
+    roots = tree.roots()
+    if not roots:
         logger.warning("No root node found (no node with parent_id=NULL)")
-    return root
-
+        return None
+    return roots[0]
 
-def _sort_children(node: dict) -> None:
-    node["children"].sort(key=lambda c: c.get("position", 0))
-    for child in node["children"]:
-        _sort_children(child)
 
-
-def export_docx(map_name: str, nodes: list[dict]) -> BytesIO:
-    logger.info("Generating DOCX: map_name='%s', nodes=%d", map_name, len(nodes))
+def export_docx(map_name: str, tree: NodeTree) -> BytesIO:
+    logger.info("Generating DOCX: map_name='%s', nodes=%d", map_name, len(tree))
     try:
         from docx import Document
         from docx.shared import Pt, Inches
@@ -50,8 +33,8 @@ def export_docx(map_name: str, nodes: list[dict]) -> BytesIO:
         raise
 
     doc = Document()
-    root = _build_tree(nodes)
-    if not root:
+    root = _root(tree)
+    if root is None:
         logger.warning("No root node, creating empty document with title only")
         doc.add_heading(map_name, level=1)
         buf = BytesIO()
@@ -59,24 +42,23 @@ def export_docx(map_name: str, nodes: list[dict]) -> BytesIO:
         buf.seek(0)
         return buf
 
-    doc.add_heading(root["content"] or map_name, level=1)
-
-    def _add_nodes(node: dict, level: int) -> None:
-        for child in node["children"]:
-            content = child["content"] or ""
-            if level <= 8:
-                # Heading levels 2-9
-                doc.add_heading(content, level=level)
-            else:
-                # For deep nesting, use indented paragraphs
-                indent = level - 9
-                p = doc.add_paragraph(content)
-                p.paragraph_format.left_indent = Inches(0.3 * indent)
-                p.paragraph_format.space_before = Pt(2)
-                p.paragraph_format.space_after = Pt(2)
-            _add_nodes(child, level + 1)
-
-    _add_nodes(root, 2)
+    doc.add_heading(tree.content[root] or map_name, level=1)
+
+    for slot, depth in tree.walk(root):
+        if depth == 0:
+            continue
+        level = depth + 1
+        content = tree.content[slot] or ""
+        if level <= 8:
+            # Heading levels 2-9
+            doc.add_heading(content, level=level)
+        else:
+            # For deep nesting, use indented paragraphs
+            indent = level - 9
+            p = doc.add_paragraph(content)
+            p.paragraph_format.left_indent = Inches(0.3 * indent)
+            p.paragraph_format.space_before = Pt(2)
+            p.paragraph_format.space_after = Pt(2)
 
     buf = BytesIO()
     doc.save(buf)
@@ -85,8 +67,8 @@ def export_docx(map_name: str, nodes: list[dict]) -> BytesIO:
     return buf
 
 
-def export_xlsx(map_name: str, nodes: list[dict]) -> BytesIO:
-    logger.info("Generating XLSX: map_name='%s', nodes=%d", map_name, len(nodes))
+def export_xlsx(map_name: str, tree: NodeTree) -> BytesIO:
+    logger.info("Generating XLSX: map_name='%s', nodes=%d", map_name, len(tree))
     try:
         from openpyxl import Workbook
         from openpyxl.styles import Font, Alignment
@@ -103,31 +85,21 @@ def export_xlsx(map_name: str, nodes: list[dict]) -> BytesIO:
     for cell in ws[1]:
         cell.font = Font(bold=True)
 
-    root = _build_tree(nodes)
-    if not root:
+    root = _root(tree)
+    if root is None:
         logger.warning("No root node, creating empty spreadsheet with headers only")
         buf = BytesIO()
         wb.save(buf)
         buf.seek(0)
         return buf
 
-    # Build parent content lookup
-    parent_map: dict[str | None, str] = {}
-    for n in nodes:
-        parent_map[n["id"]] = n["content"] or ""
-
     row_count = 0
-
-    def _add_rows(node: dict, level: int, parent_content: str) -> None:
-        nonlocal row_count
-        content = node["content"] or ""
+    for slot, level in tree.walk(root):
+        content = tree.content[slot] or ""
+        parent_content = (tree.content[tree.parent[slot]] or "") if level > 0 else ""
         indent = "  " * level
-        ws.append([level, f"{indent}{content}", parent_content if level > 0 else ""])
+        ws.append([level, f"{indent}{content}", parent_content])
         row_count += 1
-        for child in node["children"]:
-            _add_rows(child, level + 1, content)
-
-    _add_rows(root, 0, "")
 
     # Auto-adjust column widths
     ws.column_dimensions["A"].width = 8
@@ -141,23 +113,23 @@ def export_xlsx(map_name: str, nodes: list[dict]) -> BytesIO:
     return buf
 
 
-def export_xmind(map_name: str, nodes: list[dict]) -> BytesIO:
+def export_xmind(map_name: str, tree: NodeTree) -> BytesIO:
     """Export as XMind 8+ format (.xmind is a ZIP containing content.json and metadata.json)."""
-    logger.info("Generating XMind: map_name='%s', nodes=%d", map_name, len(nodes))
-    root = _build_tree(nodes)
-
-    def _build_topic(node: dict) -> dict[str, Any]:
-        topic: dict[str, Any] = {
-            "id": node["id"],
-            "title": node["content"] or "",
-        }
-        if node["children"]:
-            topic["children"] = {
-                "attached": [_build_topic(c) for c in node["children"]]
-            }
-        return topic
-
-    root_topic = _build_topic(root) if root else {"id": "root", "title": map_name}
+    logger.info("Generating XMind: map_name='%s', nodes=%d", map_name, len(tree))
+    root = _root(tree)
+
+    root_topic: dict[str, Any] = {"id": "root", "title": map_name}
+    if root is not None:
+        # Pre-order walk; topics[depth] is the latest topic at that depth
+        topics: list[dict[str, Any]] = []
+        for slot, depth in tree.walk(root):
+            topic = {"id": tree.ids[slot], "title": tree.content[slot] or ""}
+            del topics[depth:]
+            if topics:
+                parent = topics[-1]
+                parent.setdefault("children", {"attached": []})["attached"].append(topic)
+            topics.append(topic)
+        root_topic = topics[0]
 
     content = [
         {
@@ -3,14 +3,17 @@ from __future__ import annotations
 import uuid
 from datetime import datetime, timezone
 
+from backend import events
 from backend.db import get_db
+from backend.models import NodeTree
+from backend.order_keys import key_between
+from backend.services import snapshot_service
 from backend.services.node_service import get_locks_for_map
 
 
 async def list_maps(user_id: str) -> list[dict]:
     """List maps accessible to the user: owned, team-accessible, and legacy (owner_id=NULL)."""
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             """SELECT DISTINCT m.* FROM maps m
                LEFT JOIN team_members tm ON m.team_id = tm.team_id AND tm.user_id = ?
@@ -22,23 +25,20 @@ async def list_maps(user_id: str) -> list[dict]:
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def create_map(name: str, owner_id: str | None = None, team_id: str | None = None) -> dict:
     map_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute(
             "INSERT INTO maps (id, name, version, owner_id, team_id, created_at, updated_at) VALUES (?, ?, 0, ?, ?, ?, ?)",
             (map_id, name, owner_id, team_id, now, now),
         )
         root_id = str(uuid.uuid4())
         await db.execute(
-            "INSERT INTO nodes (id, map_id, parent_id, content, position, version, created_at, updated_at) VALUES (?, ?, NULL, ?, 0, 0, ?, ?)",
-            (root_id, map_id, name, now, now),
+            "INSERT INTO nodes (id, map_id, parent_id, content, position, order_key, version, created_at, updated_at) VALUES (?, ?, NULL, ?, 0, ?, 0, ?, ?)",
+            (root_id, map_id, name, key_between(None, None), now, now),
         )
         await db.commit()
         return {
@@ -51,13 +51,12 @@ async def create_map(name: str, owner_id: str | None = None, team_id: str | None
             "updated_at": now,
             "root_id": root_id,
         }
-    finally:
-        await db.close()
 
 
 async def get_map_with_nodes(map_id: str) -> dict | None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
+        # One read transaction so the nodes match the version we report
+        await db.execute("BEGIN")
         cursor = await db.execute("SELECT * FROM maps WHERE id = ?", (map_id,))
         row = await cursor.fetchone()
         if not row:
@@ -65,7 +64,7 @@ async def get_map_with_nodes(map_id: str) -> dict | None:
         map_data = dict(row)
 
         cursor = await db.execute(
-            "SELECT * FROM nodes WHERE map_id = ? ORDER BY position",
+            "SELECT * FROM nodes WHERE map_id = ? ORDER BY order_key",
             (map_id,),
         )
         nodes = [dict(r) for r in await cursor.fetchall()]
@@ -73,14 +72,133 @@ async def get_map_with_nodes(map_id: str) -> dict | None:
             n["collapsed"] = bool(n["collapsed"])
         map_data["nodes"] = nodes
         return map_data
-    finally:
-        await db.close()
+
+
+async def _fetch_levels(
+    db, map_id: str, start: str, params: tuple, depth: int | None, visible_only: bool,
+) -> tuple[list[dict], list[str]]:
+    """Nodes matched by ``start`` plus descendants down to ``depth`` levels.
+
+    With ``visible_only`` the walk does not descend below collapsed nodes.
+    Returns the rows in sibling (order_key) order and the ids of returned nodes whose
+    children were left out. Each level is one lookup on (map_id, parent_id).
+    """
+    stop = []
+    if depth is not None:
+        stop.append(f"s.depth < {int(depth)}")
+    if visible_only:
+        stop.append("s.collapsed = 0")
+    descend = f"WHERE {' AND '.join(stop)}" if stop else ""
+    frontier = " OR ".join(f"NOT ({c})" for c in stop) or "0"
+    cursor = await db.execute(
+        f"""WITH RECURSIVE sub AS (
+               SELECT nodes.*, 0 AS depth FROM nodes WHERE {start}
+               UNION ALL
+               SELECT n.*, s.depth + 1 FROM nodes n JOIN sub s ON n.map_id = s.map_id AND n.parent_id = s.id
+               {descend}
+           )
+           SELECT s.*, ({frontier}) AND EXISTS (
+               SELECT 1 FROM nodes c WHERE c.map_id = s.map_id AND c.parent_id = s.id
+           ) AS truncated
+           FROM sub s ORDER BY s.order_key""",
+        params,
+    )
+    nodes, truncated = [], []
+    for r in await cursor.fetchall():
+        d = dict(r)
+        del d["depth"]
+        if d.pop("truncated"):
+            truncated.append(d["id"])
+        d["collapsed"] = bool(d["collapsed"])
+        nodes.append(d)
+    return nodes, truncated
+
+
+async def get_map_partial(map_id: str, depth: int | None = None, visible_only: bool = False) -> dict | None:
+    """The map with only its top ``depth`` levels and/or the nodes not hidden
+    under a collapsed node; ``truncated`` lists nodes whose children were left out."""
+    async with get_db() as db:
+        await db.execute("BEGIN")
+        cursor = await db.execute("SELECT * FROM maps WHERE id = ?", (map_id,))
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        map_data = dict(row)
+        map_data["nodes"], map_data["truncated"] = await _fetch_levels(
+            db, map_id, "map_id = ? AND parent_id IS NULL", (map_id,), depth, visible_only,
+        )
+        return map_data
+
+
+async def get_node_children(map_id: str, node_id: str, depth: int = 1) -> dict | None:
+    """Descendants of ``node_id`` down to ``depth`` levels, for expanding on demand."""
+    async with get_db() as db:
+        await db.execute("BEGIN")
+        cursor = await db.execute("SELECT version FROM maps WHERE id = ?", (map_id,))
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        nodes, truncated = await _fetch_levels(
+            db, map_id, "map_id = ? AND id = ?", (map_id, node_id), depth, False,
+        )
+    if not nodes:
+        return None
+    return {
+        "version": row["version"],
+        "node_id": node_id,
+        "nodes": [n for n in nodes if n["id"] != node_id],
+        "truncated": truncated,
+    }
+
+
+async def get_map_tree(map_id: str) -> tuple[str, NodeTree] | None:
+    """Return (map name, NodeTree with content) without building per-node dicts."""
+    async with get_db() as db:
+        await db.execute("BEGIN")
+        cursor = await db.execute("SELECT name, version FROM maps WHERE id = ?", (map_id,))
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        cursor = await db.execute(
+            "SELECT id, parent_id, order_key, content FROM nodes WHERE map_id = ? ORDER BY order_key",
+            (map_id,),
+        )
+        tree = NodeTree.from_rows(await cursor.fetchall(), row["version"], with_content=True)
+        return row["name"], tree
+
+
+async def get_map_version(map_id: str) -> int | None:
+    async with get_db() as db:
+        cursor = await db.execute("SELECT version FROM maps WHERE id = ?", (map_id,))
+        row = await cursor.fetchone()
+        return row["version"] if row else None
+
+
+async def get_map_snapshot(map_id: str, version: int | None = None) -> tuple[int, bytes] | None:
+    """Return ``(version, body)``: the map with all nodes as gzip-compressed JSON.
+
+    Served from the stored snapshot when it matches the current
+    ``maps.version`` (looked up unless passed in); otherwise rebuilt from
+    SQLite and stored for the next reader. A rebuild reads the latest rows,
+    so the returned version can be newer than the one passed in.
+    """
+    if version is None:
+        version = await get_map_version(map_id)
+    if version is None:
+        return None
+    cached = await snapshot_service.load(map_id, version)
+    if cached is not None:
+        return version, cached
+    map_data = await get_map_with_nodes(map_id)
+    if map_data is None:
+        return None
+    body = await snapshot_service.store(map_id, map_data["version"], snapshot_service.encode(map_data))
+    return map_data["version"], body
 
 
 async def get_sync(map_id: str, since_version: int) -> dict | None:
     """Return changes since a given version, or full data if since_version is 0."""
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT id, version FROM maps WHERE id = ?", (map_id,))
         row = await cursor.fetchone()
         if not row:
@@ -94,7 +212,7 @@ async def get_sync(map_id: str, since_version: int) -> dict | None:
 
         # Get change log entries since the requested version
         cursor = await db.execute(
-            "SELECT action, node_id FROM change_log WHERE map_id = ? AND version > ? ORDER BY version",
+            "SELECT action, node_id FROM change_log WHERE map_id = ? AND version > ? ORDER BY version, id",
             (map_id, since_version),
         )
         log_entries = await cursor.fetchall()
@@ -128,25 +246,23 @@ async def get_sync(map_id: str, since_version: int) -> dict | None:
             "deleted": list(deleted_ids),
             "locks": await get_locks_for_map(map_id),
         }
-    finally:
-        await db.close()
 
 
 async def delete_map(map_id: str) -> bool:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute("DELETE FROM change_log WHERE map_id = ?", (map_id,))
         cursor = await db.execute("DELETE FROM maps WHERE id = ?", (map_id,))
         await db.commit()
-        return cursor.rowcount > 0
-    finally:
-        await db.close()
+        deleted = cursor.rowcount > 0
+    if deleted:
+        await snapshot_service.invalidate(map_id)
+        await events.emit(events.ACCESS_CHANGED, map_id=map_id)
+    return deleted
 
 
 async def claim_map(map_id: str, user_id: str) -> dict | None | bool:
     """Claim a legacy map. Returns map dict on success, None if not found, False if already owned."""
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT * FROM maps WHERE id = ?", (map_id,))
         row = await cursor.fetchone()
         if not row:
@@ -154,14 +270,15 @@ async def claim_map(map_id: str, user_id: str) -> dict | None | bool:
         if row["owner_id"] is not None:
             return False
         now = datetime.now(timezone.utc).isoformat()
+        # owner_id is part of the snapshot, so bump the version its ETag is built from
         await db.execute(
-            "UPDATE maps SET owner_id = ?, updated_at = ? WHERE id = ?",
+            "UPDATE maps SET owner_id = ?, version = version + 1, updated_at = ? WHERE id = ?",
             (user_id, now, map_id),
         )
         await db.commit()
         result = dict(row)
         result["owner_id"] = user_id
+        result["version"] = row["version"] + 1
         result["updated_at"] = now
-        return result
-    finally:
-        await db.close()
+    await events.emit(events.ACCESS_CHANGED, map_id=map_id)
+    return result
@@ -1,25 +1,49 @@
 from __future__ import annotations
 
 import json
+import sqlite3
+import time
 import uuid
 from datetime import datetime, timezone
 
+from backend import events
 from backend.db import get_db
+from backend.order_keys import MAX_KEY_LENGTH, is_valid_key, key_between, spread_keys
 from backend.redis_client import get_redis
+from backend.tree_cache import tree_cache
+from backend.write_queue import run_write
 
 LOCK_TTL = 300  # 5 minutes in seconds
+MAX_LOCK_BATCH = 500  # nodes per batch lock/unlock request
 
 
 async def node_belongs_to_map(node_id: str, map_id: str) -> bool:
-    db = await get_db()
-    try:
+    tree = tree_cache.get(map_id)
+    if tree is not None:
+        return node_id in tree
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT 1 FROM nodes WHERE id = ? AND map_id = ?",
             (node_id, map_id),
         )
         return await cursor.fetchone() is not None
-    finally:
-        await db.close()
+
+
+async def missing_nodes(map_id: str, node_ids: list[str]) -> list[str]:
+    """Return the ids in ``node_ids`` that are not nodes of ``map_id``."""
+    if not node_ids:
+        return []
+    tree = tree_cache.get(map_id)
+    if tree is not None:
+        return [node_id for node_id in node_ids if node_id not in tree]
+    async with get_db() as db:
+        placeholders = ",".join("?" for _ in node_ids)
+        cursor = await db.execute(
+            f"SELECT id FROM nodes WHERE map_id = ? AND id IN ({placeholders})",
+            (map_id, *node_ids),
+        )
+        found = {row["id"] for row in await cursor.fetchall()}
+    return [node_id for node_id in node_ids if node_id not in found]
 
 
 async def _bump_version(db, map_id: str) -> int:
@@ -33,6 +57,105 @@ async def _bump_version(db, map_id: str) -> int:
     return row["version"]
 
 
+_HISTORY_INSERT = """INSERT INTO node_history
+    (node_id, map_id, user_id, username, action,
+     old_content, new_content, old_parent_id, new_parent_id,
+     old_position, new_position, snapshot, map_version, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+class _Rejected(Exception):
+    """Raised inside a write job to undo its version bump; the write returns None."""
+
+
+async def _write(map_id: str, job) -> dict | None:
+    """Run a node mutation through the write queue and announce the new version."""
+    try:
+        result = await run_write(job)
+    except _Rejected:
+        return None
+    if result and not result.get("lock_conflict") and not result.get("error"):
+        await events.emit(events.MAP_CHANGED, map_id=map_id, result=result)
+    return result
+
+
+def _current_tree(map_id: str, ver: int):
+    """The map's hot tree if it holds every write before version ``ver``."""
+    tree = tree_cache.get(map_id)
+    return tree if tree is not None and tree.version == ver - 1 else None
+
+
+async def _node_exists(db, map_id: str, node_id: str, tree=None) -> bool:
+    if tree is not None:
+        return node_id in tree
+    cursor = await db.execute(
+        "SELECT 1 FROM nodes WHERE id = ? AND map_id = ?",
+        (node_id, map_id),
+    )
+    return await cursor.fetchone() is not None
+
+
+async def _is_ancestor(db, ancestor_id: str, node_id: str, tree=None) -> bool:
+    """True if ``ancestor_id`` is ``node_id`` or one of its ancestors."""
+    if tree is not None:
+        return tree.is_ancestor(ancestor_id, node_id)
+    cursor = await db.execute(
+        """WITH RECURSIVE ancestors(id) AS (
+               SELECT ?
+               UNION ALL
+               SELECT n.parent_id FROM nodes n JOIN ancestors a ON n.id = a.id
+               WHERE n.parent_id IS NOT NULL
+           )
+           SELECT 1 FROM ancestors WHERE id = ? LIMIT 1""",
+        (node_id, ancestor_id),
+    )
+    return await cursor.fetchone() is not None
+
+
+# Sibling lists (map_id, parent_id) that were handed an over-long order key
+_crowded: set[tuple[str, str]] = set()
+
+
+def take_crowded() -> list[tuple[str, str]]:
+    """Sibling lists that need a rebalance since the last call."""
+    crowded = list(_crowded)
+    _crowded.clear()
+    return crowded
+
+
+async def _sibling_key(
+    db, map_id: str, parent_id: str, position: int, node_id: str, current: str | None = None,
+) -> str:
+    """Order key that puts ``node_id`` before the first sibling at or after ``position``.
+
+    ``current`` is kept if it already sorts there, so clients that renumber
+    positions do not rewrite keys. Both lookups use (map_id, parent_id, order_key).
+    """
+    cursor = await db.execute(
+        """SELECT MIN(order_key) FROM nodes
+           WHERE map_id = ? AND parent_id = ? AND position >= ? AND id != ?""",
+        (map_id, parent_id, position, node_id),
+    )
+    after = (await cursor.fetchone())[0]
+    if after is None:
+        cursor = await db.execute(
+            "SELECT MAX(order_key) FROM nodes WHERE map_id = ? AND parent_id = ? AND id != ?",
+            (map_id, parent_id, node_id),
+        )
+    else:
+        cursor = await db.execute(
+            "SELECT MAX(order_key) FROM nodes WHERE map_id = ? AND parent_id = ? AND id != ? AND order_key < ?",
+            (map_id, parent_id, node_id, after),
+        )
+    before = (await cursor.fetchone())[0]
+    if current is not None and (before is None or before < current) and (after is None or current < after):
+        return current
+    key = key_between(before, after)
+    if len(key) > MAX_KEY_LENGTH:
+        _crowded.add((map_id, parent_id))
+    return key
+
+
 async def _record_history(
     db,
     node_id: str,
@@ -51,17 +174,79 @@ async def _record_history(
 ) -> None:
     now = datetime.now(timezone.utc).isoformat()
     await db.execute(
-        """INSERT INTO node_history
-           (node_id, map_id, user_id, username, action,
-            old_content, new_content, old_parent_id, new_parent_id,
-            old_position, new_position, snapshot, map_version, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        _HISTORY_INSERT,
         (node_id, map_id, user_id, username or '', action,
          old_content, new_content, old_parent_id, new_parent_id,
          old_position, new_position, snapshot, map_version, now),
     )
 
 
+async def _insert_node(
+    db,
+    map_id: str,
+    parent_id: str,
+    content: str = "",
+    position: int = 0,
+    style: str = "{}",
+    node_id: str | None = None,
+    user_id: str | None = None,
+    username: str | None = None,
+    ver: int | None = None,
+    order_key: str | None = None,
+) -> dict | None:
+    """Insert a node under ``parent_id``; bumps the version unless ``ver`` is given.
+
+    Without an ``order_key`` one is derived from ``position``.
+    """
+    node_id = node_id or str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    tree = None
+    bumped = ver is None
+    if bumped:
+        ver = await _bump_version(db, map_id)
+        tree = _current_tree(map_id, ver)
+    # Parent node must belong to this map, otherwise reject cross-map writes.
+    if not await _node_exists(db, map_id, parent_id, tree):
+        if bumped:
+            raise _Rejected
+        return None
+    if order_key is None:
+        order_key = await _sibling_key(db, map_id, parent_id, position, node_id)
+
+    await db.execute(
+        """INSERT INTO nodes (id, map_id, parent_id, content, position, order_key, style, version,
+           last_edited_by, last_edited_by_name, last_edited_at, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (node_id, map_id, parent_id, content, position, order_key, style, ver,
+         user_id, username or '', now, now, now),
+    )
+    await db.execute(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'create', ?)",
+        (map_id, ver, node_id),
+    )
+    await _record_history(
+        db, node_id, map_id, 'create', ver,
+        user_id=user_id, username=username,
+        new_content=content, new_parent_id=parent_id, new_position=position,
+    )
+    return {
+        "id": node_id,
+        "map_id": map_id,
+        "parent_id": parent_id,
+        "content": content,
+        "position": position,
+        "order_key": order_key,
+        "style": style,
+        "collapsed": False,
+        "version": ver,
+        "last_edited_by": user_id,
+        "last_edited_by_name": username or '',
+        "last_edited_at": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
 async def create_node(
     map_id: str,
     parent_id: str,
@@ -71,54 +256,127 @@ async def create_node(
     node_id: str | None = None,
     user_id: str | None = None,
     username: str | None = None,
+    order_key: str | None = None,
 ) -> dict | None:
     node_id = node_id or str(uuid.uuid4())
+    return await _write(map_id, lambda db: _insert_node(
+        db, map_id, parent_id, content, position, style, node_id, user_id, username, order_key=order_key,
+    ))
+
+
+_UPDATABLE_FIELDS = {"content", "position", "order_key", "style", "collapsed", "parent_id"}
+
+
+async def _apply_update(
+    db,
+    map_id: str,
+    node_id: str,
+    updates: dict,
+    user_id: str | None = None,
+    username: str | None = None,
+    ver: int | None = None,
+) -> dict | None:
+    """Update a node's fields; bumps the version unless ``ver`` is given."""
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
-        # Parent node must belong to this map, otherwise reject cross-map writes.
-        cursor = await db.execute(
-            "SELECT 1 FROM nodes WHERE id = ? AND map_id = ?",
-            (parent_id, map_id),
-        )
-        if await cursor.fetchone() is None:
-            return None
+    # Get current state before update
+    cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
+    row = await cursor.fetchone()
+    if not row:
+        return None
+    old_node = dict(row)
 
+    tree = None
+    bumped = ver is None
+    if bumped:
         ver = await _bump_version(db, map_id)
-        await db.execute(
-            """INSERT INTO nodes (id, map_id, parent_id, content, position, style, version,
-               last_edited_by, last_edited_by_name, last_edited_at, created_at, updated_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (node_id, map_id, parent_id, content, position, style, ver,
-             user_id, username or '', now, now, now),
-        )
-        await db.execute(
-            "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'create', ?)",
-            (map_id, ver, node_id),
-        )
-        await _record_history(
-            db, node_id, map_id, 'create', ver,
-            user_id=user_id, username=username,
-            new_content=content, new_parent_id=parent_id, new_position=position,
+        tree = _current_tree(map_id, ver)
+    # New parent (if provided) must remain in the same map and not be the
+    # node itself or one of its descendants.
+    new_parent = updates.get("parent_id")
+    if new_parent is not None and new_parent != old_node["parent_id"]:
+        if (not await _node_exists(db, map_id, new_parent, tree)
+                or await _is_ancestor(db, node_id, new_parent, tree)):
+            if bumped:
+                raise _Rejected
+            return None
+    fields = dict(updates)
+    parent_id = updates.get("parent_id", old_node["parent_id"])
+    if "order_key" not in updates and ("position" in updates or "parent_id" in updates) and parent_id:
+        key = await _sibling_key(
+            db, map_id, parent_id, updates.get("position", old_node["position"]), node_id,
+            current=old_node["order_key"] if parent_id == old_node["parent_id"] else None,
         )
-        await db.commit()
-        return {
-            "id": node_id,
-            "map_id": map_id,
-            "parent_id": parent_id,
-            "content": content,
-            "position": position,
-            "style": style,
-            "collapsed": False,
-            "version": ver,
-            "last_edited_by": user_id,
-            "last_edited_by_name": username or '',
-            "last_edited_at": now,
-            "created_at": now,
-            "updated_at": now,
-        }
-    finally:
-        await db.close()
+        if key != old_node["order_key"]:
+            fields["order_key"] = key
+    fields["updated_at"] = now
+    fields["version"] = ver
+    if user_id:
+        fields["last_edited_by"] = user_id
+        fields["last_edited_by_name"] = username or ''
+        fields["last_edited_at"] = now
+
+    set_clause = ", ".join(f"{k} = ?" for k in fields)
+    values = list(fields.values()) + [node_id, map_id]
+    await db.execute(f"UPDATE nodes SET {set_clause} WHERE id = ? AND map_id = ?", values)
+    await db.execute(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'update', ?)",
+        (map_id, ver, node_id),
+    )
+
+    # Record history
+    await _record_history(
+        db, node_id, map_id, 'update', ver,
+        user_id=user_id, username=username,
+        old_content=old_node.get("content"),
+        new_content=updates.get("content", old_node.get("content")),
+        old_parent_id=old_node.get("parent_id"),
+        new_parent_id=updates.get("parent_id", old_node.get("parent_id")),
+        old_position=old_node.get("position"),
+        new_position=updates.get("position", old_node.get("position")),
+    )
+
+    # The new row is the old one plus what was just written; no re-read needed
+    node = {**old_node, **fields}
+    node["collapsed"] = bool(node["collapsed"])
+    return node
+
+
+_EDITOR_FIELDS = ("last_edited_by", "last_edited_by_name", "last_edited_at")
+
+
+def delta_fields(changes) -> list[str]:
+    """Fields an update touches: the requested ones plus order_key when the node moved."""
+    fields = list(changes)
+    if "order_key" not in fields and ("position" in fields or "parent_id" in fields):
+        fields.append("order_key")
+    return fields
+
+
+def node_delta(node: dict, changes: dict) -> dict:
+    """Minimal broadcast form of an updated node: a flat dict of its id, the
+    changed fields and the editor, which clients merge into their copy."""
+    delta = {"id": node["id"]}
+    delta.update((k, node[k]) for k in changes if k in node)
+    for key in _EDITOR_FIELDS:
+        delta[key] = node.get(key)
+    return delta
+
+
+def batch_deltas(results: list[dict]) -> list[dict]:
+    """node:batch results with update/move rows reduced to deltas."""
+    out = []
+    for result in results:
+        if result["op"] in ("update", "move"):
+            fields = delta_fields(result.get("fields") or ())
+            out.append({"op": result["op"], **node_delta(result["node"], fields)})
+        else:
+            out.append(result)
+    return out
+
+
+def reorder_delta(result: dict) -> dict:
+    """Broadcast form of a reorder or rebalance: the parent and its children's new keys."""
+    return {"parent_id": result["parent_id"], "order_keys": result["order_keys"]}
 
 
 async def update_node(
@@ -128,162 +386,283 @@ async def update_node(
     user_id: str | None = None,
     username: str | None = None,
 ) -> dict | None:
-    allowed = {"content", "position", "style", "collapsed", "parent_id"}
-    updates = {k: v for k, v in changes.items() if k in allowed}
+    updates = {k: v for k, v in changes.items() if k in _UPDATABLE_FIELDS}
     if not updates:
         return None
 
-    now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
-        # Check if node is locked by another user
-        lock_owner = await check_lock_owner(node_id, map_id, user_id or "")
-        if lock_owner:
-            return {"lock_conflict": True, "locked_by": lock_owner}
+    # Check if node is locked by another user
+    lock_owner = await check_lock_owner(node_id, map_id, user_id or "")
+    if lock_owner:
+        return {"lock_conflict": True, "locked_by": lock_owner}
 
-        # Get current state before update
-        cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
-        row = await cursor.fetchone()
-        if not row:
-            return None
-        old_node = dict(row)
+    return await _write(map_id, lambda db: _apply_update(db, map_id, node_id, updates, user_id, username))
 
-        # New parent (if provided) must remain in the same map.
-        if "parent_id" in updates and updates["parent_id"] is not None:
-            cursor = await db.execute(
-                "SELECT 1 FROM nodes WHERE id = ? AND map_id = ?",
-                (updates["parent_id"], map_id),
-            )
-            if await cursor.fetchone() is None:
-                return None
 
+async def _fetch_subtree(db, map_id: str, node_id: str) -> list[dict]:
+    """Return full rows of a node and all its descendants, parents before children."""
+    cursor = await db.execute(
+        """WITH RECURSIVE subtree AS (
+               SELECT * FROM nodes WHERE id = ? AND map_id = ?
+               UNION ALL
+               SELECT n.* FROM nodes n JOIN subtree s ON n.parent_id = s.id
+           )
+           SELECT * FROM subtree""",
+        (node_id, map_id),
+    )
+    nodes = [dict(r) for r in await cursor.fetchall()]
+    for n in nodes:
+        n["collapsed"] = bool(n["collapsed"])
+    return nodes
+
+
+async def _delete_subtree(
+    db,
+    map_id: str,
+    node_id: str,
+    user_id: str | None = None,
+    username: str | None = None,
+    ver: int | None = None,
+) -> dict | None:
+    # Collect full subtree data before deleting
+    subtree_nodes = await _fetch_subtree(db, map_id, node_id)
+    if not subtree_nodes:
+        return None
+    root = subtree_nodes[0]
+    deleted_ids = [n["id"] for n in subtree_nodes]
+
+    if ver is None:
         ver = await _bump_version(db, map_id)
-        updates["updated_at"] = now
-        updates["version"] = ver
-        if user_id:
-            updates["last_edited_by"] = user_id
-            updates["last_edited_by_name"] = username or ''
-            updates["last_edited_at"] = now
-
-        set_clause = ", ".join(f"{k} = ?" for k in updates)
-        values = list(updates.values()) + [node_id, map_id]
-        await db.execute(f"UPDATE nodes SET {set_clause} WHERE id = ? AND map_id = ?", values)
-        await db.execute(
-            "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'update', ?)",
-            (map_id, ver, node_id),
-        )
 
-        # Record history
-        await _record_history(
-            db, node_id, map_id, 'update', ver,
-            user_id=user_id, username=username,
-            old_content=old_node.get("content"),
-            new_content=changes.get("content", old_node.get("content")),
-            old_parent_id=old_node.get("parent_id"),
-            new_parent_id=changes.get("parent_id", old_node.get("parent_id")),
-            old_position=old_node.get("position"),
-            new_position=changes.get("position", old_node.get("position")),
-        )
+    # Log all deletions
+    await db.executemany(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'delete', ?)",
+        [(map_id, ver, did) for did in deleted_ids],
+    )
 
-        await db.commit()
+    # Record history with snapshot
+    await _record_history(
+        db, node_id, map_id, 'delete', ver,
+        user_id=user_id, username=username,
+        old_content=root["content"],
+        old_parent_id=root["parent_id"],
+        old_position=root["position"],
+        snapshot=json.dumps(subtree_nodes, default=str),
+    )
 
-        cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
-        row = await cursor.fetchone()
-        if not row:
-            return None
-        d = dict(row)
-        d["collapsed"] = bool(d["collapsed"])
-        return d
-    finally:
-        await db.close()
+    # Descendants go with it through ON DELETE CASCADE
+    await db.execute("DELETE FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
+    return {"deleted_ids": deleted_ids, "version": ver, "map_id": map_id}
+
+
+def _parents_first(nodes: list[dict]) -> list[dict]:
+    """Order a flat subtree so every node comes after its parent."""
+    ids = {n["id"] for n in nodes}
+    children: dict[str, list[dict]] = {}
+    ordered = [n for n in nodes if n["parent_id"] not in ids]
+    for n in nodes:
+        if n["parent_id"] in ids:
+            children.setdefault(n["parent_id"], []).append(n)
+    i = 0
+    while i < len(ordered):
+        ordered.extend(children.pop(ordered[i]["id"], ()))
+        i += 1
+    return ordered
+
+
+async def _restore_subtree(
+    db,
+    map_id: str,
+    snapshot_nodes: list[dict],
+    user_id: str | None = None,
+    username: str | None = None,
+) -> dict | None:
+    """Re-insert a deleted subtree in one transaction with a single version bump."""
+    nodes = _parents_first(snapshot_nodes)
+    if not nodes or len(nodes) != len(snapshot_nodes):
+        return None
+    root = nodes[0]
+    # The subtree must hang off a node that still exists in this map.
+    if not await _node_exists(db, map_id, root["parent_id"]):
+        return None
+
+    now = datetime.now(timezone.utc).isoformat()
+    ver = await _bump_version(db, map_id)
+    # The root goes back where its position says; snapshots taken before
+    # order keys existed get fresh keys for the descendants.
+    keys = {root["id"]: await _sibling_key(
+        db, map_id, root["parent_id"], root.get("position", 0), root["id"], current=root.get("order_key"),
+    )}
+    unkeyed: dict[str, list[dict]] = {}
+    for n in nodes[1:]:
+        if n.get("order_key"):
+            keys[n["id"]] = n["order_key"]
+        else:
+            unkeyed.setdefault(n["parent_id"], []).append(n)
+    for siblings in unkeyed.values():
+        siblings.sort(key=lambda n: n.get("position", 0))
+        keys.update(zip((n["id"] for n in siblings), spread_keys(len(siblings))))
+    restored = []
+    for n in nodes:
+        restored.append({
+            "id": n["id"],
+            "map_id": map_id,
+            "parent_id": n["parent_id"],
+            "content": n.get("content", ""),
+            "position": n.get("position", 0),
+            "order_key": keys[n["id"]],
+            "style": n.get("style", "{}"),
+            "collapsed": bool(n.get("collapsed", False)),
+            "version": ver,
+            "last_edited_by": user_id,
+            "last_edited_by_name": username or '',
+            "last_edited_at": now,
+            "created_at": n.get("created_at") or now,
+            "updated_at": now,
+        })
+    await db.executemany(
+        """INSERT INTO nodes (id, map_id, parent_id, content, position, order_key, style, collapsed, version,
+           last_edited_by, last_edited_by_name, last_edited_at, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(n["id"], map_id, n["parent_id"], n["content"], n["position"], n["order_key"], n["style"], n["collapsed"],
+          ver, user_id, username or '', now, n["created_at"], now) for n in restored],
+    )
+    await db.executemany(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'create', ?)",
+        [(map_id, ver, n["id"]) for n in restored],
+    )
+    await db.executemany(
+        _HISTORY_INSERT,
+        [(n["id"], map_id, user_id, username or '', 'create',
+          None, n["content"], None, n["parent_id"], None, n["position"], None, ver, now)
+         for n in restored],
+    )
+    return {"restored": restored, "parent_id": root["parent_id"], "version": ver}
 
 
 async def delete_node(map_id: str, node_id: str, user_id: str | None = None, username: str | None = None) -> dict | None:
-    db = await get_db()
-    try:
-        # Check if node is locked by another user
-        lock_owner = await check_lock_owner(node_id, map_id, user_id or "")
-        if lock_owner:
-            return {"lock_conflict": True, "locked_by": lock_owner}
+    # Check if node is locked by another user
+    lock_owner = await check_lock_owner(node_id, map_id, user_id or "")
+    if lock_owner:
+        return {"lock_conflict": True, "locked_by": lock_owner}
 
-        cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
-        row = await cursor.fetchone()
-        if not row:
-            return None
+    return await _write(map_id, lambda db: _delete_subtree(db, map_id, node_id, user_id, username))
 
-        # Collect full subtree data before deleting
-        subtree_nodes = []
-        deleted_ids = [node_id]
-        queue = [node_id]
-
-        # First collect all IDs
-        while queue:
-            pid = queue.pop()
-            cursor = await db.execute("SELECT id FROM nodes WHERE parent_id = ? AND map_id = ?", (pid, map_id))
-            children = await cursor.fetchall()
-            for c in children:
-                deleted_ids.append(c["id"])
-                queue.append(c["id"])
-
-        # Collect full data for snapshot
-        for did in deleted_ids:
-            cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (did, map_id))
-            r = await cursor.fetchone()
-            if r:
-                d = dict(r)
-                d["collapsed"] = bool(d["collapsed"])
-                subtree_nodes.append(d)
 
-        ver = await _bump_version(db, map_id)
+MAX_NODE_BATCH = 1000  # ops per node:batch
+BATCH_OPS = ("create", "update", "move", "delete")
 
-        # Log all deletions
-        for did in deleted_ids:
-            await db.execute(
-                "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'delete', ?)",
-                (map_id, ver, did),
-            )
 
-        # Record history with snapshot
-        await _record_history(
-            db, node_id, map_id, 'delete', ver,
-            user_id=user_id, username=username,
-            old_content=row["content"],
-            old_parent_id=row["parent_id"],
-            old_position=row["position"],
-            snapshot=json.dumps(subtree_nodes, default=str),
+class BatchError(Exception):
+    """Raised inside a batch job to roll the whole batch back."""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+async def _apply_batch_op(db, map_id: str, op: dict, ver: int, user_id, username) -> dict | None:
+    kind = op.get("op")
+    if kind == "create":
+        if not op.get("parent_id"):
+            return None
+        node = await _insert_node(
+            db, map_id, op["parent_id"],
+            content=op.get("content", ""),
+            position=op.get("position", 0),
+            style=op.get("style", "{}"),
+            node_id=op.get("id"),
+            user_id=user_id, username=username, ver=ver,
+            order_key=op.get("order_key"),
         )
+        return node and {"op": kind, "node": node}
+    if kind in ("update", "move"):
+        if kind == "move":
+            if not op.get("parent_id"):
+                return None
+            updates = {"parent_id": op["parent_id"], "position": op.get("position", 0)}
+            if op.get("order_key") is not None:
+                updates["order_key"] = op["order_key"]
+        else:
+            updates = {k: v for k, v in (op.get("changes") or {}).items() if k in _UPDATABLE_FIELDS}
+            if not updates:
+                return None
+        node = await _apply_update(db, map_id, op["id"], updates, user_id, username, ver=ver)
+        return node and {"op": kind, "node": node, "fields": list(updates)}
+    if kind == "delete":
+        deleted = await _delete_subtree(db, map_id, op["id"], user_id, username, ver=ver)
+        return deleted and {"op": kind, "id": op["id"], "deleted_ids": deleted["deleted_ids"]}
+    return None
 
-        await db.execute("DELETE FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
-        await db.commit()
-        return {"deleted_ids": deleted_ids, "version": ver, "map_id": map_id}
-    finally:
-        await db.close()
 
+async def apply_batch(
+    map_id: str,
+    ops: list[dict],
+    user_id: str | None = None,
+    username: str | None = None,
+) -> dict:
+    """Apply an ordered list of create/update/move/delete ops atomically.
+
+    All ops share one version bump (so their history rows share map_version)
+    and one transaction: if any op fails nothing is written. Creates may
+    carry client ids so later ops can refer to them.
+
+    Returns {"version", "results"}, {"lock_conflict", "locked_by"} or
+    {"error", "index"}.
+    """
+    for i, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get("op") not in BATCH_OPS:
+            return {"error": "Unknown op", "index": i}
+        if op["op"] != "create" and not op.get("id"):
+            return {"error": "Missing node id", "index": i}
+        key = (op.get("changes") or {}).get("order_key") if op["op"] == "update" else op.get("order_key")
+        if key is not None and not is_valid_key(key):
+            return {"error": "Invalid order_key", "index": i}
+
+    created = {op.get("id") for op in ops if op["op"] == "create"}
+    targets = list(dict.fromkeys(op["id"] for op in ops if op["op"] != "create" and op["id"] not in created))
+    owners = await check_lock_owners(targets, map_id, user_id or "")
+    if owners:
+        node_id, locked_by = next(iter(owners.items()))
+        return {"lock_conflict": True, "locked_by": locked_by, "node_id": node_id}
+
+    async def apply(db) -> dict:
+        ver = await _bump_version(db, map_id)
+        results = []
+        for i, op in enumerate(ops):
+            try:
+                result = await _apply_batch_op(db, map_id, op, ver, user_id, username)
+            except sqlite3.IntegrityError:
+                raise BatchError(i, "Node id already exists")
+            if result is None:
+                raise BatchError(i, "Node not found" if op["op"] != "create" else "Parent node not found in this map")
+            results.append(result)
+        return {"version": ver, "results": results}
 
-async def get_node_history(node_id: str, limit: int = 50) -> list[dict]:
-    db = await get_db()
     try:
+        return await _write(map_id, apply)
+    except BatchError as exc:
+        return {"error": exc.message, "index": exc.index}
+
+
+async def get_node_history(node_id: str, limit: int = 50) -> list[dict]:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT * FROM node_history WHERE node_id = ? ORDER BY created_at DESC LIMIT ?",
             (node_id, limit),
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def get_map_history(map_id: str, limit: int = 100) -> list[dict]:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT * FROM node_history WHERE map_id = ? ORDER BY created_at DESC LIMIT ?",
             (map_id, limit),
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def rollback_to_history(
@@ -293,22 +672,36 @@ async def rollback_to_history(
     username: str,
     expected_node_id: str | None = None,
 ) -> dict:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT * FROM node_history WHERE id = ?", (history_id,))
         row = await cursor.fetchone()
-        if not row:
-            return {"error": "History entry not found"}
-        entry = dict(row)
+    if not row:
+        return {"error": "History entry not found"}
+    entry = dict(row)
 
-        if entry["map_id"] != map_id:
-            return {"error": "History entry does not belong to this map"}
-        if expected_node_id and entry["node_id"] != expected_node_id:
-            return {"error": "History entry does not belong to this node"}
+    if entry["map_id"] != map_id:
+        return {"error": "History entry does not belong to this map"}
+    if expected_node_id and entry["node_id"] != expected_node_id:
+        return {"error": "History entry does not belong to this node"}
 
+    try:
         action = entry["action"]
 
-        if action == "update":
+        if action == "update" and entry["snapshot"]:
+            # Reverse a reorder: put the recorded children back in their old order
+            saved = json.loads(entry["snapshot"]).get("reorder") or []
+            owners = await check_lock_owners([row[0] for row in saved], map_id, user_id)
+            if owners:
+                return {"error": "Rollback failed"}
+            result = await _write(
+                map_id,
+                lambda db: _restore_order(db, map_id, entry["node_id"], saved, user_id, username)
+            )
+            if not result:
+                return {"error": "Rollback failed"}
+            return {"status": "ok", "action": "reorder_reversed", **result}
+
+        elif action == "update":
             # Reverse: apply old values
             changes = {}
             if entry["old_content"] is not None:
@@ -319,14 +712,14 @@ async def rollback_to_history(
                 changes["position"] = entry["old_position"]
             if changes:
                 result = await update_node(map_id, entry["node_id"], changes, user_id=user_id, username=username)
-                if not result:
+                if not result or result.get("lock_conflict"):
                     return {"error": "Rollback failed"}
                 return {"status": "ok", "action": "update_reversed", "node": result}
 
         elif action == "create":
             # Reverse: delete the node
             result = await delete_node(map_id, entry["node_id"], user_id=user_id, username=username)
-            if result is None:
+            if result is None or result.get("lock_conflict"):
                 return {"error": "Rollback failed"}
             return {"status": "ok", "action": "create_reversed", "result": result}
 
@@ -335,106 +728,475 @@ async def rollback_to_history(
             if not entry["snapshot"]:
                 return {"error": "No snapshot available"}
             snapshot_nodes = json.loads(entry["snapshot"])
-            restored = []
-            for n in snapshot_nodes:
-                result = await create_node(
-                    map_id=map_id,
-                    parent_id=n["parent_id"],
-                    content=n.get("content", ""),
-                    position=n.get("position", 0),
-                    style=n.get("style", "{}"),
-                    node_id=n["id"],
-                    user_id=user_id,
-                    username=username,
-                )
-                if not result:
-                    return {"error": "Rollback failed"}
-                restored.append(result)
-            return {"status": "ok", "action": "delete_reversed", "restored": restored}
+            result = await _write(
+                map_id,
+                lambda db: _restore_subtree(db, map_id, snapshot_nodes, user_id, username)
+            )
+            if not result:
+                return {"error": "Rollback failed"}
+            return {"status": "ok", "action": "delete_reversed", **result}
 
         return {"error": "Unknown action type"}
     except Exception:
-        # db may already be closed above, that's fine
         return {"error": "Rollback failed"}
 
 
-async def move_node(map_id: str, node_id: str, new_parent_id: str, position: int) -> dict | None:
-    return await update_node(map_id, node_id, {"parent_id": new_parent_id, "position": position})
+async def move_node(
+    map_id: str, node_id: str, new_parent_id: str, position: int, order_key: str | None = None,
+) -> dict | None:
+    changes = {"parent_id": new_parent_id, "position": position}
+    if order_key is not None:
+        changes["order_key"] = order_key
+    return await update_node(map_id, node_id, changes)
 
 
-async def acquire_lock(node_id: str, map_id: str, user_id: str, username: str) -> dict:
-    """Try to acquire a lock via Redis.
+async def _rebalance_keys(db, map_id: str, parent_id: str) -> dict:
+    """Respace the order keys of ``parent_id``'s children, keeping their order."""
+    ver = await _bump_version(db, map_id)
+    cursor = await db.execute(
+        "SELECT id, order_key FROM nodes WHERE map_id = ? AND parent_id = ? ORDER BY order_key, position",
+        (map_id, parent_id),
+    )
+    rows = await cursor.fetchall()
+    keys = {
+        row["id"]: key for row, key in zip(rows, spread_keys(len(rows)))
+        if key != row["order_key"]
+    }
+    if not keys:
+        raise _Rejected
+    await db.executemany(
+        "UPDATE nodes SET order_key = ?, version = ? WHERE id = ?",
+        [(key, ver, node_id) for node_id, key in keys.items()],
+    )
+    await db.executemany(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'update', ?)",
+        [(map_id, ver, node_id) for node_id in keys],
+    )
+    return {"version": ver, "map_id": map_id, "parent_id": parent_id, "order_keys": keys}
 
-    Returns dict with lock info on success.
-    On failure returns {"locked": False, "locked_by": "<username>"}.
+
+MAX_REORDER = 5000  # children per reorder
+
+
+async def _children_order(db, map_id: str, parent_id: str) -> list[list]:
+    """[id, order_key, position] of ``parent_id``'s children in sibling order."""
+    cursor = await db.execute(
+        "SELECT id, order_key, position FROM nodes WHERE map_id = ? AND parent_id = ? ORDER BY order_key, position",
+        (map_id, parent_id),
+    )
+    return [list(row) for row in await cursor.fetchall()]
+
+
+async def _write_order(
+    db, map_id: str, parent_id: str, before: list[list], rows: list[tuple],
+    user_id: str | None = None, username: str | None = None,
+) -> dict:
+    """Set (id, order_key, position) ``rows`` with one UPDATE under one version.
+
+    One history row on the parent keeps the previous order (``before``) as
+    its snapshot, so the whole reorder rolls back as one.
     """
-    r = get_redis()
-    key = f"lock:{map_id}:{node_id}"
-    lock_value = json.dumps({"user_id": user_id, "username": username, "locked_at": datetime.now(timezone.utc).isoformat()})
+    ver = await _bump_version(db, map_id)
+    now = datetime.now(timezone.utc).isoformat()
+    cases = " ".join("WHEN ? THEN ?" for _ in rows)
+    placeholders = ",".join("?" for _ in rows)
+    await db.execute(
+        f"""UPDATE nodes SET order_key = CASE id {cases} END, position = CASE id {cases} END,
+                version = ?, updated_at = ?
+            WHERE map_id = ? AND id IN ({placeholders})""",
+        (*(v for node_id, key, _ in rows for v in (node_id, key)),
+         *(v for node_id, _, position in rows for v in (node_id, position)),
+         ver, now, map_id, *(node_id for node_id, _, _ in rows)),
+    )
+    await db.executemany(
+        "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'update', ?)",
+        [(map_id, ver, node_id) for node_id, _, _ in rows],
+    )
+    await _record_history(
+        db, parent_id, map_id, 'update', ver,
+        user_id=user_id, username=username,
+        snapshot=json.dumps({"reorder": before}),
+    )
+    return {
+        "version": ver,
+        "map_id": map_id,
+        "parent_id": parent_id,
+        "order_keys": {node_id: key for node_id, key, _ in rows},
+    }
 
-    # Try SET NX (only if not exists)
-    acquired = await r.set(key, lock_value, nx=True, ex=LOCK_TTL)
-    if acquired:
-        return {"node_id": node_id, "user_id": user_id, "username": username, "locked_at": datetime.now(timezone.utc).isoformat()}
-
-    # Key exists — check if same user (refresh TTL)
-    existing = await r.get(key)
-    if existing:
-        data = json.loads(existing)
-        if data["user_id"] == user_id:
-            # Refresh TTL
-            await r.set(key, lock_value, ex=LOCK_TTL)
-            return {"node_id": node_id, "user_id": user_id, "username": username, "locked_at": data["locked_at"]}
-        # Locked by another user
-        return {"locked": False, "locked_by": data["username"]}
 
-    # Key expired between SET NX and GET — retry once
-    acquired = await r.set(key, lock_value, nx=True, ex=LOCK_TTL)
-    if acquired:
-        return {"node_id": node_id, "user_id": user_id, "username": username, "locked_at": datetime.now(timezone.utc).isoformat()}
+async def _reorder(db, map_id: str, parent_id: str, ordered_ids: list[str], user_id, username) -> dict | None:
+    before = await _children_order(db, map_id, parent_id)
+    if not before and not await _node_exists(db, map_id, parent_id):
+        return None
+    if not before or len(ordered_ids) != len(before) or set(ordered_ids) != {node_id for node_id, _, _ in before}:
+        return {"error": "ordered_ids must list every child of the node exactly once"}
+    rows = list(zip(ordered_ids, spread_keys(len(ordered_ids)), range(len(ordered_ids))))
+    return await _write_order(db, map_id, parent_id, before, rows, user_id, username)
+
+
+async def _restore_order(db, map_id: str, parent_id: str, saved: list[list], user_id, username) -> dict | None:
+    """Put the children recorded in ``saved`` back to their keys; later children are left alone."""
+    before = await _children_order(db, map_id, parent_id)
+    current = {node_id for node_id, _, _ in before}
+    rows = [tuple(row) for row in saved if row[0] in current]
+    if not rows:
+        return None
+    return await _write_order(db, map_id, parent_id, before, rows, user_id, username)
+
+
+async def reorder_children(
+    map_id: str,
+    parent_id: str,
+    ordered_ids: list[str],
+    user_id: str | None = None,
+    username: str | None = None,
+) -> dict | None:
+    """Put all of ``parent_id``'s children in the order of ``ordered_ids``.
+
+    The children get fresh evenly spaced keys (and their index as position)
+    in one statement under one version, instead of a move per child.
+
+    Returns {"version", "parent_id", "order_keys"}, {"lock_conflict",
+    "locked_by", "node_id"}, {"error"} or None if the parent does not exist.
+    """
+    owners = await check_lock_owners(ordered_ids, map_id, user_id or "")
+    if owners:
+        node_id, locked_by = next(iter(owners.items()))
+        return {"lock_conflict": True, "locked_by": locked_by, "node_id": node_id}
+    return await _write(map_id, lambda db: _reorder(db, map_id, parent_id, ordered_ids, user_id, username))
 
-    return {"locked": False, "locked_by": "unknown"}
 
+async def rebalance_children(map_id: str, parent_id: str) -> dict | None:
+    """Give a sibling list short, evenly spaced order keys under one version.
+
+    Only keys change, so no history is recorded. Returns None if there was
+    nothing to respace.
+    """
+    return await _write(map_id, lambda db: _rebalance_keys(db, map_id, parent_id))
 
-# Lua script for atomic check-and-delete
-_RELEASE_LOCK_SCRIPT = """
-local val = redis.call('GET', KEYS[1])
-if val == false then
+
+# Locks for a map live in one hash, locks:{map_id} (node_id -> JSON owner),
+# with each lock's expiry time in the sorted set lockexp:{map_id}, so a map's
+# locks are read or written in a single round trip. Entries past their expiry
+# are treated as absent; removing them is left to expire_due_locks(), which
+# sweeps the global locks:due set ("{map_id}|{node_id}" -> expiry) and reports
+# each expiry exactly once. lockgen:{map_id} is bumped on every change so
+# /sync can derive an ETag without reading the locks.
+LOCKS_DUE_KEY = "locks:due"
+
+
+class _LuaScript:
+    """A lock script run with EVALSHA, so only its hash is sent per call.
+
+    Registered on first use with the current Redis client (and again if
+    the client is replaced); redis-py reloads it if the server lost it.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self._script = None
+
+    async def __call__(self, keys, *args):
+        r = get_redis()
+        if self._script is None or self._script.registered_client is not r:
+            self._script = r.register_script(self.source)
+        return await self._script(keys=keys, args=args)
+
+
+_LIVE_LOCK = """
+local function live_lock(node_id)
+    local expires = redis.call('ZSCORE', KEYS[2], node_id)
+    if not expires or tonumber(expires) <= tonumber(ARGV[1]) then
+        return false
+    end
+    return redis.call('HGET', KEYS[1], node_id)
+end
+"""
+
+# A refresh by the holder only extends the TTL: the lock list, and so
+# lockgen, is unchanged. Returns {acquired, owner JSON, refreshed}.
+# KEYS: locks, lockexp, lockgen, locks:due
+# ARGV: now, node_id, user_id, owner JSON, ttl, due member
+_ACQUIRE_LOCK_SCRIPT = _LuaScript(_LIVE_LOCK + """
+local existing = live_lock(ARGV[2])
+local value = ARGV[4]
+if existing then
+    local data = cjson.decode(existing)
+    if data['user_id'] ~= ARGV[3] then
+        return {0, existing, 0}
+    end
+    -- Refresh by the same user keeps the original locked_at
+    local fresh = cjson.decode(value)
+    fresh['locked_at'] = data['locked_at']
+    value = cjson.encode(fresh)
+end
+local expires = tonumber(ARGV[1]) + tonumber(ARGV[5])
+redis.call('HSET', KEYS[1], ARGV[2], value)
+redis.call('ZADD', KEYS[2], expires, ARGV[2])
+redis.call('ZADD', KEYS[4], expires, ARGV[6])
+if existing then
+    return {1, value, 1}
+end
+redis.call('INCR', KEYS[3])
+return {1, value, 0}
+""")
+
+# All-or-nothing: every node is checked before any is written. Returns
+# {1, owner JSONs, refreshed flags} or {0, conflicts, {}}.
+# KEYS: locks, lockexp, lockgen, locks:due
+# ARGV: now, user_id, owner JSON, ttl, map_id, node_id...
+_ACQUIRE_LOCKS_SCRIPT = _LuaScript(_LIVE_LOCK + """
+local conflicts = {}
+local current = {}
+for i = 6, #ARGV do
+    local existing = live_lock(ARGV[i])
+    if existing then
+        local data = cjson.decode(existing)
+        if data['user_id'] ~= ARGV[2] then
+            table.insert(conflicts, {ARGV[i], data['username']})
+        else
+            current[ARGV[i]] = data['locked_at']
+        end
+    end
+end
+if #conflicts > 0 then
+    return {0, conflicts, {}}
+end
+local expires = tonumber(ARGV[1]) + tonumber(ARGV[4])
+local values = {}
+local refreshed = {}
+local added = false
+for i = 6, #ARGV do
+    local value = ARGV[3]
+    if current[ARGV[i]] then
+        local fresh = cjson.decode(value)
+        fresh['locked_at'] = current[ARGV[i]]
+        value = cjson.encode(fresh)
+        table.insert(refreshed, 1)
+    else
+        table.insert(refreshed, 0)
+        added = true
+    end
+    redis.call('HSET', KEYS[1], ARGV[i], value)
+    redis.call('ZADD', KEYS[2], expires, ARGV[i])
+    redis.call('ZADD', KEYS[4], expires, ARGV[5] .. '|' .. ARGV[i])
+    table.insert(values, value)
+end
+if added then
+    redis.call('INCR', KEYS[3])
+end
+return {1, values, refreshed}
+""")
+
+# Releases the caller's own locks among the given nodes; returns their ids.
+# KEYS: locks, lockexp, lockgen, locks:due
+# ARGV: user_id, map_id, node_id...
+_RELEASE_LOCKS_SCRIPT = _LuaScript("""
+local released = {}
+for i = 3, #ARGV do
+    local existing = redis.call('HGET', KEYS[1], ARGV[i])
+    if existing and cjson.decode(existing)['user_id'] == ARGV[1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        redis.call('ZREM', KEYS[2], ARGV[i])
+        redis.call('ZREM', KEYS[4], ARGV[2] .. '|' .. ARGV[i])
+        table.insert(released, ARGV[i])
+    end
+end
+if #released > 0 then
+    redis.call('INCR', KEYS[3])
+end
+return released
+""")
+
+# KEYS: locks, lockexp, lockgen, locks:due
+# ARGV: now, node_id, user_id, due member
+_RELEASE_LOCK_SCRIPT = _LuaScript("""
+local existing = redis.call('HGET', KEYS[1], ARGV[2])
+if not existing or cjson.decode(existing)['user_id'] ~= ARGV[3] then
     return 0
 end
-local data = cjson.decode(val)
-if data['user_id'] == ARGV[1] then
-    redis.call('DEL', KEYS[1])
-    return 1
+redis.call('HDEL', KEYS[1], ARGV[2])
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREM', KEYS[4], ARGV[4])
+redis.call('INCR', KEYS[3])
+return 1
+""")
+
+# KEYS: locks, lockexp; ARGV: now, node_id
+_LOCK_OWNER_SCRIPT = _LuaScript(_LIVE_LOCK + """
+return live_lock(ARGV[2])
+""")
+
+# KEYS: locks, lockexp; ARGV: now, node_id...
+_LOCK_OWNERS_SCRIPT = _LuaScript(_LIVE_LOCK + """
+local owners = {}
+for i = 2, #ARGV do
+    owners[i - 1] = live_lock(ARGV[i]) or ''
 end
-return 0
-"""
+return owners
+""")
+
+# KEYS: locks, lockexp; ARGV: now
+_GET_LOCKS_SCRIPT = _LuaScript("""
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '(' .. ARGV[1], '+inf')
+if #ids == 0 then
+    return {}
+end
+-- HMGET in chunks: unpack() of a long list overflows Lua's stack
+local values = {}
+for i = 1, #ids, 1000 do
+    local chunk = redis.call('HMGET', KEYS[1], unpack(ids, i, math.min(i + 999, #ids)))
+    for j = 1, #chunk do
+        values[#values + 1] = chunk[j]
+    end
+end
+return {ids, values}
+""")
 
+# KEYS: locks:due; ARGV: now, limit. Per-map keys are derived from the
+# members, so this assumes a single Redis instance (no cluster slots).
+_SWEEP_LOCKS_SCRIPT = _LuaScript("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local expired = {}
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    local sep = string.find(member, '|', 1, true)
+    local map_id = string.sub(member, 1, sep - 1)
+    local node_id = string.sub(member, sep + 1)
+    local expires = redis.call('ZSCORE', 'lockexp:' .. map_id, node_id)
+    if expires and tonumber(expires) <= tonumber(ARGV[1]) then
+        local owner = redis.call('HGET', 'locks:' .. map_id, node_id)
+        redis.call('ZREM', 'lockexp:' .. map_id, node_id)
+        redis.call('HDEL', 'locks:' .. map_id, node_id)
+        redis.call('INCR', 'lockgen:' .. map_id)
+        table.insert(expired, {map_id, node_id, owner or '{}'})
+    end
+end
+return expired
+""")
 
-async def release_lock(node_id: str, map_id: str, user_id: str) -> bool:
+
+def _lock_keys(map_id: str) -> tuple[str, str, str, str]:
+    return f"locks:{map_id}", f"lockexp:{map_id}", f"lockgen:{map_id}", LOCKS_DUE_KEY
+
+
+async def acquire_lock(node_id: str, map_id: str, user_id: str, username: str) -> dict:
+    """Try to acquire (or refresh) a lock via Redis.
+
+    Returns dict with lock info on success.
+    On failure returns {"locked": False, "locked_by": "<username>"}.
+    """
+    lock_value = json.dumps({"user_id": user_id, "username": username, "locked_at": datetime.now(timezone.utc).isoformat()})
+    acquired, value, refreshed = await _ACQUIRE_LOCK_SCRIPT(
+        _lock_keys(map_id),
+        time.time(), node_id, user_id, lock_value, LOCK_TTL, f"{map_id}|{node_id}",
+    )
+    data = json.loads(value)
+    if not acquired:
+        return {"locked": False, "locked_by": data["username"]}
+    lock = {"node_id": node_id, "user_id": user_id, "username": username, "locked_at": data["locked_at"]}
+    # A TTL refresh by the holder is not announced again
+    if not refreshed:
+        await events.emit(events.LOCKS_CHANGED, map_id=map_id, action="acquired", lock=lock)
+    return lock
+
+
+async def get_lock_generation(map_id: str) -> int:
     r = get_redis()
-    key = f"lock:{map_id}:{node_id}"
-    result = await r.eval(_RELEASE_LOCK_SCRIPT, 1, key, user_id)
+    return int(await r.get(f"lockgen:{map_id}") or 0)
+
+
+async def release_lock(node_id: str, map_id: str, user_id: str) -> bool:
+    result = await _RELEASE_LOCK_SCRIPT(
+        _lock_keys(map_id), time.time(), node_id, user_id, f"{map_id}|{node_id}",
+    )
+    if result == 1:
+        await events.emit(
+            events.LOCKS_CHANGED, map_id=map_id, action="released",
+            lock={"node_id": node_id, "user_id": user_id},
+        )
     return result == 1
 
 
+async def acquire_locks(node_ids: list[str], map_id: str, user_id: str, username: str) -> dict:
+    """Lock every node in ``node_ids`` or none of them, in one round trip.
+
+    Returns {"locked": True, "locks": [...]} on success, or
+    {"locked": False, "conflicts": [{"node_id", "locked_by"}, ...]} naming
+    the nodes held by other users.
+    """
+    node_ids = list(dict.fromkeys(node_ids))
+    if not node_ids:
+        return {"locked": True, "locks": []}
+    lock_value = json.dumps({"user_id": user_id, "username": username, "locked_at": datetime.now(timezone.utc).isoformat()})
+    acquired, values, refreshed = await _ACQUIRE_LOCKS_SCRIPT(
+        _lock_keys(map_id),
+        time.time(), user_id, lock_value, LOCK_TTL, map_id, *node_ids,
+    )
+    if not acquired:
+        return {
+            "locked": False,
+            "conflicts": [{"node_id": node_id, "locked_by": locked_by} for node_id, locked_by in values],
+        }
+    locks = [
+        {"node_id": node_id, "user_id": user_id, "username": username, "locked_at": json.loads(value)["locked_at"]}
+        for node_id, value in zip(node_ids, values)
+    ]
+    added = [lock for lock, was_held in zip(locks, refreshed) if not was_held]
+    if added:
+        await events.emit(events.LOCKS_CHANGED, map_id=map_id, action="acquired", locks=added)
+    return {"locked": True, "locks": locks}
+
+
+async def release_locks(node_ids: list[str], map_id: str, user_id: str) -> list[str]:
+    """Release the caller's locks among ``node_ids``; returns the released ids."""
+    node_ids = list(dict.fromkeys(node_ids))
+    if not node_ids:
+        return []
+    released = await _RELEASE_LOCKS_SCRIPT(_lock_keys(map_id), user_id, map_id, *node_ids)
+    if released:
+        await events.emit(
+            events.LOCKS_CHANGED, map_id=map_id, action="released",
+            locks=[{"node_id": node_id, "user_id": user_id} for node_id in released],
+        )
+    return released
+
+
+async def expire_due_locks(limit: int = 100) -> int:
+    """Remove up to ``limit`` locks whose TTL has passed and announce each one.
+
+    Safe to run from every worker: the sweep is one atomic script, so each
+    expiry is claimed (and announced) by exactly one caller.
+    """
+    expired = await _SWEEP_LOCKS_SCRIPT((LOCKS_DUE_KEY,), time.time(), limit)
+    for map_id, node_id, owner in expired:
+        data = json.loads(owner)
+        await events.emit(
+            events.LOCKS_CHANGED, map_id=map_id, action="expired",
+            lock={"node_id": node_id, "user_id": data.get("user_id"), "username": data.get("username")},
+        )
+    return len(expired)
+
+
 async def get_locks_for_map(map_id: str) -> list[dict]:
-    r = get_redis()
+    locks_key, expiry_key, _, _ = _lock_keys(map_id)
+    result = await _GET_LOCKS_SCRIPT((locks_key, expiry_key), time.time())
     locks: list[dict] = []
-    pattern = f"lock:{map_id}:*"
-    prefix = f"lock:{map_id}:"
-    async for key in r.scan_iter(match=pattern, count=100):
-        val = await r.get(key)
-        if val:
-            data = json.loads(val)
-            node_id = key[len(prefix):]
-            locks.append({
-                "node_id": node_id,
-                "map_id": map_id,
-                "user_id": data["user_id"],
-                "username": data["username"],
-                "locked_at": data["locked_at"],
-            })
+    if not result:
+        return locks
+    node_ids, values = result
+    for node_id, val in zip(node_ids, values):
+        if not val:
+            continue
+        data = json.loads(val)
+        locks.append({
+            "node_id": node_id,
+            "map_id": map_id,
+            "user_id": data["user_id"],
+            "username": data["username"],
+            "locked_at": data["locked_at"],
+        })
     return locks
 
 
@@ -443,12 +1205,26 @@ async def check_lock_owner(node_id: str, map_id: str, user_id: str) -> str | Non
 
     Returns the locking username if locked by someone else, None otherwise.
     """
-    r = get_redis()
-    key = f"lock:{map_id}:{node_id}"
-    val = await r.get(key)
+    locks_key, expiry_key, _, _ = _lock_keys(map_id)
+    val = await _LOCK_OWNER_SCRIPT((locks_key, expiry_key), time.time(), node_id)
     if not val:
         return None
     data = json.loads(val)
     if data["user_id"] == user_id:
         return None
     return data["username"]
+
+
+async def check_lock_owners(node_ids: list[str], map_id: str, user_id: str) -> dict[str, str]:
+    """Batch form of check_lock_owner: {node_id: username} for nodes locked by others."""
+    if not node_ids:
+        return {}
+    locks_key, expiry_key, _, _ = _lock_keys(map_id)
+    values = await _LOCK_OWNERS_SCRIPT((locks_key, expiry_key), time.time(), *node_ids)
+    owners = {}
+    for node_id, val in zip(node_ids, values):
+        if val:
+            data = json.loads(val)
+            if data["user_id"] != user_id:
+                owners[node_id] = data["username"]
+    return owners
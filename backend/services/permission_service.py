@@ -23,56 +23,61 @@ def has_permission(role: str, permission: str) -> bool:
     return ROLE_LEVELS.get(role, 0) >= PERMISSION_LEVELS.get(permission, 999)
 
 
+async def _fetch_team_role(db, user_id: str, team_id: str) -> str | None:
+    cursor = await db.execute(
+        "SELECT role FROM team_members WHERE team_id = ? AND user_id = ?",
+        (team_id, user_id),
+    )
+    row = await cursor.fetchone()
+    return row["role"] if row else None
+
+
 async def get_user_team_role(user_id: str, team_id: str) -> str | None:
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT role FROM team_members WHERE team_id = ? AND user_id = ?",
-            (team_id, user_id),
-        )
-        row = await cursor.fetchone()
-        return row["role"] if row else None
-    finally:
-        await db.close()
+    async with get_db() as db:
+        return await _fetch_team_role(db, user_id, team_id)
 
 
-async def check_map_access(user_id: str, map_id: str, permission: str = "view") -> bool:
-    """Check if user has the required permission on a map.
+async def get_map_role(user_id: str, map_id: str) -> tuple[str | None, str | None]:
+    """Resolve the user's effective role on a map.
+
+    Returns ``(role, team_id)``; role is None when the user has no access.
 
     Rules:
     - Maps with owner_id=NULL (legacy) are accessible to all authenticated users
     - Personal maps (owner_id set, team_id=NULL) are only accessible to the owner
-    - Team maps: check user's team role against required permission
+    - Team maps: the user's team role applies
     """
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT owner_id, team_id FROM maps WHERE id = ?", (map_id,))
         row = await cursor.fetchone()
         if not row:
-            return False
+            return None, None
 
         owner_id = row["owner_id"]
         team_id = row["team_id"]
 
         # Legacy maps (no owner) - accessible to all authenticated users
         if owner_id is None:
-            return True
+            return "owner", team_id
 
         # Personal map - owner has full access
         if owner_id == user_id and team_id is None:
-            return True
+            return "owner", None
 
         # Team map
         if team_id:
-            role = await get_user_team_role(user_id, team_id)
-            if role is None:
-                return False
-            return has_permission(role, permission)
+            return await _fetch_team_role(db, user_id, team_id), team_id
 
         # Personal map, not the owner
+        return None, None
+
+
+async def check_map_access(user_id: str, map_id: str, permission: str = "view") -> bool:
+    """Check if user has the required permission on a map (see get_map_role)."""
+    role, _ = await get_map_role(user_id, map_id)
+    if role is None:
         return False
-    finally:
-        await db.close()
+    return has_permission(role, permission)
 
 
 async def check_team_access(user_id: str, team_id: str, permission: str = "view") -> bool:
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import glob
+import gzip
+import logging
+import os
+
+from backend.responses import dumps
+
+logger = logging.getLogger(__name__)
+
+_snapshot_dir: str = ""
+
+
+def set_snapshot_dir(path: str) -> None:
+    """Enable map snapshots under ``path`` (empty string disables them)."""
+    global _snapshot_dir
+    _snapshot_dir = path
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+def enabled() -> bool:
+    return bool(_snapshot_dir)
+
+
+def encode(data) -> bytes:
+    # Byte-for-byte what JSONResponse would send for the same content
+    return dumps(data)
+
+
+def _path(map_id: str, version: int) -> str:
+    return os.path.join(_snapshot_dir, f"{map_id}-{version}.json.gz")
+
+
+def _read(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write(map_id: str, version: int, body: bytes) -> bytes:
+    compressed = gzip.compress(body, mtime=0)
+    path = _path(map_id, version)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp, path)
+    # Older versions are never served again
+    for old in glob.glob(os.path.join(_snapshot_dir, f"{map_id}-*.json.gz")):
+        if old != path:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    return compressed
+
+
+def _remove(map_id: str) -> None:
+    for path in glob.glob(os.path.join(_snapshot_dir, f"{map_id}-*.json.gz")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def load(map_id: str, version: int) -> bytes | None:
+    """Return the gzip-compressed snapshot of a map at ``version``, if stored."""
+    if not _snapshot_dir:
+        return None
+    return await asyncio.to_thread(_read, _path(map_id, version))
+
+
+async def store(map_id: str, version: int, body: bytes) -> bytes:
+    """Compress and persist a serialized map; returns the compressed bytes."""
+    if not _snapshot_dir:
+        return gzip.compress(body, mtime=0)
+    try:
+        return await asyncio.to_thread(_write, map_id, version, body)
+    except OSError:
+        logger.exception("Failed to write snapshot for map %s", map_id)
+        return gzip.compress(body, mtime=0)
+
+
+async def invalidate(map_id: str) -> None:
+    if _snapshot_dir:
+        await asyncio.to_thread(_remove, map_id)
@@ -3,14 +3,14 @@ from __future__ import annotations
 import uuid
 from datetime import datetime, timezone
 
+from backend import events
 from backend.db import get_db
 
 
 async def create_team(name: str, owner_id: str) -> dict:
     team_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute(
             "INSERT INTO teams (id, name, owner_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
             (team_id, name, owner_id, now, now),
@@ -22,13 +22,10 @@ async def create_team(name: str, owner_id: str) -> dict:
         )
         await db.commit()
         return {"id": team_id, "name": name, "owner_id": owner_id, "created_at": now, "updated_at": now}
-    finally:
-        await db.close()
 
 
 async def list_user_teams(user_id: str) -> list[dict]:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             """SELECT t.id, t.name, t.owner_id, t.created_at, t.updated_at, tm.role
                FROM teams t
@@ -39,24 +36,18 @@ async def list_user_teams(user_id: str) -> list[dict]:
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def get_team(team_id: str) -> dict | None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("SELECT * FROM teams WHERE id = ?", (team_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
-    finally:
-        await db.close()
 
 
 async def update_team(team_id: str, name: str) -> dict | None:
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         await db.execute(
             "UPDATE teams SET name = ?, updated_at = ? WHERE id = ?",
             (name, now, team_id),
@@ -65,23 +56,20 @@ async def update_team(team_id: str, name: str) -> dict | None:
         cursor = await db.execute("SELECT * FROM teams WHERE id = ?", (team_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
-    finally:
-        await db.close()
 
 
 async def delete_team(team_id: str) -> bool:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute("DELETE FROM teams WHERE id = ?", (team_id,))
         await db.commit()
-        return cursor.rowcount > 0
-    finally:
-        await db.close()
+        deleted = cursor.rowcount > 0
+    if deleted:
+        await events.emit(events.ACCESS_CHANGED, team_id=team_id)
+    return deleted
 
 
 async def list_team_members(team_id: str) -> list[dict]:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             """SELECT u.id, u.username, u.email, u.display_name, tm.role, tm.created_at
                FROM team_members tm
@@ -92,14 +80,11 @@ async def list_team_members(team_id: str) -> list[dict]:
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def add_team_member(team_id: str, user_id: str, role: str = "viewer") -> dict | None:
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         # Check if already a member
         cursor = await db.execute(
             "SELECT team_id FROM team_members WHERE team_id = ? AND user_id = ?",
@@ -114,26 +99,23 @@ async def add_team_member(team_id: str, user_id: str, role: str = "viewer") -> d
         )
         await db.commit()
         return {"team_id": team_id, "user_id": user_id, "role": role}
-    finally:
-        await db.close()
 
 
 async def update_member_role(team_id: str, user_id: str, role: str) -> bool:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "UPDATE team_members SET role = ? WHERE team_id = ? AND user_id = ?",
             (role, team_id, user_id),
         )
         await db.commit()
-        return cursor.rowcount > 0
-    finally:
-        await db.close()
+        updated = cursor.rowcount > 0
+    if updated:
+        await events.emit(events.ACCESS_CHANGED, team_id=team_id, user_id=user_id)
+    return updated
 
 
 async def remove_team_member(team_id: str, user_id: str) -> bool:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         # Cannot remove the owner
         cursor = await db.execute(
             "SELECT role FROM team_members WHERE team_id = ? AND user_id = ?",
@@ -148,9 +130,10 @@ async def remove_team_member(team_id: str, user_id: str) -> bool:
             (team_id, user_id),
         )
         await db.commit()
-        return cursor.rowcount > 0
-    finally:
-        await db.close()
+        removed = cursor.rowcount > 0
+    if removed:
+        await events.emit(events.ACCESS_CHANGED, team_id=team_id, user_id=user_id)
+    return removed
 
 
 # --- Invitations ---
@@ -158,8 +141,7 @@ async def remove_team_member(team_id: str, user_id: str) -> bool:
 async def create_invitation(team_id: str, inviter_id: str, invitee_email: str, role: str = "viewer") -> dict:
     inv_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
-    db = await get_db()
-    try:
+    async with get_db() as db:
         # Check if invitation already pending
         cursor = await db.execute(
             "SELECT id FROM team_invitations WHERE team_id = ? AND invitee_email = ? AND status = 'pending'",
@@ -175,13 +157,10 @@ async def create_invitation(team_id: str, inviter_id: str, invitee_email: str, r
         )
         await db.commit()
         return {"id": inv_id, "team_id": team_id, "invitee_email": invitee_email, "role": role, "status": "pending"}
-    finally:
-        await db.close()
 
 
 async def list_user_invitations(email: str) -> list[dict]:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             """SELECT i.id, i.team_id, i.invitee_email, i.role, i.status, i.created_at,
                       t.name as team_name, u.display_name as inviter_name
@@ -194,13 +173,10 @@ async def list_user_invitations(email: str) -> list[dict]:
         )
         rows = await cursor.fetchall()
         return [dict(r) for r in rows]
-    finally:
-        await db.close()
 
 
 async def accept_invitation(invitation_id: str, user_id: str) -> dict | None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT * FROM team_invitations WHERE id = ? AND status = 'pending'",
             (invitation_id,),
@@ -234,14 +210,12 @@ async def accept_invitation(invitation_id: str, user_id: str) -> dict | None:
             (invitation_id,),
         )
         await db.commit()
-        return {"id": invitation_id, "status": "accepted", "team_id": inv["team_id"]}
-    finally:
-        await db.close()
+    await events.emit(events.ACCESS_CHANGED, team_id=inv["team_id"], user_id=user_id)
+    return {"id": invitation_id, "status": "accepted", "team_id": inv["team_id"]}
 
 
 async def decline_invitation(invitation_id: str, user_id: str) -> dict | None:
-    db = await get_db()
-    try:
+    async with get_db() as db:
         cursor = await db.execute(
             "SELECT * FROM team_invitations WHERE id = ? AND status = 'pending'",
             (invitation_id,),
@@ -262,5 +236,3 @@ async def decline_invitation(invitation_id: str, user_id: str) -> dict | None:
         )
         await db.commit()
         return {"id": invitation_id, "status": "declined"}
-    finally:
-        await db.close()
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from backend import events
+from backend.db import get_db
+from backend.models import NodeTree
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self):
+        self.refs = 0
+        self.tree: NodeTree | None = None
+        self.stale = True
+        # Bumped by every change the tree could not apply in place
+        self.requests = 0
+        self.loader: asyncio.Task | None = None
+
+
+class TreeCache:
+    """In-memory structure of maps that have live WebSocket rooms.
+
+    A map is loaded when its first client joins and dropped when the last
+    one leaves. Committed node mutations of this process arrive as
+    map:changed events and are applied in version order; changes made by
+    other workers, or any gap in the versions, mark the tree stale until it
+    catches up from change_log. ``get`` only hands out trees that are
+    current, so callers fall back to SQL while one is loading or stale.
+    SQLite stays the source of truth.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, _Entry] = {}
+        # Metrics
+        self.loads = 0
+        self.catch_ups = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def retain(self, map_id: str) -> None:
+        entry = self._entries.get(map_id)
+        if entry is None:
+            entry = self._entries[map_id] = _Entry()
+            self._refresh(map_id, entry)
+        entry.refs += 1
+
+    def release(self, map_id: str) -> None:
+        entry = self._entries.get(map_id)
+        if entry is None:
+            return
+        entry.refs -= 1
+        if entry.refs <= 0:
+            del self._entries[map_id]
+            if entry.loader is not None:
+                entry.loader.cancel()
+
+    def get(self, map_id: str) -> NodeTree | None:
+        """The map's tree if it is loaded and current, else None."""
+        entry = self._entries.get(map_id)
+        if entry is None:
+            return None
+        if entry.tree is None or entry.stale:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.tree
+
+    def _refresh(self, map_id: str, entry: _Entry) -> None:
+        entry.stale = True
+        entry.requests += 1
+        if entry.loader is None or entry.loader.done():
+            entry.loader = asyncio.create_task(self._load(map_id, entry), name=f"tree-load:{map_id}")
+
+    async def _load(self, map_id: str, entry: _Entry) -> None:
+        try:
+            while self._entries.get(map_id) is entry:
+                seen = entry.requests
+                if entry.tree is None:
+                    entry.tree = await self._read_tree(map_id)
+                    self.loads += 1
+                else:
+                    await self._catch_up(map_id, entry.tree)
+                    self.catch_ups += 1
+                if entry.requests == seen:
+                    entry.stale = False
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to load the tree of map %s", map_id)
+            entry.tree = None
+
+    @staticmethod
+    async def _read_tree(map_id: str) -> NodeTree:
+        async with get_db() as db:
+            # One read transaction so the nodes match the version
+            await db.execute("BEGIN")
+            try:
+                cursor = await db.execute("SELECT version FROM maps WHERE id = ?", (map_id,))
+                row = await cursor.fetchone()
+                version = row["version"] if row else 0
+                cursor = await db.execute(
+                    "SELECT id, parent_id, order_key FROM nodes WHERE map_id = ?", (map_id,),
+                )
+                rows = await cursor.fetchall()
+            finally:
+                await db.commit()
+        return NodeTree.from_rows(rows, version)
+
+    @staticmethod
+    async def _catch_up(map_id: str, tree: NodeTree) -> None:
+        """Replay change_log entries newer than the tree against current rows."""
+        since = tree.version
+        async with get_db() as db:
+            await db.execute("BEGIN")
+            try:
+                cursor = await db.execute("SELECT version FROM maps WHERE id = ?", (map_id,))
+                row = await cursor.fetchone()
+                version = row["version"] if row else since
+                cursor = await db.execute(
+                    """SELECT c.action, c.node_id, n.id, n.parent_id, n.order_key
+                       FROM change_log c LEFT JOIN nodes n ON n.id = c.node_id AND n.map_id = c.map_id
+                       WHERE c.map_id = ? AND c.version > ? ORDER BY c.version, c.id""",
+                    (map_id, since),
+                )
+                rows = await cursor.fetchall()
+            finally:
+                await db.commit()
+        # Rows carry each touched node's current state. Move the survivors
+        # first (parents first) so their subtrees leave deleted parents, then
+        # drop the nodes that no longer exist.
+        current, gone = {}, set()
+        for _action, node_id, found, parent_id, order_key in rows:
+            if found is None:
+                gone.add(node_id)
+                current.pop(node_id, None)
+            else:
+                current[node_id] = (node_id, parent_id, order_key)
+                gone.discard(node_id)
+        tree.upsert_many(current.values())
+        for node_id in gone:
+            tree.remove(node_id)
+        tree.version = version
+
+    async def on_map_changed(self, map_id: str | None = None, result: dict | None = None, **_) -> None:
+        entry = self._entries.get(map_id)
+        if entry is None or not result:
+            return
+        tree = entry.tree
+        version = result.get("version")
+        if tree is not None and not entry.stale and version == tree.version + 1:
+            _apply(tree, result)
+            tree.version = version
+        elif tree is None or version is None or version > tree.version:
+            self._refresh(map_id, entry)
+
+    async def on_remote_change(self, map_id: str | None = None, version: int | None = None, **_) -> None:
+        entry = self._entries.get(map_id)
+        if entry is None:
+            return
+        if entry.tree is None or version is None or version > entry.tree.version:
+            self._refresh(map_id, entry)
+
+    def stats(self) -> dict:
+        trees = [e.tree for e in self._entries.values() if e.tree is not None]
+        nodes = sum(len(t) for t in trees)
+        memory = sum(t.memory() for t in trees)
+        return {
+            "maps": len(self._entries),
+            "nodes": nodes,
+            "bytes": memory,
+            "bytes_per_node": round(memory / nodes, 1) if nodes else 0,
+            "stale": sum(1 for e in self._entries.values() if e.stale),
+            "loads": self.loads,
+            "catch_ups": self.catch_ups,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _apply(tree: NodeTree, result: dict) -> None:
+    """Apply a committed node_service write result to the tree."""
+    if "results" in result:
+        for op in result["results"]:
+            if op["op"] == "delete":
+                tree.remove(op["id"])
+            else:
+                node = op["node"]
+                tree.upsert(node["id"], node["parent_id"], node["order_key"])
+    elif "deleted_ids" in result:
+        tree.remove(result["deleted_ids"][0])
+    elif "restored" in result:
+        for node in result["restored"]:
+            tree.upsert(node["id"], node["parent_id"], node["order_key"])
+    elif "order_keys" in result:
+        for node_id, key in result["order_keys"].items():
+            tree.upsert(node_id, result["parent_id"], key)
+    else:
+        tree.upsert(result["id"], result["parent_id"], result["order_key"])
+
+
+tree_cache = TreeCache()
+events.subscribe(events.MAP_CHANGED, tree_cache.on_map_changed)
+events.subscribe(events.REMOTE_MAP_CHANGED, tree_cache.on_remote_change)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+from backend.db import get_db, get_pool
+
+logger = logging.getLogger(__name__)
+
+WriteJob = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class WriteQueue:
+    """Single-writer group commit for node mutations.
+
+    One task owns a dedicated connection and drains submitted jobs. Jobs that
+    arrive within ``batch_window_ms`` of the first one (up to ``max_batch``)
+    run inside one transaction, each wrapped in its own SAVEPOINT so a failing
+    job is rolled back alone, and the batch pays a single commit/fsync.
+    """
+
+    def __init__(self, batch_window_ms: float = 2.0, max_batch: int = 64):
+        self.batch_window = max(0.0, batch_window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: asyncio.Queue[tuple[WriteJob, asyncio.Future] | None] = asyncio.Queue()
+        self._db: aiosqlite.Connection | None = None
+        self._task: asyncio.Task | None = None
+        # Metrics
+        self.batches = 0
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.max_batch_seen = 0
+        self.commit_time_total = 0.0
+
+    async def start(self) -> None:
+        self._db = await get_pool().open_connection()
+        self._task = asyncio.create_task(self._run(), name="write-queue")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def submit(self, job: WriteJob) -> Any:
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((job, fut))
+        return await fut
+
+    async def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch, stopping = await self._collect(item)
+            try:
+                await self._apply(batch)
+            except Exception as exc:
+                logger.exception("Write batch failed")
+                # Never leave a caller waiting on a batch that did not run
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+        # Drain anything submitted before stop() so callers are not left hanging
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                await self._apply([item])
+
+    async def _apply(self, batch: list[tuple[WriteJob, asyncio.Future]]) -> None:
+        db = self._db
+        outcomes: list[tuple[asyncio.Future, Any, BaseException | None]] = []
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for job, fut in batch:
+                if fut.cancelled():
+                    continue
+                await db.execute("SAVEPOINT job")
+                try:
+                    result = await job(db)
+                except Exception as exc:
+                    await db.execute("ROLLBACK TO job")
+                    await db.execute("RELEASE job")
+                    outcomes.append((fut, None, exc))
+                else:
+                    await db.execute("RELEASE job")
+                    outcomes.append((fut, result, None))
+            start = time.perf_counter()
+            await db.commit()
+            self.commit_time_total += time.perf_counter() - start
+        except Exception as exc:
+            # Also reached when BEGIN itself fails (e.g. the database is locked)
+            if db.in_transaction:
+                await db.rollback()
+            outcomes = [(fut, None, exc) for _, fut in batch if not fut.cancelled()]
+
+        self.batches += 1
+        self.jobs += len(outcomes)
+        self.max_batch_seen = max(self.max_batch_seen, len(outcomes))
+        for fut, result, exc in outcomes:
+            if fut.done():
+                continue
+            if exc is not None:
+                self.failed_jobs += 1
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        batches = self.batches or 1
+        return {
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "failed_jobs": self.failed_jobs,
+            "batch_size_avg": round(self.jobs / batches, 2),
+            "batch_size_max": self.max_batch_seen,
+            "commit_ms_avg": round(self.commit_time_total / batches * 1000, 3),
+        }
+
+
+_write_queue: WriteQueue | None = None
+
+
+async def init_write_queue(**options) -> WriteQueue:
+    global _write_queue
+    queue = WriteQueue(**options)
+    await queue.start()
+    _write_queue = queue
+    return queue
+
+
+async def close_write_queue() -> None:
+    global _write_queue
+    if _write_queue is not None:
+        await _write_queue.stop()
+        _write_queue = None
+
+
+def get_write_queue() -> WriteQueue | None:
+    return _write_queue
+
+
+async def run_write(job: WriteJob) -> Any:
+    """Run ``job(db)`` inside a write transaction and return its result.
+
+    Goes through the group-commit writer when it is running, otherwise
+    (scripts, tools) falls back to a pooled connection and its own commit.
+    """
+    if _write_queue is None:
+        async with get_db() as db:
+            result = await job(db)
+            await db.commit()
+            return result
+    return await _write_queue.submit(job)
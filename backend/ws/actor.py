@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+# Seconds an actor with nothing to do waits before its task exits
+IDLE_TIMEOUT = 30.0
+
+MapOp = Callable[[], Awaitable[Any]]
+
+# Map whose actor is running the current op (inherited by tasks it spawns)
+_current_map: contextvars.ContextVar[str | None] = contextvars.ContextVar("map_actor", default=None)
+
+
+class MapActor:
+    """One map's mutation pipeline: runs submitted ops one at a time, in order."""
+
+    def __init__(self, map_id: str, registry: MapActors):
+        self.map_id = map_id
+        self._registry = registry
+        self._ops: deque[tuple[MapOp, asyncio.Future, float]] = deque()
+        self._wakeup = asyncio.Event()
+        self.stopping = False
+        self.task = asyncio.create_task(self._run(), name=f"map-actor:{map_id}")
+        # Metrics
+        self.processed = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def submit(self, op: MapOp) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._ops.append((op, fut, time.perf_counter()))
+        self._wakeup.set()
+        return fut
+
+    async def _run(self) -> None:
+        _current_map.set(self.map_id)
+        while True:
+            while self._ops:
+                await self._process(*self._ops.popleft())
+            if self.stopping:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if not self._ops:
+                    self._registry._retire(self)
+                    return
+
+    async def _process(self, op: MapOp, fut: asyncio.Future, queued_at: float) -> None:
+        start = time.perf_counter()
+        try:
+            result = await op()
+        except Exception as exc:
+            if not fut.done():
+                fut.set_exception(exc)
+        else:
+            if not fut.done():
+                fut.set_result(result)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.processed += 1
+            self.wait_total += start - queued_at
+            self.run_total += elapsed
+            self.run_max = max(self.run_max, elapsed)
+
+    def stats(self) -> dict:
+        processed = self.processed or 1
+        return {
+            "queue_depth": len(self._ops),
+            "ops": self.processed,
+            "wait_ms_avg": round(self.wait_total / processed * 1000, 3),
+            "run_ms_avg": round(self.run_total / processed * 1000, 3),
+            "run_ms_max": round(self.run_max * 1000, 3),
+        }
+
+
+class MapActors:
+    """Serializes each map's mutations, acks and broadcasts in this process.
+
+    A map's op (write + ack + broadcast) runs only after the previous one has
+    finished, so the room sees versions in the order ``maps.version`` assigned
+    them and never interleaved, while different maps still run concurrently
+    and share the write queue's group commits. Actors start on first use and
+    exit after ``IDLE_TIMEOUT`` seconds without work. Ordering across workers
+    is still only as good as the Redis fan-out delivers it.
+    """
+
+    def __init__(self):
+        self._actors: dict[str, MapActor] = {}
+        # Metrics of actors that already exited
+        self.retired = 0
+        self.retired_ops = 0
+
+    async def run(self, map_id: str, op: MapOp) -> Any:
+        """Run ``op()`` on the map's actor and return its result.
+
+        Called from inside one of the map's ops (directly or from a task it
+        spawned) it runs inline, as the actor is already busy with the caller.
+        The op finishes even if the caller is cancelled.
+        """
+        if _current_map.get() == map_id:
+            return await op()
+        actor = self._actors.get(map_id)
+        if actor is None:
+            actor = self._actors[map_id] = MapActor(map_id, self)
+        return await asyncio.shield(actor.submit(op))
+
+    def _retire(self, actor: MapActor) -> None:
+        if self._actors.get(actor.map_id) is actor:
+            del self._actors[actor.map_id]
+        self.retired += 1
+        self.retired_ops += actor.processed
+
+    async def stop(self) -> None:
+        """Let queued ops finish, then stop every actor."""
+        actors = list(self._actors.values())
+        self._actors.clear()
+        for actor in actors:
+            actor.stopping = True
+            actor._wakeup.set()
+        await asyncio.gather(*(a.task for a in actors), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._actors),
+            "retired": self.retired,
+            "ops": self.retired_ops + sum(a.processed for a in self._actors.values()),
+            "maps": {map_id: actor.stats() for map_id, actor in self._actors.items()},
+        }
+
+
+actors = MapActors()
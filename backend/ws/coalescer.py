@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from backend import events
+from backend.services import node_service
+from backend.ws.actor import actors
+from backend.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingEdit:
+    map_id: str
+    node_id: str
+    user_id: str
+    username: str
+    content: str
+    timer: asyncio.Task | None = None
+
+
+class EditCoalescer:
+    """Write-behind buffer for typing-driven content edits.
+
+    Content updates sent with ``coalesce`` are broadcast immediately but kept
+    per (node, user) and persisted as one update (one version, one history
+    row) when the window opened by the first edit closes, or earlier on
+    blur, unlock, a non-coalesced edit of the node, or disconnect. The window
+    is fixed from the first edit, so a crash loses at most ``window_ms``.
+    """
+
+    def __init__(self, window_ms: float = 1000.0):
+        self.window = max(0.0, window_ms) / 1000
+        self._pending: dict[tuple[str, str, str], PendingEdit] = {}
+        # Metrics
+        self.edits = 0
+        self.writes = 0
+        self.dropped = 0
+
+    def configure(self, window_ms: float) -> None:
+        self.window = max(0.0, window_ms) / 1000
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, map_id: str, node_id: str, user_id: str, username: str, content: str) -> dict | None:
+        """Buffer a content edit and return the preview to broadcast.
+
+        Returns None if the node does not exist, or a lock_conflict dict.
+        Both are checked once per window; the flush checks the lock again.
+        """
+        key = (map_id, node_id, user_id)
+        edit = self._pending.get(key)
+        if edit is None:
+            if not await node_service.node_belongs_to_map(node_id, map_id):
+                return None
+            lock_owner = await node_service.check_lock_owner(node_id, map_id, user_id)
+            if lock_owner:
+                return {"lock_conflict": True, "locked_by": lock_owner}
+            edit = self._pending.get(key)
+        if edit is None:
+            edit = PendingEdit(map_id, node_id, user_id, username, content)
+            edit.timer = asyncio.create_task(self._expire(key, edit))
+            self._pending[key] = edit
+        edit.content = content
+        self.edits += 1
+        # Same shape as the node:update delta sent once the edit is persisted
+        return node_service.node_delta({
+            "id": node_id,
+            "content": content,
+            "last_edited_by": user_id,
+            "last_edited_by_name": username,
+            "last_edited_at": datetime.now(timezone.utc).isoformat(),
+        }, ("content",))
+
+    async def _expire(self, key: tuple[str, str, str], edit: PendingEdit) -> None:
+        await asyncio.sleep(self.window)
+        if self._pending.get(key) is edit:
+            await self._persist(self._pending.pop(key))
+
+    async def flush(self, map_id: str, node_id: str, user_id: str) -> None:
+        edit = self._pending.pop((map_id, node_id, user_id), None)
+        if edit is not None:
+            self._cancel_timer(edit)
+            # The edit is no longer pending; finish the write even if the
+            # caller (e.g. a closing WebSocket handler) is cancelled.
+            await asyncio.shield(self._persist(edit))
+
+    async def flush_user(self, map_id: str, user_id: str) -> None:
+        for key in [k for k in self._pending if k[0] == map_id and k[2] == user_id]:
+            await self.flush(*key)
+
+    async def flush_all(self) -> None:
+        for key in list(self._pending):
+            await self.flush(*key)
+
+    @staticmethod
+    def _cancel_timer(edit: PendingEdit) -> None:
+        if edit.timer is not None and edit.timer is not asyncio.current_task():
+            edit.timer.cancel()
+
+    async def _persist(self, edit: PendingEdit) -> None:
+        await actors.run(edit.map_id, lambda: self._write(edit))
+
+    async def _write(self, edit: PendingEdit) -> None:
+        try:
+            result = await node_service.update_node(
+                edit.map_id, edit.node_id, {"content": edit.content},
+                user_id=edit.user_id, username=edit.username,
+            )
+        except Exception:
+            logger.exception("Failed to persist coalesced edit of node %s", edit.node_id)
+            result = None
+        if not result or result.get("lock_conflict"):
+            self.dropped += 1
+            return
+        self.writes += 1
+        # Everyone, including the editor, learns the persisted version
+        message = {"type": "node:update", "version": result["version"]}
+        await manager.broadcast(
+            edit.map_id,
+            {**message, "data": node_service.node_delta(result, ("content",))},
+            full={**message, "data": result},
+        )
+
+    async def on_locks_changed(
+        self, map_id: str, action: str | None = None, lock: dict | None = None,
+        locks: list[dict] | None = None, **_,
+    ) -> None:
+        if action not in ("released", "expired"):
+            return
+        for released in locks if locks is not None else [lock]:
+            await self.flush(map_id, released["node_id"], released.get("user_id"))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window * 1000, 3),
+            "pending": len(self._pending),
+            "edits": self.edits,
+            "writes": self.writes,
+            "dropped": self.dropped,
+        }
+
+
+coalescer = EditCoalescer()
+events.subscribe(events.LOCKS_CHANGED, coalescer.on_locks_changed)
@@ -0,0 +1,49 @@
+"""Wire codecs for WebSocket frames.
+
+JSON text frames are the default. Clients that offer the
+``mindmap.msgpack.v1`` subprotocol get the same messages as MessagePack
+binary frames, when the optional ``msgpack`` package is installed.
+"""
+from __future__ import annotations
+
+import json
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_SUBPROTOCOL = "mindmap.msgpack.v1"
+
+
+def encode_json(message: dict) -> str:
+    # Same encoding as WebSocket.send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_msgpack(message: dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+ENCODERS = {JSON: encode_json}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = encode_msgpack
+
+
+def encode(codec: str, message: dict) -> str | bytes:
+    return ENCODERS[codec](message)
+
+
+def decode(codec: str, frame: str | bytes) -> dict:
+    if codec == MSGPACK:
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
+
+
+def negotiate(offered: list[str]) -> tuple[str, str | None]:
+    """Pick (codec, subprotocol to accept) from the client's offered subprotocols."""
+    if MSGPACK_SUBPROTOCOL in offered and MSGPACK in ENCODERS:
+        return MSGPACK, MSGPACK_SUBPROTOCOL
+    return JSON, None
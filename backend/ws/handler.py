@@ -5,14 +5,28 @@ import uuid
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 
 from backend.auth import decode_token
-from backend.services import node_service, permission_service
-from backend.ws.manager import manager
+from backend.order_keys import is_valid_key
+from backend.services import map_service, node_service, permission_service
+from backend.tree_cache import tree_cache
+from backend.ws import codec
+from backend.ws.actor import actors
+from backend.ws.coalescer import coalescer
+from backend.ws.manager import Client, manager
 
 router = APIRouter()
 
+# Versioned mutations, run through the map's actor
+NODE_OPS = ("node:create", "node:update", "node:delete", "node:move", "node:batch", "node:reorder")
+
 
 @router.websocket("/ws/{map_id}")
-async def websocket_endpoint(ws: WebSocket, map_id: str, token: str = Query(default="")):
+async def websocket_endpoint(
+    ws: WebSocket,
+    map_id: str,
+    token: str = Query(default=""),
+    rows: str = Query(default=""),
+    since: int | None = Query(default=None),
+):
     # Authenticate via query param token
     user = None
     if token:
@@ -24,126 +38,312 @@ async def websocket_endpoint(ws: WebSocket, map_id: str, token: str = Query(defa
         await ws.close(code=4001, reason="Authentication required")
         return
 
-    if not await permission_service.check_map_access(user["id"], map_id, "view"):
+    role, team_id = await permission_service.get_map_role(user["id"], map_id)
+    if role is None or not permission_service.has_permission(role, "view"):
         await ws.close(code=4003, reason="Access denied")
         return
 
     client_id = str(uuid.uuid4())
-    room = await manager.connect(map_id, client_id, ws)
+    # ?rows=full opts into full node rows instead of field-level update deltas
+    wire_codec, subprotocol = codec.negotiate(ws.scope.get("subprotocols", []))
+    client = Client(
+        client_id=client_id, ws=ws, user_id=user["id"], role=role, team_id=team_id,
+        full_rows=rows == "full", codec=wire_codec,
+    )
+    version = await map_service.get_map_version(map_id) or 0
+    room = await manager.connect(map_id, client, subprotocol=subprotocol, version=version)
+    # Keep the map's structure in memory while anyone is connected
+    await tree_cache.retain(map_id)
 
     # Send client its own id and current version
-    await ws.send_json({
+    manager.send(client, {
         "type": "connected",
         "client_id": client_id,
         "version": room.version,
         "user_id": user["id"],
     })
 
+    # ?since=N resumes: replay missed ops from the room buffer, else a DB delta
+    if since is not None and since < room.version:
+        if not manager.replay(room, client, since):
+            delta = await map_service.get_sync(map_id, since)
+            if delta is not None:
+                manager.send(client, {"type": "sync", "data": delta, "version": delta["version"]})
+        else:
+            # Lock events are not versioned, so send the current set
+            manager.send(client, {"type": "locks", "data": await node_service.get_locks_for_map(map_id)})
+
     try:
         while True:
-            data = await ws.receive_json()
+            data = await _receive(ws, client)
+            if not isinstance(data, dict):
+                manager.send(client, {"type": "error", "message": "Malformed message"})
+                continue
             msg_type = data.get("type", "")
             payload = data.get("data", {})
 
-            result = None
-
-            if msg_type.startswith("node:"):
-                if not await permission_service.check_map_access(user["id"], map_id, "edit"):
-                    await ws.send_json({"type": "error", "message": "No edit access"})
+            if msg_type.startswith(("node:", "lock:")):
+                if not client.can("edit"):
+                    manager.send(client, {"type": "error", "message": "No edit access"})
                     continue
 
-            if msg_type == "node:create":
-                parent_id = payload.get("parent_id")
-                if not parent_id:
-                    await ws.send_json({"type": "error", "message": "Missing parent_id"})
-                    continue
-                result = await node_service.create_node(
-                    map_id=map_id,
-                    parent_id=parent_id,
-                    content=payload.get("content", ""),
-                    position=payload.get("position", 0),
-                    style=payload.get("style", "{}"),
-                    node_id=payload.get("id"),
-                    user_id=user["id"],
-                    username=user["username"],
-                )
-                if result is None:
-                    await ws.send_json({"type": "error", "message": "Parent node not found in this map"})
-                    continue
-            elif msg_type == "node:update":
+            if msg_type in ("lock:acquire", "lock:release"):
+                # Lock changes reach the room as lock:* events from node_service
                 node_id = payload.get("id")
                 if not node_id:
-                    await ws.send_json({"type": "error", "message": "Missing node id"})
+                    manager.send(client, {"type": "error", "message": "Missing node id"})
                     continue
-                result = await node_service.update_node(
-                    map_id=map_id,
-                    node_id=node_id,
-                    changes=payload.get("changes", {}),
-                    user_id=user["id"],
-                    username=user["username"],
-                )
-                if result is None:
-                    await ws.send_json({"type": "error", "message": "Node not found"})
-                    continue
-            elif msg_type == "node:delete":
-                node_id = payload.get("id")
-                if not node_id:
-                    await ws.send_json({"type": "error", "message": "Missing node id"})
+                if not await node_service.node_belongs_to_map(node_id, map_id):
+                    manager.send(client, {"type": "error", "message": "Node not found"})
                     continue
-                deleted = await node_service.delete_node(map_id, node_id, user_id=user["id"], username=user["username"])
-                if deleted is None:
-                    await ws.send_json({"type": "error", "message": "Node not found"})
+                if msg_type == "lock:acquire":
+                    result = await node_service.acquire_lock(node_id, map_id, user["id"], user["username"])
+                    if result.get("locked") is False:
+                        manager.send(client, {"type": "error", "message": f"{result['locked_by']} 正在编辑该节点"})
+                        continue
+                else:
+                    await node_service.release_lock(node_id, map_id, user["id"])
+                    result = {"node_id": node_id}
+                manager.send(client, {"type": "ack", "original_type": msg_type, "data": result})
+                continue
+
+            if msg_type in ("lock:acquire_batch", "lock:release_batch"):
+                node_ids = payload.get("ids") or []
+                if not isinstance(node_ids, list) or len(node_ids) > node_service.MAX_LOCK_BATCH:
+                    manager.send(client, {"type": "error", "message": f"ids must be a list of at most {node_service.MAX_LOCK_BATCH} node ids"})
                     continue
-                result = {"id": node_id}
-            elif msg_type == "node:move":
+                if msg_type == "lock:acquire_batch":
+                    if await node_service.missing_nodes(map_id, node_ids):
+                        manager.send(client, {"type": "error", "message": "Node not found"})
+                        continue
+                    result = await node_service.acquire_locks(node_ids, map_id, user["id"], user["username"])
+                    if not result["locked"]:
+                        manager.send(client, {
+                            "type": "error",
+                            "message": "部分节点正在被其他用户编辑",
+                            "conflicts": result["conflicts"],
+                        })
+                        continue
+                else:
+                    result = {"released": await node_service.release_locks(node_ids, map_id, user["id"])}
+                manager.send(client, {"type": "ack", "original_type": msg_type, "data": result})
+                continue
+
+            if msg_type == "node:update" and payload.get("coalesce") and coalescer.enabled:
                 node_id = payload.get("id")
-                parent_id = payload.get("parent_id")
-                if not node_id or not parent_id:
-                    await ws.send_json({"type": "error", "message": "Missing node id or parent_id"})
-                    continue
-                result = await node_service.move_node(
-                    map_id=map_id,
-                    node_id=node_id,
-                    new_parent_id=parent_id,
-                    position=payload.get("position", 0),
-                )
-                if result is None:
-                    await ws.send_json({"type": "error", "message": "Node not found"})
+                changes = payload.get("changes", {})
+                if node_id and set(changes) == {"content"}:
+                    # Typing: broadcast now, persist when the coalescing window closes
+                    preview = await coalescer.submit(map_id, node_id, user["id"], user["username"], changes["content"])
+                    if preview is None:
+                        manager.send(client, {"type": "error", "message": "Node not found"})
+                    elif preview.get("lock_conflict"):
+                        manager.send(client, {"type": "error", "message": f"{preview['locked_by']} 正在编辑该节点"})
+                    else:
+                        manager.send(client, {"type": "ack", "original_type": msg_type, "data": preview, "pending": True})
+                        await manager.broadcast(
+                            map_id,
+                            {"type": msg_type, "data": preview, "pending": True, "client_id": client_id},
+                            exclude_client=client_id,
+                        )
                     continue
-            else:
-                await ws.send_json({"type": "error", "message": f"Unknown type: {msg_type}"})
-                continue
 
-            version = manager.next_version(room)
-
-            # Acknowledge to sender
-            await ws.send_json({
-                "type": "ack",
-                "original_type": msg_type,
-                "data": result,
-                "version": version,
-            })
-
-            # Broadcast to others
-            await manager.broadcast(
-                room,
-                {
-                    "type": msg_type,
-                    "data": result,
-                    "version": version,
-                    "client_id": client_id,
-                },
-                exclude_client=client_id,
-            )
+            if msg_type == "node:blur":
+                node_id = payload.get("id")
+                if node_id:
+                    await coalescer.flush(map_id, node_id, user["id"])
+            elif msg_type in NODE_OPS:
+                # Write, ack and broadcast in the map's order (see backend.ws.actor)
+                await actors.run(map_id, lambda: _apply_node_op(client, user, map_id, msg_type, payload))
+            else:
+                manager.send(client, {"type": "error", "message": f"Unknown type: {msg_type}"})
 
     except WebSocketDisconnect:
         pass
     finally:
         await manager.disconnect(map_id, client_id)
+        tree_cache.release(map_id)
+        await coalescer.flush_user(map_id, user["id"])
         # Notify others
-        room = manager.get_room(map_id)
-        if room:
-            await manager.broadcast(room, {
-                "type": "peer:disconnect",
-                "client_id": client_id,
-            })
+        await manager.broadcast(map_id, {
+            "type": "peer:disconnect",
+            "client_id": client_id,
+        })
+
+
+async def _receive(ws: WebSocket, client: Client):
+    """Next decoded message; None for a frame that does not decode.
+
+    Text frames are always JSON. Binary frames use the negotiated codec,
+    so a msgpack client may still send the odd JSON text frame.
+    """
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    try:
+        if message.get("text") is not None:
+            return codec.decode(codec.JSON, message["text"])
+        return codec.decode(client.codec, message["bytes"])
+    except ValueError:
+        return None
+
+
+def _valid_order_key(key) -> bool:
+    return key is None or is_valid_key(key)
+
+
+async def _apply_node_op(client: Client, user: dict, map_id: str, msg_type: str, payload: dict) -> None:
+    """Apply one node mutation, then ack the sender and broadcast it."""
+    client_id = client.client_id
+    result = None
+    # Full-row form of ``result`` for clients that asked for it
+    full_result = None
+
+    if msg_type == "node:create":
+        parent_id = payload.get("parent_id")
+        if not parent_id:
+            manager.send(client, {"type": "error", "message": "Missing parent_id"})
+            return
+        if not _valid_order_key(payload.get("order_key")):
+            manager.send(client, {"type": "error", "message": "Invalid order_key"})
+            return
+        result = await node_service.create_node(
+            map_id=map_id,
+            parent_id=parent_id,
+            content=payload.get("content", ""),
+            position=payload.get("position", 0),
+            style=payload.get("style", "{}"),
+            node_id=payload.get("id"),
+            user_id=user["id"],
+            username=user["username"],
+            order_key=payload.get("order_key"),
+        )
+        if result is None:
+            manager.send(client, {"type": "error", "message": "Parent node not found in this map"})
+            return
+        version = result["version"]
+    elif msg_type == "node:update":
+        node_id = payload.get("id")
+        if not node_id:
+            manager.send(client, {"type": "error", "message": "Missing node id"})
+            return
+        changes = payload.get("changes", {})
+        if not _valid_order_key(changes.get("order_key")):
+            manager.send(client, {"type": "error", "message": "Invalid order_key"})
+            return
+        await coalescer.flush(map_id, node_id, user["id"])
+        result = await node_service.update_node(
+            map_id=map_id,
+            node_id=node_id,
+            changes=changes,
+            user_id=user["id"],
+            username=user["username"],
+        )
+        if result is None:
+            manager.send(client, {"type": "error", "message": "Node not found"})
+            return
+        if result.get("lock_conflict"):
+            manager.send(client, {"type": "error", "message": f"{result['locked_by']} 正在编辑该节点"})
+            return
+        version = result["version"]
+        full_result, result = result, node_service.node_delta(result, node_service.delta_fields(changes))
+    elif msg_type == "node:delete":
+        node_id = payload.get("id")
+        if not node_id:
+            manager.send(client, {"type": "error", "message": "Missing node id"})
+            return
+        await coalescer.flush(map_id, node_id, user["id"])
+        deleted = await node_service.delete_node(map_id, node_id, user_id=user["id"], username=user["username"])
+        if deleted is None:
+            manager.send(client, {"type": "error", "message": "Node not found"})
+            return
+        if deleted.get("lock_conflict"):
+            manager.send(client, {"type": "error", "message": f"{deleted['locked_by']} 正在编辑该节点"})
+            return
+        result = {"id": node_id}
+        version = deleted["version"]
+    elif msg_type == "node:move":
+        node_id = payload.get("id")
+        parent_id = payload.get("parent_id")
+        if not node_id or not parent_id:
+            manager.send(client, {"type": "error", "message": "Missing node id or parent_id"})
+            return
+        if not _valid_order_key(payload.get("order_key")):
+            manager.send(client, {"type": "error", "message": "Invalid order_key"})
+            return
+        result = await node_service.move_node(
+            map_id=map_id,
+            node_id=node_id,
+            new_parent_id=parent_id,
+            position=payload.get("position", 0),
+            order_key=payload.get("order_key"),
+        )
+        if result is None:
+            manager.send(client, {"type": "error", "message": "Node not found"})
+            return
+        if result.get("lock_conflict"):
+            manager.send(client, {"type": "error", "message": f"{result['locked_by']} 正在编辑该节点"})
+            return
+        version = result["version"]
+        full_result, result = result, node_service.node_delta(result, ("parent_id", "position", "order_key"))
+    elif msg_type == "node:batch":
+        ops = payload.get("ops")
+        if not isinstance(ops, list) or not ops or len(ops) > node_service.MAX_NODE_BATCH:
+            manager.send(client, {"type": "error", "message": f"ops must contain 1 to {node_service.MAX_NODE_BATCH} operations"})
+            return
+        batch = await node_service.apply_batch(map_id, ops, user_id=user["id"], username=user["username"])
+        if batch.get("lock_conflict"):
+            manager.send(client, {"type": "error", "message": f"{batch['locked_by']} 正在编辑该节点"})
+            return
+        if "error" in batch:
+            manager.send(client, {"type": "error", "message": batch["error"], "index": batch["index"]})
+            return
+        full_result = {"results": batch["results"]}
+        result = {"results": node_service.batch_deltas(batch["results"])}
+        version = batch["version"]
+    elif msg_type == "node:reorder":
+        parent_id = payload.get("parent_id")
+        ordered_ids = payload.get("ordered_ids")
+        if not parent_id:
+            manager.send(client, {"type": "error", "message": "Missing parent_id"})
+            return
+        if (not isinstance(ordered_ids, list) or not ordered_ids or len(ordered_ids) > node_service.MAX_REORDER
+                or not all(isinstance(node_id, str) for node_id in ordered_ids)):
+            manager.send(client, {"type": "error", "message": f"ordered_ids must contain 1 to {node_service.MAX_REORDER} nodes"})
+            return
+        reordered = await node_service.reorder_children(
+            map_id, parent_id, ordered_ids, user_id=user["id"], username=user["username"],
+        )
+        if reordered is None:
+            manager.send(client, {"type": "error", "message": "Node not found"})
+            return
+        if reordered.get("lock_conflict"):
+            manager.send(client, {"type": "error", "message": f"{reordered['locked_by']} 正在编辑该节点"})
+            return
+        if "error" in reordered:
+            manager.send(client, {"type": "error", "message": reordered["error"]})
+            return
+        result = node_service.reorder_delta(reordered)
+        version = reordered["version"]
+
+    # Acknowledge to sender
+    manager.send(client, {
+        "type": "ack",
+        "original_type": msg_type,
+        "data": full_result if full_result is not None and client.full_rows else result,
+        "version": version,
+    })
+
+    # Broadcast to others (in every worker, via Redis fan-out)
+    message = {
+        "type": msg_type,
+        "data": result,
+        "version": version,
+        "client_id": client_id,
+    }
+    await manager.broadcast(
+        map_id,
+        message,
+        exclude_client=client_id,
+        full={**message, "data": full_result} if full_result is not None else None,
+    )
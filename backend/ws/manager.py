@@ -1,57 +1,420 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import logging
+import uuid
+from collections import deque
 from dataclasses import dataclass, field
 from fastapi import WebSocket
 
+from backend import events
+from backend.ws import codec
+from backend.services import permission_service
+
+logger = logging.getLogger(__name__)
+
+ACCESS_CHANNEL = "ws:access"
+
+
+SLOW_CONSUMER_POLICIES = ("disconnect", "resync")
+
+# Envelopes waiting for the publisher task before new ones are dropped
+PUBLISH_QUEUE_SIZE = 10000
+
+
+def room_channel(map_id: str) -> str:
+    return f"ws:room:{map_id}"
+
+
+@dataclass
+class Client:
+    client_id: str
+    ws: WebSocket
+    user_id: str
+    # Effective role on the room's map, resolved at connect time and kept
+    # current by access:changed events instead of per-message DB reads.
+    role: str | None = None
+    team_id: str | None = None
+    map_id: str = ""
+    # Outbound frames, drained by this connection's own writer task so one
+    # slow socket never blocks the room or the sender's receive loop.
+    queue: asyncio.Queue[str | bytes | None] = field(default_factory=asyncio.Queue)
+    writer: asyncio.Task | None = None
+    closed: bool = False
+    # Receive full node rows instead of field-level deltas for updates
+    full_rows: bool = False
+    # Wire format negotiated at connect time (see backend.ws.codec)
+    codec: str = codec.JSON
+
+    def can(self, permission: str) -> bool:
+        return self.role is not None and permission_service.has_permission(self.role, permission)
+
 
 @dataclass
 class Room:
     map_id: str
     version: int = 0
-    connections: dict[str, WebSocket] = field(default_factory=dict)
+    connections: dict[str, Client] = field(default_factory=dict)
+    # Recent versioned broadcasts as (version, message, full) for ?since=
+    # resume. Together they cover every version in (replay_from, version].
+    ops: deque = field(default_factory=deque)
+    replay_from: int = 0
+
+    def seed(self, version: int) -> None:
+        """Catch up with maps.version; changes the room never saw break coverage."""
+        if version > self.version:
+            self.version = version
+            self.ops.clear()
+            self.replay_from = version
+
+    def record(self, version: int, message: dict, full: dict | None, limit: int) -> None:
+        if version <= self.version:
+            # Late or out-of-order delivery: the buffer is no longer contiguous
+            self.ops.clear()
+            self.replay_from = self.version
+            return
+        if version != self.version + 1:
+            # Versions written without a broadcast (e.g. REST edits) left a gap
+            self.ops.clear()
+            self.replay_from = version - 1
+        self.version = version
+        if limit <= 0:
+            self.replay_from = version
+            return
+        self.ops.append((version, message, full))
+        while len(self.ops) > limit:
+            self.replay_from = self.ops.popleft()[0]
+
+    def can_replay(self, since: int) -> bool:
+        return self.replay_from <= since <= self.version
 
 
 class ConnectionManager:
-    def __init__(self):
+    """Tracks local WebSocket rooms and fans broadcasts out across workers.
+
+    Every broadcast is delivered to this worker's connections directly and,
+    when Redis fan-out is started, queued for a publisher task that sends
+    it on the map's channel in order, so senders never wait on Redis. Each
+    worker subscribes only to channels of maps it has local connections
+    for, and skips its own messages when they come back.
+    """
+
+    def __init__(
+        self, send_queue_size: int = 256, slow_consumer_policy: str = "disconnect", replay_buffer: int = 256,
+    ):
         self.rooms: dict[str, Room] = {}
         self._lock = asyncio.Lock()
+        self.worker_id = uuid.uuid4().hex
+        self._redis = None
+        self._pubsub = None
+        self._listener: asyncio.Task | None = None
+        self._outbox: asyncio.Queue[tuple[str, str] | None] | None = None
+        self._publisher: asyncio.Task | None = None
+        # Slow-consumer socket closes in flight, referenced until done
+        self._closing: set[asyncio.Task] = set()
+        self.configure(send_queue_size, slow_consumer_policy, replay_buffer)
+        # Metrics
+        self.dropped_messages = 0
+        self.evicted_clients = 0
+        self.resynced_clients = 0
+        self.resume_replays = 0
+        self.resume_fallbacks = 0
+        self.dropped_publishes = 0
+
+    def configure(self, send_queue_size: int, slow_consumer_policy: str, replay_buffer: int = 256) -> None:
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+        self.send_queue_size = max(1, send_queue_size)
+        self.slow_consumer_policy = slow_consumer_policy
+        self.replay_buffer = max(0, replay_buffer)
+
+    async def start(self, redis) -> None:
+        self._redis = redis
+        self._pubsub = redis.pubsub()
+        await self._pubsub.subscribe(ACCESS_CHANNEL)
+        for map_id in self.rooms:
+            await self._pubsub.subscribe(room_channel(map_id))
+        self._listener = asyncio.create_task(self._listen(), name="ws-fanout")
+        self._outbox = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._publisher = asyncio.create_task(self._publish_loop(self._outbox), name="ws-publisher")
+
+    async def stop(self) -> None:
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        if self._publisher is not None:
+            # Let queued envelopes go out before Redis is closed
+            try:
+                self._outbox.put_nowait(None)
+            except asyncio.QueueFull:
+                self._publisher.cancel()
+            try:
+                await asyncio.wait_for(self._publisher, 5.0)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                pass
+            self._publisher = None
+            self._outbox = None
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._redis = None
 
-    async def connect(self, map_id: str, client_id: str, ws: WebSocket) -> Room:
-        await ws.accept()
+    async def connect(
+        self, map_id: str, client: Client, subprotocol: str | None = None, version: int = 0,
+    ) -> Room:
+        """Accept the socket and join the room; ``version`` is the map's current maps.version."""
+        await client.ws.accept(subprotocol=subprotocol)
+        client.map_id = map_id
+        client.queue = asyncio.Queue(maxsize=self.send_queue_size)
+        client.writer = asyncio.create_task(self._write_loop(client), name=f"ws-writer-{client.client_id}")
         async with self._lock:
             if map_id not in self.rooms:
-                self.rooms[map_id] = Room(map_id=map_id)
+                self.rooms[map_id] = Room(map_id=map_id, version=version, replay_from=version)
+                if self._pubsub is not None:
+                    await self._pubsub.subscribe(room_channel(map_id))
             room = self.rooms[map_id]
-            room.connections[client_id] = ws
+            room.seed(version)
+            room.connections[client.client_id] = client
         return room
 
     async def disconnect(self, map_id: str, client_id: str):
         async with self._lock:
             room = self.rooms.get(map_id)
             if room:
-                room.connections.pop(client_id, None)
+                client = room.connections.pop(client_id, None)
+                if client is not None:
+                    self._close_writer(client)
                 if not room.connections:
                     del self.rooms[map_id]
+                    if self._pubsub is not None:
+                        await self._pubsub.unsubscribe(room_channel(map_id))
 
-    async def broadcast(self, room: Room, message: dict, exclude_client: str | None = None):
-        disconnected = []
-        for cid, ws in room.connections.items():
+    async def broadcast(
+        self, map_id: str, message: dict, exclude_client: str | None = None, full: dict | None = None,
+    ):
+        """Send ``message`` to the room; clients with ``full_rows`` get ``full`` instead when given."""
+        room = self.rooms.get(map_id)
+        if room is not None:
+            await self._deliver(room, message, exclude_client, full)
+        if self._outbox is not None:
+            envelope = {"origin": self.worker_id, "exclude": exclude_client, "message": message}
+            if full is not None:
+                envelope["full"] = full
+            self._publish(room_channel(map_id), json.dumps(envelope, default=str))
+
+    def _publish(self, channel: str, payload: str) -> None:
+        """Queue ``payload`` for the publisher task without waiting on Redis."""
+        try:
+            self._outbox.put_nowait((channel, payload))
+        except asyncio.QueueFull:
+            self.dropped_publishes += 1
+            logger.warning("Publish queue full, dropping message for %s", channel)
+
+    async def _publish_loop(self, outbox: asyncio.Queue) -> None:
+        while True:
+            item = await outbox.get()
+            if item is None:
+                return
+            channel, payload = item
+            try:
+                await self._redis.publish(channel, payload)
+            except Exception:
+                logger.exception("Failed to publish on %s", channel)
+
+    async def _deliver(
+        self, room: Room, message: dict, exclude_client: str | None = None, full: dict | None = None,
+    ):
+        version = message.get("version")
+        if isinstance(version, int):
+            room.record(version, message, full, self.replay_buffer)
+        # Encode once per (variant, codec) in use, not once per recipient
+        frames: dict[tuple[bool, str], str | bytes] = {}
+        for cid, client in list(room.connections.items()):
             if cid == exclude_client:
                 continue
+            use_full = full is not None and client.full_rows
+            key = (use_full, client.codec)
+            frame = frames.get(key)
+            if frame is None:
+                frame = frames[key] = codec.encode(client.codec, full if use_full else message)
+            self._enqueue(room, client, frame)
+
+    def replay(self, room: Room, client: Client, since: int) -> bool:
+        """Queue the room's buffered ops newer than ``since`` for ``client``.
+
+        Returns False when ``since`` is outside the buffer and the caller
+        must fall back to a DB delta. Runs without awaiting, so the replayed
+        ops are queued ahead of any broadcast that follows.
+        """
+        if not room.can_replay(since):
+            self.resume_fallbacks += 1
+            return False
+        self.resume_replays += 1
+        for version, message, full in room.ops:
+            if version > since:
+                self.send(client, full if full is not None and client.full_rows else message)
+        return True
+
+    def send(self, client: Client, message: dict) -> None:
+        """Queue a message for one client without waiting for the socket."""
+        self._enqueue(self.rooms.get(client.map_id), client, codec.encode(client.codec, message))
+
+    def _enqueue(self, room: Room | None, client: Client, frame: str | bytes) -> None:
+        if client.closed:
+            return
+        try:
+            client.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        self.dropped_messages += 1
+        if self.slow_consumer_policy == "resync" and room is not None:
+            # Discard the backlog; the client re-fetches state via /sync.
+            self.dropped_messages += client.queue.qsize()
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.queue.put_nowait(codec.encode(client.codec, {"type": "resync", "version": room.version}))
+            self.resynced_clients += 1
+            logger.info("Resyncing slow client %s", client.client_id)
+        else:
+            self.evicted_clients += 1
+            logger.info("Evicting slow client %s", client.client_id)
+            self._close_writer(client)
+            task = asyncio.create_task(self._close_socket(client, 4008, "Slow consumer"))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _write_loop(self, client: Client) -> None:
+        try:
+            while True:
+                frame = await client.queue.get()
+                if frame is None:
+                    break
+                if isinstance(frame, bytes):
+                    await client.ws.send_bytes(frame)
+                else:
+                    await client.ws.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            client.closed = True
+
+    def _close_writer(self, client: Client) -> None:
+        client.closed = True
+        if client.writer is None:
+            return
+        try:
+            client.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            client.writer.cancel()
+
+    @staticmethod
+    async def _close_socket(client: Client, code: int, reason: str) -> None:
+        try:
+            await client.ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _listen(self) -> None:
+        prefix = room_channel("")
+        while True:
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis fan-out listener error")
+                await asyncio.sleep(1.0)
+                continue
+            if not msg or msg.get("type") != "message":
+                continue
             try:
-                await ws.send_json(message)
+                envelope = json.loads(msg["data"])
+                if envelope.get("origin") == self.worker_id:
+                    continue
+                channel = msg["channel"]
+                if channel == ACCESS_CHANNEL:
+                    await self.refresh_access(**envelope["change"])
+                elif channel.startswith(prefix):
+                    room = self.rooms.get(channel[len(prefix):])
+                    if room is not None:
+                        await self._deliver(room, envelope["message"], envelope.get("exclude"), envelope.get("full"))
             except Exception:
-                disconnected.append(cid)
-        for cid in disconnected:
-            room.connections.pop(cid, None)
+                logger.exception("Failed to handle fan-out message")
 
     def get_room(self, map_id: str) -> Room | None:
         return self.rooms.get(map_id)
 
-    def next_version(self, room: Room) -> int:
-        room.version += 1
-        return room.version
+    async def on_locks_changed(
+        self, map_id: str, action: str | None = None, lock: dict | None = None,
+        locks: list[dict] | None = None, **_,
+    ) -> None:
+        """Relay a lock change to the map's room as lock:acquired/released/expired.
+
+        Batch changes go out as one message with ``data: {"locks": [...]}``.
+        """
+        if action is None:
+            return
+        data = {"locks": locks} if locks is not None else lock
+        await self.broadcast(map_id, {"type": f"lock:{action}", "data": data})
+
+    async def on_access_changed(self, **change) -> None:
+        await self.refresh_access(**change)
+        if self._outbox is not None:
+            self._publish(ACCESS_CHANNEL, json.dumps({"origin": self.worker_id, "change": change}))
+
+    async def refresh_access(
+        self,
+        map_id: str | None = None,
+        team_id: str | None = None,
+        user_id: str | None = None,
+    ) -> None:
+        """Re-resolve cached roles for connections affected by an access change.
+
+        Matches connections on the given map, or on maps of the given team,
+        optionally narrowed to one user. Connections that lost view access are
+        closed; others pick up their new role for subsequent messages.
+        """
+        if map_id is None and team_id is None:
+            return
+        for room in list(self.rooms.values()):
+            if map_id is not None and room.map_id != map_id:
+                continue
+            for client in list(room.connections.values()):
+                if team_id is not None and client.team_id != team_id:
+                    continue
+                if user_id is not None and client.user_id != user_id:
+                    continue
+                client.role, client.team_id = await permission_service.get_map_role(client.user_id, room.map_id)
+                if not client.can("view"):
+                    logger.info("Access revoked: map=%s user=%s", room.map_id, client.user_id)
+                    self._close_writer(client)
+                    await self._close_socket(client, 4003, "Access revoked")
+
+    def stats(self) -> dict:
+        clients = [c for room in self.rooms.values() for c in room.connections.values()]
+        return {
+            "rooms": len(self.rooms),
+            "clients": len(clients),
+            "queued_messages": sum(c.queue.qsize() for c in clients),
+            "dropped_messages": self.dropped_messages,
+            "evicted_clients": self.evicted_clients,
+            "resynced_clients": self.resynced_clients,
+            "buffered_ops": sum(len(room.ops) for room in self.rooms.values()),
+            "resume_replays": self.resume_replays,
+            "resume_fallbacks": self.resume_fallbacks,
+            "publish_queue": self._outbox.qsize() if self._outbox is not None else 0,
+            "dropped_publishes": self.dropped_publishes,
+        }
 
 
 manager = ConnectionManager()
+events.subscribe(events.ACCESS_CHANGED, manager.on_access_changed)
+events.subscribe(events.LOCKS_CHANGED, manager.on_locks_changed)
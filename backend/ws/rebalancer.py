@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from backend.services import node_service
+from backend.ws.actor import actors
+from backend.ws.manager import manager
+
+logger = logging.getLogger(__name__)
+
+
+class KeyRebalancer:
+    """Background task that respaces sibling lists whose order keys grew long.
+
+    Inserts only ever write the moved node, so a list that keeps growing at
+    one spot ends up with long keys. Every ``interval`` seconds the lists
+    node_service flagged are given short keys again, each under one version
+    on the map's actor, and the room gets one ``node:reorder`` with the new keys.
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.rebalanced = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="key-rebalancer")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for map_id, parent_id in node_service.take_crowded():
+                try:
+                    if await actors.run(map_id, lambda: self._rebalance(map_id, parent_id)):
+                        self.rebalanced += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Rebalancing order keys under %s in map %s failed", parent_id, map_id)
+
+    @staticmethod
+    async def _rebalance(map_id: str, parent_id: str) -> dict | None:
+        result = await node_service.rebalance_children(map_id, parent_id)
+        if result is not None:
+            await manager.broadcast(map_id, {
+                "type": "node:reorder",
+                "data": node_service.reorder_delta(result),
+                "version": result["version"],
+            })
+        return result
+
+    def stats(self) -> dict:
+        return {"rebalanced": self.rebalanced}
+
+
+rebalancer = KeyRebalancer()
@@ -0,0 +1,66 @@
+"""Subtree delete: per-node walk (previous implementation) vs recursive CTE.
+
+    python -m benchmarks.bench_delete_subtree
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+
+from backend.db import get_db
+from backend.services import node_service
+from benchmarks.common import Timer, create_tree, temp_database
+
+SIZES = [100, 1000, 5000, 20000]
+
+
+async def _legacy_delete(db, map_id: str, node_id: str) -> int:
+    """The old delete_node body: one SELECT per node to walk, one per node to snapshot."""
+    cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
+    row = await cursor.fetchone()
+    deleted_ids = [node_id]
+    queue = [node_id]
+    while queue:
+        pid = queue.pop()
+        cursor = await db.execute("SELECT id FROM nodes WHERE parent_id = ? AND map_id = ?", (pid, map_id))
+        for c in await cursor.fetchall():
+            deleted_ids.append(c["id"])
+            queue.append(c["id"])
+    subtree_nodes = []
+    for did in deleted_ids:
+        cursor = await db.execute("SELECT * FROM nodes WHERE id = ? AND map_id = ?", (did, map_id))
+        r = await cursor.fetchone()
+        if r:
+            subtree_nodes.append(dict(r))
+    ver = await node_service._bump_version(db, map_id)
+    for did in deleted_ids:
+        await db.execute(
+            "INSERT INTO change_log (map_id, version, action, node_id) VALUES (?, ?, 'delete', ?)",
+            (map_id, ver, did),
+        )
+    await node_service._record_history(
+        db, node_id, map_id, "delete", ver,
+        old_content=row["content"], snapshot=json.dumps(subtree_nodes, default=str),
+    )
+    await db.execute("DELETE FROM nodes WHERE id = ? AND map_id = ?", (node_id, map_id))
+    return len(deleted_ids)
+
+
+async def main() -> None:
+    print(f"{'nodes':>8} {'per-node walk ms':>18} {'recursive CTE ms':>18} {'speedup':>8}")
+    async with temp_database():
+        for size in SIZES:
+            map_id, root_id = await create_tree(size)
+            async with get_db() as db:
+                with Timer() as legacy:
+                    await _legacy_delete(db, map_id, root_id)
+                await db.rollback()
+                with Timer() as cte:
+                    result = await node_service._delete_subtree(db, map_id, root_id)
+                await db.rollback()
+            assert len(result["deleted_ids"]) == size
+            print(f"{size:>8} {legacy.ms:>18.1f} {cte.ms:>18.1f} {legacy.ms / cte.ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
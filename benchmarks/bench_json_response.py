@@ -0,0 +1,55 @@
+"""Serializing a large map load: FastAPI default path vs FastJSONResponse.
+
+    python -m benchmarks.bench_json_response
+
+The default path is what a route returning a plain dict pays:
+jsonable_encoder over the whole payload, then JSONResponse's json.dumps.
+FastJSONResponse returned directly skips jsonable_encoder and encodes with
+orjson when it is installed. Both must produce identical bytes.
+"""
+from __future__ import annotations
+
+import asyncio
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from backend import responses
+from backend.services import map_service
+from benchmarks.common import Timer, create_tree, temp_database
+
+SIZE = 50000
+ROUNDS = 5
+
+
+def _best(fn) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        with Timer() as t:
+            fn()
+        best = min(best, t.ms)
+    return best
+
+
+async def main() -> None:
+    async with temp_database():
+        map_id, _ = await create_tree(SIZE, content="节点")
+        payload = await map_service.get_map_with_nodes(map_id)
+    assert len(payload["nodes"]) == SIZE
+
+    baseline = JSONResponse(jsonable_encoder(payload)).body
+    fast = responses.FastJSONResponse(payload).body
+    assert fast == baseline, "FastJSONResponse output differs from JSONResponse"
+
+    encoder = "orjson" if responses.orjson is not None else "stdlib json (orjson not installed)"
+    print(f"{SIZE} nodes, {len(baseline) / 1e6:.1f} MB body, encoder: {encoder}")
+    default_ms = _best(lambda: JSONResponse(jsonable_encoder(payload)))
+    render_ms = _best(lambda: JSONResponse(payload))
+    fast_ms = _best(lambda: responses.FastJSONResponse(payload))
+    print(f"  jsonable_encoder + JSONResponse  {default_ms:>8.1f} ms")
+    print(f"  JSONResponse only               {render_ms:>8.1f} ms")
+    print(f"  FastJSONResponse                {fast_ms:>8.1f} ms  ({default_ms / fast_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""First paint of a large map: full load vs ?depth= / ?visible= partial loads.
+
+    python -m benchmarks.bench_lazy_load
+
+Every node at depth 2 is collapsed, so the visible part is the same three
+levels that depth=2 returns. Sizes are the JSON bodies.
+"""
+from __future__ import annotations
+
+import asyncio
+
+from backend.db import get_db
+from backend.responses import dumps
+from backend.services import map_service
+from benchmarks.common import Timer, create_tree, temp_database
+
+SIZE = 50000
+FANOUT = 8
+ROUNDS = 5
+
+
+async def _best(load) -> tuple[float, dict]:
+    best, result = float("inf"), None
+    for _ in range(ROUNDS):
+        with Timer() as t:
+            result = await load()
+        best = min(best, t.ms)
+    return best, result
+
+
+async def main() -> None:
+    async with temp_database():
+        map_id, _ = await create_tree(SIZE, fanout=FANOUT)
+        level2 = [i for i in range(SIZE) if 1 + FANOUT <= i < 1 + FANOUT + FANOUT ** 2]
+        async with get_db() as db:
+            cursor = await db.execute("SELECT id FROM nodes WHERE map_id = ? ORDER BY rowid", (map_id,))
+            ids = [r["id"] for r in await cursor.fetchall()]
+            await db.executemany("UPDATE nodes SET collapsed = 1 WHERE id = ?", [(ids[i],) for i in level2])
+            await db.commit()
+
+        print(f"{SIZE} nodes, fanout {FANOUT}")
+        print(f"  {'mode':<14} {'nodes':>7} {'body KB':>9} {'load ms':>9}")
+        for name, load in (
+            ("full", lambda: map_service.get_map_with_nodes(map_id)),
+            ("depth=2", lambda: map_service.get_map_partial(map_id, depth=2)),
+            ("visible", lambda: map_service.get_map_partial(map_id, visible_only=True)),
+        ):
+            ms, result = await _best(load)
+            print(f"  {name:<14} {len(result['nodes']):>7} {len(dumps(result)) / 1024:>9.1f} {ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""Reordering all children of a node: one move per child vs reorder_children.
+
+    python -m benchmarks.bench_reorder
+
+The per-child path is what a client did before: one update per sibling,
+each with its own SELECT, version, history row and commit. Both paths skip
+the Redis lock check.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+
+from backend.services import map_service, node_service
+from backend.write_queue import close_write_queue, init_write_queue
+from benchmarks.common import Timer, temp_database
+
+SIZES = [50, 200, 1000]
+
+
+async def _setup(size: int) -> tuple[str, str, list[str]]:
+    m = await map_service.create_map("bench")
+    ops = [{"op": "create", "parent_id": m["root_id"], "position": i} for i in range(size)]
+    result = await node_service.apply_batch(m["id"], ops)
+    children = [r["node"]["id"] for r in result["results"]]
+    random.shuffle(children)
+    return m["id"], m["root_id"], children
+
+
+async def _per_child(map_id: str, parent_id: str, ordered_ids: list[str]) -> None:
+    for i, node_id in enumerate(ordered_ids):
+        await node_service._write(
+            map_id, lambda db: node_service._apply_update(db, map_id, node_id, {"parent_id": parent_id, "position": i}),
+        )
+
+
+async def _bulk(map_id: str, parent_id: str, ordered_ids: list[str]) -> None:
+    await node_service._write(
+        map_id, lambda db: node_service._reorder(db, map_id, parent_id, ordered_ids, None, None),
+    )
+
+
+async def main() -> None:
+    print(f"{'children':>8} {'':>10} {'versions':>9} {'ms':>9}")
+    async with temp_database():
+        await init_write_queue()
+        try:
+            for size in SIZES:
+                for name, reorder in (("per child", _per_child), ("bulk", _bulk)):
+                    map_id, parent_id, ordered_ids = await _setup(size)
+                    start = await map_service.get_map_version(map_id)
+                    with Timer() as t:
+                        await reorder(map_id, parent_id, ordered_ids)
+                    versions = await map_service.get_map_version(map_id) - start
+                    print(f"{size:>8} {name:>10} {versions:>9} {t.ms:>9.1f}")
+        finally:
+            await close_write_queue()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Inserting into the middle of a sibling list: renumbered positions vs order keys.
+
+    python -m benchmarks.bench_sibling_insert
+
+With integer positions a client inserting at index i sends the create and
+then one versioned update per later sibling to shift its position. With
+order keys the client sends a key between its neighbours' keys and
+nothing else is written. Both runs insert the same random indexes into a list of
+SIBLINGS children through node_service's write path.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+
+from backend.db import get_db
+from backend.order_keys import key_between
+from backend.services import map_service, node_service
+from backend.write_queue import close_write_queue, init_write_queue
+from benchmarks.common import Timer, temp_database
+
+SIBLINGS = 200
+INSERTS = 20
+
+
+async def _fill(parent_id: str, map_id: str) -> list[tuple[str, str]]:
+    ops = [{"op": "create", "parent_id": parent_id, "position": i} for i in range(SIBLINGS)]
+    result = await node_service.apply_batch(map_id, ops)
+    return [(r["node"]["id"], r["node"]["order_key"]) for r in result["results"]]
+
+
+async def _renumbered(map_id: str, parent_id: str, children: list[tuple[str, str]], index: int) -> dict:
+    node = await node_service.create_node(map_id, parent_id, position=index)
+    for i, (node_id, _) in enumerate(children[index:], start=index + 1):
+        # update_node minus the Redis lock check
+        await node_service._write(map_id, lambda db: node_service._apply_update(db, map_id, node_id, {"position": i}))
+    return node
+
+
+async def _keyed(map_id: str, parent_id: str, children: list[tuple[str, str]], index: int) -> dict:
+    before = children[index - 1][1] if index else None
+    after = children[index][1] if index < len(children) else None
+    return await node_service.create_node(map_id, parent_id, order_key=key_between(before, after))
+
+
+async def _run(insert, indexes: list[int]) -> tuple[float, int, bool]:
+    """Returns (ms, versions written, whether the stored order matches the expected one)."""
+    m = await map_service.create_map("bench")
+    map_id, parent_id = m["id"], m["root_id"]
+    children = await _fill(parent_id, map_id)
+    start_version = await map_service.get_map_version(map_id)
+    with Timer() as t:
+        for index in indexes:
+            node = await insert(map_id, parent_id, children, index)
+            children.insert(index, (node["id"], node["order_key"]))
+    writes = await map_service.get_map_version(map_id) - start_version
+    async with get_db() as db:
+        cursor = await db.execute(
+            "SELECT id FROM nodes WHERE map_id = ? AND parent_id = ? ORDER BY order_key", (map_id, parent_id),
+        )
+        stored = [row["id"] for row in await cursor.fetchall()]
+    return t.ms, writes, stored == [node_id for node_id, _ in children]
+
+
+async def main() -> None:
+    indexes = [random.randrange(SIBLINGS + i) for i in range(INSERTS)]
+    print(f"{SIBLINGS} siblings, {INSERTS} inserts at random indexes")
+    print(f"{'mode':>12} {'versions':>9} {'total ms':>9} {'ms/insert':>10} {'order ok':>9}")
+    async with temp_database():
+        await init_write_queue()
+        try:
+            for name, insert in (("renumbered", _renumbered), ("order keys", _keyed)):
+                ms, writes, ok = await _run(insert, indexes)
+                print(f"{name:>12} {writes:>9} {ms:>9.1f} {ms / INSERTS:>10.2f} {str(ok):>9}")
+        finally:
+            await close_write_queue()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
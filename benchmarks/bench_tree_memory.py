@@ -0,0 +1,81 @@
+"""Memory of a loaded map: dict rows + dict-of-dicts tree vs NodeTree.
+
+    python -m benchmarks.bench_tree_memory
+
+The legacy path is what exports used to hold: ``dict(row)`` for every
+``SELECT *`` row plus the ``{**n, "children": []}`` copies made by the old
+``_build_tree``. The compact path is ``map_service.get_map_tree``: one
+NodeTree with interned ids, array columns and child slot lists. Retained is
+what stays allocated once the structure is built; peak includes the fetched
+rows. Measured with tracemalloc, which also slows the load times down.
+"""
+from __future__ import annotations
+
+import asyncio
+import gc
+import tracemalloc
+
+from backend.db import get_db
+from backend.services import map_service
+from benchmarks.common import Timer, create_tree, temp_database
+
+SIZES = [10000, 100000]
+
+
+def _legacy_build_tree(nodes: list[dict]) -> dict | None:
+    """The old export_service._build_tree."""
+    node_map = {n["id"]: {**n, "children": []} for n in nodes}
+    root = None
+    for n in nodes:
+        if n["parent_id"] is None:
+            root = node_map[n["id"]]
+        elif n["parent_id"] in node_map:
+            node_map[n["parent_id"]]["children"].append(node_map[n["id"]])
+    stack = [root] if root else []
+    while stack:
+        node = stack.pop()
+        node["children"].sort(key=lambda c: c.get("position", 0))
+        stack.extend(node["children"])
+    return root
+
+
+async def _legacy(map_id: str):
+    async with get_db() as db:
+        cursor = await db.execute("SELECT * FROM nodes WHERE map_id = ? ORDER BY position", (map_id,))
+        nodes = [dict(r) for r in await cursor.fetchall()]
+    for n in nodes:
+        n["collapsed"] = bool(n["collapsed"])
+    return nodes, _legacy_build_tree(nodes)
+
+
+async def _compact(map_id: str):
+    return await map_service.get_map_tree(map_id)
+
+
+async def _measure(load, map_id: str) -> tuple[float, float, float]:
+    gc.collect()
+    tracemalloc.start()
+    with Timer() as t:
+        kept = await load(map_id)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return retained / 1e6, peak / 1e6, t.ms
+
+
+async def main() -> None:
+    print(f"{'nodes':>8} {'':>10} {'retained MB':>12} {'peak MB':>9} {'B/node':>8} {'load ms':>9}")
+    async with temp_database():
+        for size in SIZES:
+            map_id, _ = await create_tree(size, content="节点")
+            _, tree = await _compact(map_id)
+            assert len(tree) == size
+            for name, load in (("dicts", _legacy), ("NodeTree", _compact)):
+                retained, peak, ms = await _measure(load, map_id)
+                print(f"{size:>8} {name:>10} {retained:>12.1f} {peak:>9.1f} {retained * 1e6 / size:>8.0f} {ms:>9.1f}")
+            print(f"{'':>8} NodeTree.memory() estimate: {tree.memory() / size:.0f} B/node")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
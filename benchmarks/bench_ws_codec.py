@@ -0,0 +1,96 @@
+"""WebSocket frame encoding: JSON text vs MessagePack binary (mindmap.msgpack.v1).
+
+    python -m benchmarks.bench_ws_codec
+
+Reports encode cost and bytes on the wire for a typical update delta and for
+bulk messages, plus the cost of fanning one message out to a room when it is
+encoded once per recipient (previous behaviour) vs once per codec.
+"""
+from __future__ import annotations
+
+import time
+import uuid
+from datetime import datetime, timezone
+
+from backend.ws import codec
+
+ROOM_SIZE = 50
+
+
+def _node(i: int, parent: str | None) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "map_id": str(uuid.uuid4()),
+        "parent_id": parent,
+        "content": f"节点 node {i}",
+        "position": i % 8,
+        "style": "{}",
+        "collapsed": False,
+        "version": 42,
+        "last_edited_by": str(uuid.uuid4()),
+        "last_edited_by_name": "alice",
+        "last_edited_at": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def _messages() -> dict[str, dict]:
+    root = _node(0, None)
+    return {
+        "update delta": {
+            "type": "node:update",
+            "data": {
+                "id": root["id"],
+                "changes": {"content": "hello world"},
+                "last_edited_by": root["last_edited_by"],
+                "last_edited_by_name": "alice",
+                "last_edited_at": root["last_edited_at"],
+            },
+            "version": 43,
+            "client_id": str(uuid.uuid4()),
+        },
+        "batch 500 creates": {
+            "type": "node:batch",
+            "data": {"results": [{"op": "create", "node": _node(i, root["id"])} for i in range(500)]},
+            "version": 44,
+        },
+        "restore 5000 nodes": {
+            "type": "node:restore",
+            "data": {"parent_id": root["id"], "nodes": [_node(i, root["id"]) for i in range(5000)]},
+            "version": 45,
+        },
+    }
+
+
+def _time_us(fn, message: dict, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(message)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    if codec.MSGPACK not in codec.ENCODERS:
+        print("msgpack is not installed; pip install msgpack to compare")
+        return
+    print(f"{'message':>20} {'json us':>10} {'msgpack us':>11} {'json B':>9} {'msgpack B':>10}")
+    for name, message in _messages().items():
+        repeat = 2000 if name == "update delta" else 20
+        json_us = _time_us(codec.encode_json, message, repeat)
+        msgpack_us = _time_us(codec.encode_msgpack, message, repeat)
+        json_bytes = len(codec.encode_json(message).encode())
+        msgpack_bytes = len(codec.encode_msgpack(message))
+        print(f"{name:>20} {json_us:>10.1f} {msgpack_us:>11.1f} {json_bytes:>9} {msgpack_bytes:>10}")
+
+    message = _messages()["batch 500 creates"]
+    per_recipient = _time_us(lambda m: [codec.encode_json(m) for _ in range(ROOM_SIZE)], message, 5)
+    once = _time_us(lambda m: (codec.encode_json(m), codec.encode_msgpack(m)), message, 5)
+    print(f"\nfan-out to {ROOM_SIZE} clients, batch 500 creates:")
+    print(f"  encode per recipient (json)   {per_recipient / 1000:>8.2f} ms")
+    print(f"  encode once per codec (both)  {once / 1000:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Shared setup for the standalone benchmarks.
+
+Run them from the repository root, e.g. ``python -m benchmarks.bench_delete_subtree``.
+They use a throwaway SQLite file and never touch ./data.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+from backend.db import close_pool, get_db, init_db, init_pool
+from backend.order_keys import spread_keys
+
+
+@asynccontextmanager
+async def temp_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        await init_pool(os.path.join(tmp, "bench.db"))
+        await init_db()
+        try:
+            yield
+        finally:
+            await close_pool()
+
+
+async def create_tree(size: int, fanout: int = 8, content: str = "node") -> tuple[str, str]:
+    """Insert a map with ``size`` nodes in a balanced tree. Returns (map_id, root_id)."""
+    map_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    ids = [str(uuid.uuid4()) for _ in range(size)]
+    keys = spread_keys(fanout)
+    rows = []
+    for i, node_id in enumerate(ids):
+        parent = ids[(i - 1) // fanout] if i else None
+        position = (i - 1) % fanout if i else 0
+        rows.append((node_id, map_id, parent, f"{content} {i}", position, keys[position], now, now))
+    async with get_db() as db:
+        await db.execute(
+            "INSERT INTO maps (id, name, version, created_at, updated_at) VALUES (?, 'bench', 0, ?, ?)",
+            (map_id, now, now),
+        )
+        await db.executemany(
+            """INSERT INTO nodes (id, map_id, parent_id, content, position, order_key, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            rows,
+        )
+        await db.commit()
+    return map_id, ids[0]
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
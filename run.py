@@ -13,6 +13,7 @@ uvicorn.run(
     factory=True,
     host="0.0.0.0",
     port=config.port,
+    workers=config.workers,
     reload=False,
     log_level="info",
 )
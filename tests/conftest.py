@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+import backend.redis_client as redis_client
+from backend.app import create_app
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("MINDMAP_DATABASE", str(tmp_path / "app.db"))
+    monkeypatch.setenv("MINDMAP_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        redis_client.aioredis, "from_url",
+        lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs),
+    )
+    with TestClient(create_app()) as c:
+        yield c
+
+
+@pytest.fixture
+def map_and_token(client):
+    r = client.post("/api/auth/register", json={"username": "alice", "email": "a@x.io", "password": "secret1"})
+    token = r.json()["access_token"]
+    m = client.post("/api/maps", json={"name": "M"}, headers={"Authorization": f"Bearer {token}"}).json()
+    return m, token
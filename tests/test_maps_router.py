@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import pytest
+from starlette.requests import Request
+
+from backend.routers.maps import _accepts_gzip
+
+
+def _request(accept_encoding: str) -> Request:
+    return Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("br, gzip;q=0.5", True),
+    ("*", True),
+    ("", False),
+    ("identity", False),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, deflate", False),
+    ("br, *;q=0", False),
+    ("*, gzip;q=0", False),
+])
+def test_accepts_gzip_honours_q_values(header, expected):
+    assert _accepts_gzip(_request(header)) is expected
+
+
+def test_map_etag_depends_on_the_content_encoding(client, map_and_token):
+    m, token = map_and_token
+    auth = {"Authorization": f"Bearer {token}"}
+    url = f"/api/maps/{m['id']}"
+    zipped = client.get(url, headers={**auth, "Accept-Encoding": "gzip"})
+    plain = client.get(url, headers={**auth, "Accept-Encoding": "identity"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in plain.headers
+    assert zipped.headers["etag"] != plain.headers["etag"]
+
+    # Each tag only revalidates its own encoding, and the 304 keeps Vary
+    r = client.get(url, headers={**auth, "Accept-Encoding": "gzip", "If-None-Match": zipped.headers["etag"]})
+    assert r.status_code == 304
+    assert r.headers["vary"] == "Accept-Encoding"
+    r = client.get(url, headers={**auth, "Accept-Encoding": "identity", "If-None-Match": zipped.headers["etag"]})
+    assert r.status_code == 200
+    assert r.json()["id"] == m["id"]
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import asyncio
+
+import fakeredis
+import pytest
+
+from backend.notifier import ChangeNotifier
+
+
+class SlowRedis(fakeredis.aioredis.FakeRedis):
+    async def publish(self, channel, message):
+        await asyncio.sleep(0.5)
+        return await super().publish(channel, message)
+
+
+@pytest.mark.anyio
+async def test_on_change_does_not_wait_for_redis_and_wakes_other_workers():
+    server = fakeredis.FakeServer()
+    writer, reader = ChangeNotifier(), ChangeNotifier()
+    await writer.start(SlowRedis(server=server, decode_responses=True))
+    await reader.start(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    try:
+        local, remote = writer.watch("m1"), reader.watch("m1")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await writer.on_change(map_id="m1", result={"version": 1})
+        assert loop.time() - start < 0.2
+        assert local.is_set()
+        await asyncio.wait_for(remote.wait(), 5)
+    finally:
+        await writer.stop()
+        await reader.stop()
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from fastapi.responses import JSONResponse
+
+from backend.responses import FastJSONResponse
+
+NODE = {
+    "id": "6f1c2d3e-0000-4000-8000-000000000001",
+    "map_id": "m1",
+    "parent_id": None,
+    "content": "中文 \"quoted\" \\ tab\t emoji 🙂  ",
+    "position": 3,
+    "order_key": "V8",
+    "style": '{"color":"#fff"}',
+    "version": 2**40,
+    "collapsed": False,
+    "last_edited_at": "2026-01-01T00:00:00+00:00",
+}
+
+
+def test_node_payloads_render_like_json_response():
+    payload = {"id": "m1", "name": "地图", "version": 7, "nodes": [NODE, {**NODE, "parent_id": NODE["id"]}], "locks": {}}
+    assert FastJSONResponse(payload).body == JSONResponse(payload).body
+    assert FastJSONResponse([payload, []]).body == JSONResponse([payload, []]).body
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from backend.db import close_pool, init_pool
+from backend.write_queue import WriteQueue
+
+
+@pytest.fixture
+async def queue(tmp_path):
+    path = str(tmp_path / "wq.db")
+    await init_pool(path, size=1, busy_timeout=200)
+    q = WriteQueue(batch_window_ms=0)
+    await q.start()
+    try:
+        yield q, path
+    finally:
+        await q.stop()
+        await close_pool()
+
+
+async def _create(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+
+
+async def _insert(db):
+    await db.execute("INSERT INTO t (x) VALUES (1)")
+    return "ok"
+
+
+@pytest.mark.anyio
+async def test_jobs_commit(queue):
+    q, _ = queue
+    await q.submit(_create)
+    assert await q.submit(_insert) == "ok"
+
+
+@pytest.mark.anyio
+async def test_locked_database_fails_the_batch_instead_of_hanging(queue):
+    q, path = queue
+    await q.submit(_create)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            await asyncio.wait_for(q.submit(_insert), 5)
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    # The writer keeps working once the lock is gone
+    assert await asyncio.wait_for(q.submit(_insert), 5) == "ok"
+    assert q.stats()["failed_jobs"] == 1
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import msgpack
+import pytest
+
+from backend.ws import codec
+
+
+def _receive_until(receive, msg_type):
+    while True:
+        message = receive()
+        if message["type"] in (msg_type, "error"):
+            return message
+
+
+def test_json_client(client, map_and_token):
+    m, token = map_and_token
+    with client.websocket_connect(f"/ws/{m['id']}?token={token}") as ws:
+        assert ws.receive_json()["type"] == "connected"
+        ws.send_json({"type": "node:create", "data": {"parent_id": m["root_id"], "content": "中文"}})
+        ack = _receive_until(ws.receive_json, "ack")
+        assert ack["original_type"] == "node:create"
+        assert ack["data"]["content"] == "中文"
+
+        ws.send_text("{not json")
+        assert ws.receive_json() == {"type": "error", "message": "Malformed message"}
+
+
+def test_msgpack_client_accepts_binary_and_text_frames(client, map_and_token):
+    m, token = map_and_token
+
+    def receive():
+        return msgpack.unpackb(ws.receive_bytes(), raw=False)
+
+    with client.websocket_connect(f"/ws/{m['id']}?token={token}", subprotocols=[codec.MSGPACK_SUBPROTOCOL]) as ws:
+        assert receive()["type"] == "connected"
+        ws.send_bytes(msgpack.packb({"type": "node:create", "data": {"parent_id": m["root_id"], "content": "bin"}}))
+        ack = _receive_until(receive, "ack")
+        assert ack["data"]["content"] == "bin"
+
+        # A JSON text frame from a msgpack client is decoded as JSON, not dropped
+        ws.send_json({"type": "node:update", "data": {"id": ack["data"]["id"], "changes": {"content": "text"}}})
+        ack = _receive_until(receive, "ack")
+        assert ack["original_type"] == "node:update"
+        assert ack["data"]["content"] == "text"
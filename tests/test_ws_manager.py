@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio
+
+import fakeredis
+import pytest
+
+from backend.ws.manager import Client, ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = asyncio.Queue()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.frames.put_nowait(frame)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+class SlowRedis(fakeredis.aioredis.FakeRedis):
+    async def publish(self, channel, message):
+        await asyncio.sleep(0.5)
+        return await super().publish(channel, message)
+
+
+@pytest.mark.anyio
+async def test_broadcast_does_not_wait_for_redis_and_reaches_other_workers():
+    server = fakeredis.FakeServer()
+    sender, receiver = ConnectionManager(), ConnectionManager()
+    await sender.start(SlowRedis(server=server, decode_responses=True))
+    await receiver.start(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    ws = FakeSocket()
+    await receiver.connect("m1", Client(client_id="c1", ws=ws, user_id="u1"))
+    try:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await sender.broadcast("m1", {"type": "node:update", "data": {"id": "n1"}, "version": 1})
+        await sender.broadcast("m1", {"type": "node:update", "data": {"id": "n2"}, "version": 2})
+        assert loop.time() - start < 0.2
+        assert sender.stats()["publish_queue"] >= 1
+
+        first = await asyncio.wait_for(ws.frames.get(), 5)
+        second = await asyncio.wait_for(ws.frames.get(), 5)
+        assert '"n1"' in first and '"n2"' in second
+    finally:
+        await receiver.disconnect("m1", "c1")
+        await sender.stop()
+        await receiver.stop()
+
+
+class StuckSocket(FakeSocket):
+    def __init__(self):
+        super().__init__()
+        self.closed_with = None
+
+    async def send_text(self, frame):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+@pytest.mark.anyio
+async def test_slow_consumer_is_closed_and_its_close_task_tracked():
+    manager = ConnectionManager(send_queue_size=1)
+    ws = StuckSocket()
+    await manager.connect("m1", Client(client_id="c1", ws=ws, user_id="u1"))
+    for i in range(3):
+        await manager.broadcast("m1", {"type": "node:update", "data": {"id": f"n{i}"}})
+    assert manager.evicted_clients == 1
+    assert len(manager._closing) == 1
+    await manager.stop()
+    assert ws.closed_with == 4008
+    assert not manager._closing
+    await manager.disconnect("m1", "c1")